@@ -0,0 +1,294 @@
+"""Admission control: rate limits and load shedding in front of the API.
+
+Every request is checked, in order, against the overload signals (event
+loop lag and requests in flight), then its user's token bucket for the
+route, then the route's shared bucket and finally one bucket for the whole
+API. A user over their own limit gets 429; anything that means the server
+as a whole is busy gets 503, and gives back the tokens the request took
+from the earlier buckets. Both carry Retry-After, and are answered before
+the request reaches the handlers and their Mongo round trips.
+"""
+import asyncio
+import json
+import math
+import time
+from dataclasses import dataclass, fields, replace
+from typing import Dict, Optional, Tuple
+
+from metrics import MetricsRegistry, route_template
+
+
+@dataclass(frozen=True, slots=True)
+class RouteLimit:
+    """Token bucket sizes for a route, in requests per second; None is unlimited"""
+    user_rate: Optional[float] = 20.0
+    user_burst: Optional[int] = 40
+    global_rate: Optional[float] = None
+    global_burst: Optional[int] = None
+
+
+# Limits for routes not listed in ROUTE_LIMITS
+DEFAULT_LIMIT = RouteLimit()
+
+# Writes fan out to several Mongo operations, so they get tighter limits
+ROUTE_LIMITS: Dict[str, RouteLimit] = {
+    "POST /api/shop/buy": RouteLimit(5, 10, 500, 1000),
+    "POST /api/shop/sell": RouteLimit(5, 10, 500, 1000),
+    "POST /api/shop/cart/buy": RouteLimit(2, 5, 200, 400),
+    "POST /api/shop/cart/sell": RouteLimit(2, 5, 200, 400),
+    "POST /api/inventory/{user_id}/use": RouteLimit(5, 10, 500, 1000),
+    "POST /api/inventory/{user_id}/equip": RouteLimit(5, 10, 500, 1000),
+    "POST /api/quests/{user_id}/complete/{quest_id}": RouteLimit(2, 5, 200, 400),
+    "PUT /api/character/{user_id}": RouteLimit(5, 10, 500, 1000),
+    "POST /api/battle/start": RouteLimit(2, 5, 200, 400),
+    "POST /api/battle/action": RouteLimit(10, 20, 1000, 2000),
+}
+
+# Never limited or shed, so the server can still be observed under load
+EXEMPT_ROUTES = frozenset({"GET /metrics", "GET /api/"})
+
+
+def parse_route_limits(config: Optional[str]) -> Dict[str, RouteLimit]:
+    """ROUTE_LIMITS with overrides from a JSON object of route -> {field: value}"""
+    limits = dict(ROUTE_LIMITS)
+    if not config:
+        return limits
+    names = {field.name for field in fields(RouteLimit)}
+    for route, overrides in json.loads(config).items():
+        unknown = set(overrides) - names
+        if unknown:
+            raise ValueError(f"Unknown limit fields for {route}: {', '.join(sorted(unknown))}")
+        limits[route] = replace(limits.get(route, DEFAULT_LIMIT), **overrides)
+    return limits
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated")
+
+    def __init__(self, rate: float, burst: int, now: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self, now: float) -> float:
+        """Take a token; returns 0 if one was free, else seconds until one is"""
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        """Give back a token taken for a request that was then refused"""
+        self.tokens = min(self.burst, self.tokens + 1)
+
+    def full(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.burst
+
+
+class AdmissionController:
+    """Decides whether a request is served now, and when to retry if not.
+
+    Loop lag is sampled by a background task every ``lag_interval``
+    seconds; a sample above ``max_loop_lag`` means requests already wait
+    too long for the loop, so new ones are shed until it recovers. Per-user
+    buckets are dropped again once they have refilled, when there are more
+    than ``max_users`` of them.
+    """
+
+    def __init__(self, route_limits: Optional[Dict[str, RouteLimit]] = None,
+                 global_rate: Optional[float] = 2000.0, global_burst: Optional[int] = 4000,
+                 max_in_flight: int = 500, max_loop_lag: float = 0.25,
+                 lag_interval: float = 0.05, max_users: int = 10000):
+        self.enabled = True
+        self.route_limits = ROUTE_LIMITS if route_limits is None else route_limits
+        self.max_in_flight = max_in_flight
+        self.max_loop_lag = max_loop_lag
+        self.lag_interval = lag_interval
+        self.max_users = max_users
+
+        self.in_flight = 0
+        self.loop_lag = 0.0
+
+        self._global = TokenBucket(global_rate, global_burst, time.monotonic()) if global_rate else None
+        self._route_buckets: Dict[str, TokenBucket] = {}
+        self._user_buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._evict_at = max_users
+        self._task: Optional[asyncio.Task] = None
+
+    def limit(self, route: str) -> RouteLimit:
+        return self.route_limits.get(route, DEFAULT_LIMIT)
+
+    def needs_user(self, route: str) -> bool:
+        return route not in EXEMPT_ROUTES and self.limit(route).user_rate is not None
+
+    def admit(self, route: str, user: Optional[str]) -> Optional[Tuple[int, str, float]]:
+        """None to serve the request, else (status, reason, retry after in seconds)"""
+        if not self.enabled or route in EXEMPT_ROUTES:
+            return None
+        if self.loop_lag > self.max_loop_lag:
+            return 503, "loop_lag", 1.0
+        if self.in_flight >= self.max_in_flight:
+            return 503, "in_flight", 1.0
+
+        now = time.monotonic()
+        limit = self.limit(route)
+        # Tokens taken so far, given back if a later bucket refuses the request
+        taken = []
+        if limit.user_rate is not None and user is not None:
+            bucket = self._user_bucket(route, user, limit, now)
+            wait = bucket.take(now)
+            if wait:
+                return 429, "user", wait
+            taken.append(bucket)
+        if limit.global_rate is not None:
+            bucket = self._route_buckets.get(route)
+            if bucket is None:
+                bucket = self._route_buckets[route] = TokenBucket(limit.global_rate, limit.global_burst, now)
+            wait = bucket.take(now)
+            if wait:
+                return self._refuse(taken, "route", wait)
+            taken.append(bucket)
+        if self._global is not None:
+            wait = self._global.take(now)
+            if wait:
+                return self._refuse(taken, "global", wait)
+        return None
+
+    @staticmethod
+    def _refuse(taken, reason: str, wait: float) -> Tuple[int, str, float]:
+        """Shed for an exhausted shared bucket; a server-side refusal must not use up the user's quota"""
+        for bucket in taken:
+            bucket.refund()
+        return 503, reason, wait
+
+    def _user_bucket(self, route: str, user: str, limit: RouteLimit, now: float) -> TokenBucket:
+        bucket = self._user_buckets.get((route, user))
+        if bucket is None:
+            if len(self._user_buckets) >= self._evict_at:
+                # A full bucket behaves exactly like a new one, so dropping it loses nothing
+                for key in [key for key, b in self._user_buckets.items() if b.full(now)]:
+                    del self._user_buckets[key]
+                self._evict_at = max(self.max_users, 2 * len(self._user_buckets))
+            bucket = self._user_buckets[(route, user)] = TokenBucket(limit.user_rate, limit.user_burst, now)
+        return bucket
+
+    async def _lag_loop(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(self.lag_interval)
+            self.loop_lag = max(0.0, loop.time() - started - self.lag_interval)
+
+    def start(self):
+        """Start sampling event loop lag"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._lag_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        self.loop_lag = 0.0
+
+
+class AdmissionMiddleware:
+    """ASGI middleware applying an AdmissionController to HTTP requests.
+
+    The route template is resolved the way the router will resolve it, and
+    left in ``scope["route_template"]`` so metrics label shed requests by
+    route too. The user is the ``user_id`` path parameter, else the ``userId`` field of a
+    JSON body. Requests naming no user only count against the shared
+    buckets: behind the ingress every client has the same address.
+    """
+
+    def __init__(self, app, controller: AdmissionController, registry: Optional[MetricsRegistry] = None):
+        self.app = app
+        self.controller = controller
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.controller.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        template, path_params = route_template(scope)
+        if template is not None:
+            scope["route_template"] = template
+        route = f"{scope['method']} {template or 'unmatched'}"
+        user = path_params.get("user_id")
+        if user is None and scope["method"] in ("POST", "PUT", "PATCH") and self.controller.needs_user(route):
+            user, receive = await self._user_from_body(receive)
+
+        decision = self.controller.admit(route, user)
+        if decision is not None:
+            status, reason, retry_after = decision
+            if self.registry is not None:
+                self.registry.request_shed(route, reason)
+            await self._reject(send, status, retry_after)
+            return
+
+        self.controller.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.controller.in_flight -= 1
+
+    @staticmethod
+    async def _user_from_body(receive):
+        """userId from a JSON body, and a receive that replays the body"""
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] != "http.request":
+                # Client went away; hand the disconnect on
+                async def disconnected():
+                    return message
+                return None, disconnected
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        body = b"".join(chunks)
+
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        user = None
+        try:
+            payload = json.loads(body)
+            if isinstance(payload, dict) and isinstance(payload.get("userId"), str):
+                user = payload["userId"]
+        except ValueError:
+            pass
+        return user, replay
+
+    @staticmethod
+    async def _reject(send, status: int, retry_after: float):
+        detail = "Too many requests" if status == 429 else "Server busy, try again later"
+        body = json.dumps({"detail": detail}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(max(1, math.ceil(retry_after))).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
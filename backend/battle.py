@@ -0,0 +1,200 @@
+import asyncio
+import random
+import time
+import uuid
+from typing import Dict, Optional
+
+from models import Battle, BattleActionResponse, Character, Enemy
+from stats import effective_strength
+
+# Combat rules, kept in line with the original client-side rolls
+PLAYER_BASE_DAMAGE = 10
+PLAYER_DEFENSE = 10
+ENEMY_BASE_DAMAGE = 5
+MAGIC_BASE_DAMAGE = 15
+MAGIC_MANA_COST = 10
+
+BATTLE_ACTIONS = ("attack", "defend", "magic")
+
+
+def roll_player_damage(rng: random.Random, strength: int, enemy_defense: int) -> int:
+    """Physical attack damage against an enemy"""
+    base_damage = rng.randrange(max(1, strength)) + PLAYER_BASE_DAMAGE
+    return max(1, base_damage - enemy_defense)
+
+
+def roll_magic_damage(rng: random.Random, intelligence: int, enemy_defense: int) -> int:
+    """Spell damage, which only half of the enemy's defense applies to"""
+    base_damage = rng.randrange(max(1, intelligence)) + MAGIC_BASE_DAMAGE
+    return max(1, base_damage - enemy_defense // 2)
+
+
+def roll_enemy_damage(rng: random.Random, attack: int, defending: bool = False) -> int:
+    """Enemy attack damage against the player"""
+    damage = max(1, rng.randrange(max(1, attack)) + ENEMY_BASE_DAMAGE - PLAYER_DEFENSE)
+    return max(1, damage // 2) if defending else damage
+
+
+class BattleSession:
+    """A running battle plus the combat stats it needs"""
+
+    def __init__(self, battle: Battle, enemy: Enemy, character: Character):
+        self.battle = battle
+        self.enemy = enemy
+        self.strength = effective_strength(character)
+        self.intelligence = character.stats.intelligence
+        self.mana = character.mana
+        self.last_active = time.monotonic()
+
+    @classmethod
+    def start(cls, character: Character, enemy: Enemy) -> "BattleSession":
+        battle = Battle(
+            id=f"battle_{uuid.uuid4().hex}",
+            userId=character.id,
+            enemyId=enemy.id,
+            playerHealth=character.health,
+            enemyHealth=enemy.health,
+            battleLog=[f"Harc kezdődik {enemy.name} ellen!"]
+        )
+        return cls(battle, enemy, character)
+
+    def act(self, action: str, rng: random.Random) -> BattleActionResponse:
+        """Resolve the player's action and the enemy's reply"""
+        battle = self.battle
+        if battle.battleEnded:
+            raise ValueError("Battle already ended")
+        if action not in BATTLE_ACTIONS:
+            raise ValueError(f"Unknown action: {action}")
+        if action == "magic" and self.mana < MAGIC_MANA_COST:
+            raise ValueError("Not enough mana")
+
+        self.last_active = time.monotonic()
+        messages = []
+
+        # Player turn
+        defending = action == "defend"
+        if action == "attack":
+            damage = roll_player_damage(rng, self.strength, self.enemy.defense)
+            battle.enemyHealth = max(0, battle.enemyHealth - damage)
+            messages.append(f"{damage} sebzést okozol!")
+        elif action == "magic":
+            self.mana -= MAGIC_MANA_COST
+            damage = roll_magic_damage(rng, self.intelligence, self.enemy.defense)
+            battle.enemyHealth = max(0, battle.enemyHealth - damage)
+            messages.append(f"Varázslat: {damage} sebzést okozol!")
+        else:
+            messages.append("Védekező állásba helyezkedsz!")
+
+        if battle.enemyHealth == 0:
+            battle.battleEnded = True
+            battle.victory = True
+            messages.append(f"{self.enemy.name} legyőzve!")
+        else:
+            # Enemy turn
+            damage = roll_enemy_damage(rng, self.enemy.attack, defending)
+            battle.playerHealth = max(0, battle.playerHealth - damage)
+            messages.append(f"{self.enemy.name} {damage} sebzést okoz!")
+            if battle.playerHealth == 0:
+                battle.battleEnded = True
+                messages.append("Vereség!")
+
+        battle.isPlayerTurn = not battle.battleEnded
+        battle.battleLog.extend(messages)
+
+        rewards = None
+        if battle.victory:
+            rewards = {"experience": self.enemy.experience, "gold": self.enemy.goldReward}
+
+        return BattleActionResponse(
+            battleId=battle.id,
+            playerHealth=battle.playerHealth,
+            enemyHealth=battle.enemyHealth,
+            isPlayerTurn=battle.isPlayerTurn,
+            battleEnded=battle.battleEnded,
+            victory=battle.victory,
+            message=" ".join(messages),
+            rewards=rewards
+        )
+
+
+class BattleStore:
+    """In-memory battle sessions with write-behind persistence.
+
+    Actions only touch memory; changed battles are flushed to storage in
+    one batch every ``flush_interval`` seconds, and once
+    more on shutdown. Finished and idle battles are dropped from memory
+    after they have been flushed. Sessions live in this process, so a
+    deployment with several workers needs sticky routing per battle.
+    """
+
+    def __init__(self, db, flush_interval: float = 5.0, idle_timeout: float = 1800.0):
+        self.db = db
+        self.flush_interval = flush_interval
+        self.idle_timeout = idle_timeout
+
+        self._sessions: Dict[str, BattleSession] = {}
+        self._dirty = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def add(self, session: BattleSession):
+        """Register a new battle"""
+        self._sessions[session.battle.id] = session
+        self._dirty.add(session.battle.id)
+
+    def get(self, battle_id: str) -> Optional[BattleSession]:
+        """Get a running battle held in memory"""
+        return self._sessions.get(battle_id)
+
+    def mark_dirty(self, battle_id: str):
+        """Queue a battle for the next flush"""
+        self._dirty.add(battle_id)
+
+    async def load(self, battle_id: str) -> Optional[Battle]:
+        """Get a battle from memory, or from the database once evicted"""
+        session = self._sessions.get(battle_id)
+        if session:
+            return session.battle
+        return await self.db.load_battle(battle_id)
+
+    async def flush(self):
+        """Write all changed battles and evict finished or idle ones"""
+        dirty, self._dirty = self._dirty, set()
+        battles = [self._sessions[battle_id].battle for battle_id in dirty if battle_id in self._sessions]
+        if battles:
+            try:
+                await self.db.save_battles(battles)
+            except Exception:
+                # Keep them queued for the next attempt
+                self._dirty |= dirty
+                raise
+
+        now = time.monotonic()
+        for battle_id, session in list(self._sessions.items()):
+            if battle_id in self._dirty:
+                continue
+            if session.battle.battleEnded or now - session.last_active > self.idle_timeout:
+                del self._sessions[battle_id]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing battles: {e}")
+
+    def start(self):
+        """Start the periodic flush task"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the flush task and write out everything pending"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -0,0 +1,304 @@
+"""HTTP load-testing benchmark for the game API.
+
+Starts the server.py app in-process, drives concurrent scripted player
+sessions through the /api routes and reports throughput and p50/p95/p99
+latency per route. Results are written as JSON so runs can be compared:
+
+    python benchmark.py --players 50 --duration 30 --output run.json
+    python benchmark.py --output new.json --baseline run.json
+
+By default the app runs against mongomock-motor, an in-process Mongo
+stand-in; pass --mongo-url to benchmark against a real server instead, or
+--memory to use the in-memory storage backend.
+
+Sessions share one event loop, so a request that suspends (anything using
+asyncio.gather) is timed across whatever the other sessions run meanwhile.
+Each session yields before every request, and --think-ms adds a pause, so
+compare runs made with the same player count and think time.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+
+import server
+
+SHOP_ITEMS = ["item_5", "item_6", "item_7", "item_8", "item_9", "item_10"]
+EQUIPPABLE_ITEMS = ["item_1", "item_2", "item_3", "item_4", "item_5", "item_8", "item_9"]
+
+# Relative weight of each scripted action in a player session
+ACTION_WEIGHTS = {
+    "bootstrap": 2,
+    "character": 10,
+    "inventory": 8,
+    "inventory_page": 3,
+    "quests": 4,
+    "quests_page": 2,
+    "enemies": 4,
+    "shop_items": 4,
+    "update_character": 2,
+    "buy": 6,
+    "sell": 3,
+    "cart": 2,
+    "cart_sell": 1,
+    "use": 6,
+    "equip": 3,
+    "battle": 6,
+    "complete_quest": 1,
+    "leaderboard": 2,
+}
+
+# A regression is flagged when p95 grows by more than this fraction
+REGRESSION_THRESHOLD = 0.2
+
+
+class Recorder:
+    """Collects latencies and status codes per route"""
+
+    def __init__(self, think_time: float = 0.0):
+        self.think_time = think_time
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Dict[int, int]] = defaultdict(lambda: defaultdict(int))
+
+    async def call(self, client: httpx.AsyncClient, method: str, route: str, url: str, **kwargs):
+        # In-process requests that never suspend would otherwise run back to back, and any
+        # route that does suspend would be timed across the other sessions' requests
+        await asyncio.sleep(self.think_time)
+        start = time.perf_counter()
+        response = await client.request(method, url, **kwargs)
+        self.latencies[f"{method} {route}"].append((time.perf_counter() - start) * 1000)
+        self.statuses[f"{method} {route}"][response.status_code] += 1
+        return response
+
+
+def percentile(sorted_values: List[float], fraction: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def player_session(client: httpx.AsyncClient, recorder: Recorder, user_id: str,
+                         deadline: float, rng: random.Random):
+    """Play one scripted player until the deadline"""
+    actions = list(ACTION_WEIGHTS)
+    weights = list(ACTION_WEIGHTS.values())
+    call = recorder.call
+
+    await call(client, "GET", "/api/bootstrap/{user_id}", f"/api/bootstrap/{user_id}")
+    while time.perf_counter() < deadline:
+        action = rng.choices(actions, weights)[0]
+        if action == "bootstrap":
+            await call(client, "GET", "/api/bootstrap/{user_id}", f"/api/bootstrap/{user_id}")
+        elif action == "character":
+            await call(client, "GET", "/api/character/{user_id}", f"/api/character/{user_id}")
+        elif action == "inventory":
+            await call(client, "GET", "/api/inventory/{user_id}", f"/api/inventory/{user_id}")
+        elif action == "inventory_page":
+            params = {"limit": 3, "type": rng.choice(["consumable", "weapon", "armor"])}
+            response = await call(client, "GET", "/api/inventory/{user_id}?limit&type",
+                                  f"/api/inventory/{user_id}", params=params)
+            cursor = response.headers.get("x-next-cursor")
+            if cursor:
+                await call(client, "GET", "/api/inventory/{user_id}?limit&type",
+                           f"/api/inventory/{user_id}", params={**params, "cursor": cursor})
+        elif action == "quests":
+            await call(client, "GET", "/api/quests/{user_id}", f"/api/quests/{user_id}")
+        elif action == "quests_page":
+            await call(client, "GET", "/api/quests/{user_id}?active&fields",
+                       f"/api/quests/{user_id}", params={"active": "true", "fields": "questId,progress", "limit": 10})
+        elif action == "enemies":
+            await call(client, "GET", "/api/enemies", "/api/enemies")
+        elif action == "shop_items":
+            await call(client, "GET", "/api/shop/items", "/api/shop/items")
+        elif action == "update_character":
+            await call(client, "PUT", "/api/character/{user_id}", f"/api/character/{user_id}",
+                       json={"health": rng.randint(50, 100)})
+        elif action == "buy":
+            await call(client, "POST", "/api/shop/buy", "/api/shop/buy",
+                       json={"userId": user_id, "itemId": rng.choice(["item_6", "item_7"]), "quantity": 1})
+        elif action == "sell":
+            await call(client, "POST", "/api/shop/sell", "/api/shop/sell",
+                       json={"userId": user_id, "itemId": rng.choice(SHOP_ITEMS), "quantity": 1})
+        elif action == "cart":
+            await call(client, "POST", "/api/shop/cart/buy", "/api/shop/cart/buy",
+                       json={"userId": user_id, "items": [{"itemId": "item_6", "quantity": 2},
+                                                          {"itemId": "item_7", "quantity": 2}]})
+        elif action == "cart_sell":
+            await call(client, "POST", "/api/shop/cart/sell", "/api/shop/cart/sell",
+                       json={"userId": user_id, "items": [{"itemId": "item_6", "quantity": 1},
+                                                          {"itemId": "item_7", "quantity": 1}]})
+        elif action == "use":
+            await call(client, "POST", "/api/inventory/{user_id}/use", f"/api/inventory/{user_id}/use",
+                       json={"userId": user_id, "itemId": rng.choice(["item_6", "item_7"]), "quantity": 1})
+        elif action == "equip":
+            await call(client, "POST", "/api/inventory/{user_id}/equip", f"/api/inventory/{user_id}/equip",
+                       json={"userId": user_id, "itemId": rng.choice(EQUIPPABLE_ITEMS)})
+        elif action == "battle":
+            response = await call(client, "POST", "/api/battle/start", "/api/battle/start",
+                                  json={"userId": user_id, "enemyId": rng.choice(["enemy_1", "enemy_2"])})
+            if response.status_code != 200:
+                continue
+            battle_id = response.json()["_id"]
+            for _ in range(20):
+                response = await call(client, "POST", "/api/battle/action", "/api/battle/action",
+                                      json={"userId": user_id, "battleId": battle_id, "action": "attack"})
+                if response.status_code != 200 or response.json()["battleEnded"]:
+                    break
+            await call(client, "GET", "/api/battle/status/{battle_id}", f"/api/battle/status/{battle_id}")
+        elif action == "leaderboard":
+            metric = rng.choice(["level", "experience", "gold"])
+            await call(client, "GET", "/api/leaderboard/{metric}", f"/api/leaderboard/{metric}")
+            await call(client, "GET", "/api/leaderboard/{metric}/around/{user_id}",
+                       f"/api/leaderboard/{metric}/around/{user_id}")
+        elif action == "complete_quest":
+            quest_id = rng.choice(["quest_1", "quest_2", "quest_3"])
+            await call(client, "POST", "/api/quests/{user_id}/complete/{quest_id}",
+                       f"/api/quests/{user_id}/complete/{quest_id}")
+
+
+async def run(players: int, duration: float, seed: Optional[int], think_time: float = 0.0) -> Dict:
+    recorder = Recorder(think_time)
+    rng = random.Random(seed)
+
+    async with server.lifespan(server.app):
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://benchmark") as client:
+            start = time.perf_counter()
+            deadline = start + duration
+            await asyncio.gather(*[
+                player_session(client, recorder, f"bench_{i}", deadline, random.Random(rng.random()))
+                for i in range(players)
+            ])
+            elapsed = time.perf_counter() - start
+
+    routes = {}
+    for route, latencies in sorted(recorder.latencies.items()):
+        latencies.sort()
+        routes[route] = {
+            "requests": len(latencies),
+            "throughput": len(latencies) / elapsed,
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "p99": percentile(latencies, 0.99),
+            "max": latencies[-1],
+            "statuses": {str(code): count for code, count in sorted(recorder.statuses[route].items())},
+        }
+
+    total = sum(route["requests"] for route in routes.values())
+    return {
+        "elapsed": elapsed,
+        "requests": total,
+        "throughput": total / elapsed,
+        "routes": routes,
+    }
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(results: Dict):
+    header = f"{'Route':<50} {'Reqs':>7} {'Req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    print(header)
+    print("-" * len(header))
+    for route, stats in results["routes"].items():
+        print(
+            f"{route:<50} {stats['requests']:>7} {stats['throughput']:>8.1f} "
+            f"{stats['p50']:>8.2f} {stats['p95']:>8.2f} {stats['p99']:>8.2f}"
+        )
+    print("-" * len(header))
+    print(f"{'Total':<50} {results['requests']:>7} {results['throughput']:>8.1f}")
+
+
+def compare(results: Dict, baseline: Dict, threshold: float = REGRESSION_THRESHOLD) -> List[str]:
+    """Routes whose p95 latency regressed by more than threshold"""
+    regressions = []
+    for route, stats in results["routes"].items():
+        previous = baseline["routes"].get(route)
+        if not previous or not previous["p95"]:
+            continue
+        change = stats["p95"] / previous["p95"] - 1
+        print(f"{route:<50} p95 {previous['p95']:>8.2f} -> {stats['p95']:>8.2f} ms ({change:+.0%})")
+        if change > threshold:
+            regressions.append(route)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the game API in-process")
+    parser.add_argument("--players", type=int, default=20, help="concurrent player sessions")
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds to run")
+    parser.add_argument("--seed", type=int, help="seed for the scripted action mix")
+    parser.add_argument("--mongo-url", help="benchmark against this MongoDB instead of the stand-in")
+    parser.add_argument("--memory", action="store_true", help="benchmark the in-memory storage backend")
+    parser.add_argument("--db-name", default="rpg_benchmark")
+    parser.add_argument("--think-ms", type=float, default=0.0, help="pause before each request of a session")
+    parser.add_argument("--admission", action="store_true",
+                        help="keep admission control on, to measure load shedding")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--baseline", help="earlier results JSON to compare against")
+    parser.add_argument("--threshold", type=float, default=REGRESSION_THRESHOLD,
+                        help="allowed p95 growth before a route counts as regressed")
+    args = parser.parse_args()
+
+    # Per-request client logging would dominate the run
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    os.environ["DB_NAME"] = args.db_name
+    # The scripted players would otherwise hit the per-user rate limits
+    server.admission.enabled = args.admission
+    if args.memory:
+        os.environ["STORAGE_BACKEND"] = "memory"
+    elif args.mongo_url:
+        os.environ["MONGO_URL"] = args.mongo_url
+    else:
+        from mongomock_motor import AsyncMongoMockClient
+        os.environ["MONGO_URL"] = "mongodb://benchmark"
+        server.AsyncIOMotorClient = lambda url, **kwargs: AsyncMongoMockClient()
+
+    results = asyncio.run(run(args.players, args.duration, args.seed, args.think_ms / 1000))
+    results["config"] = {
+        "players": args.players,
+        "duration": args.duration,
+        "think_ms": args.think_ms,
+        "seed": args.seed,
+        "backend": "memory" if args.memory else "mongodb" if args.mongo_url else "mongomock",
+        "admission": args.admission,
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "timestamp": datetime.utcnow().isoformat(),
+    }
+    print_report(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        print()
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"\n❌ p95 regressed on {len(regressions)} route(s)")
+            sys.exit(1)
+        print("\n✅ No p95 regressions")
+
+
+if __name__ == "__main__":
+    main()
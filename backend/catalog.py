@@ -0,0 +1,118 @@
+import asyncio
+import hashlib
+import json
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Awaitable, Callable, Dict, List, Mapping, Optional, Tuple
+
+from models import Item, Enemy, Quest
+
+
+@dataclass(frozen=True, slots=True)
+class CatalogSnapshot:
+    """Read-only view of the static game data at one catalog version.
+
+    The mappings are read-only, but the models and documents in them are
+    shared by every reader of this snapshot and are not copied. Callers
+    must not mutate them; copy first (``model_copy``, ``dict(doc)``).
+    """
+    version: int
+    # Content hash of the item documents, stable across processes
+    fingerprint: str
+    items: Mapping[str, Item]
+    enemies: Mapping[str, Enemy]
+    quests: Mapping[str, Quest]
+    # Raw documents, kept so merged views keep their stored shape
+    item_docs: Mapping[str, Mapping]
+    quest_docs: Mapping[str, Mapping]
+
+
+def _freeze(docs: list) -> Mapping[str, Mapping]:
+    return MappingProxyType({doc["_id"]: MappingProxyType(doc) for doc in docs})
+
+
+def _fingerprint(docs: list) -> str:
+    encoded = json.dumps(sorted(docs, key=lambda doc: doc["_id"]), sort_keys=True, default=str)
+    return hashlib.sha1(encoded.encode()).hexdigest()[:16]
+
+
+def _build(model, docs: Mapping[str, Mapping]) -> Mapping[str, object]:
+    return MappingProxyType({key: model(**doc) for key, doc in docs.items()})
+
+
+class CatalogCache:
+    """In-process cache of items, enemies and quests.
+
+    The catalog only changes when it is (re)seeded, so it is loaded once and
+    served from memory. Every reload swaps in a new snapshot with a higher
+    version; ``invalidate`` marks the current one stale so the next access
+    reloads it.
+    """
+
+    def __init__(self, load: Callable[[], Awaitable[Tuple[List[Dict], List[Dict], List[Dict]]]]):
+        # Returns the item, enemy and quest documents
+        self._load_documents = load
+
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self._version = 0
+        self._stale = True
+        self._lock = asyncio.Lock()
+
+    @property
+    def version(self) -> int:
+        """Version of the loaded snapshot, 0 if nothing is loaded yet"""
+        return self._version
+
+    @property
+    def snapshot(self) -> Optional[CatalogSnapshot]:
+        """Currently loaded snapshot without triggering a reload"""
+        return self._snapshot
+
+    def invalidate(self):
+        """Mark the cache stale so the next access reloads it"""
+        self._stale = True
+
+    async def reload(self) -> CatalogSnapshot:
+        """Load the catalog from the database and publish a new version"""
+        async with self._lock:
+            return await self._load()
+
+    async def get(self) -> CatalogSnapshot:
+        """Get the current snapshot, reloading it if missing or stale"""
+        snapshot = self._snapshot
+        if snapshot is not None and not self._stale:
+            return snapshot
+
+        async with self._lock:
+            # Another task may have reloaded while we waited for the lock
+            if self._snapshot is not None and not self._stale:
+                return self._snapshot
+            return await self._load()
+
+    async def _load(self) -> CatalogSnapshot:
+        # Cleared before reading so an invalidate() during the load sticks
+        self._stale = False
+
+        try:
+            items, enemies, quests = await self._load_documents()
+        except Exception:
+            # Keep the old snapshot stale so the next access tries again
+            self._stale = True
+            raise
+
+        item_docs = _freeze(items)
+        enemy_docs = _freeze(enemies)
+        quest_docs = _freeze(quests)
+
+        snapshot = CatalogSnapshot(
+            version=self._version + 1,
+            fingerprint=_fingerprint(items),
+            items=_build(Item, item_docs),
+            enemies=_build(Enemy, enemy_docs),
+            quests=_build(Quest, quest_docs),
+            item_docs=item_docs,
+            quest_docs=quest_docs,
+        )
+        self._snapshot = snapshot
+        self._version = snapshot.version
+        return snapshot
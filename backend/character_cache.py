@@ -0,0 +1,247 @@
+import asyncio
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+
+from pymongo import UpdateOne
+
+from database import GameDatabase
+from models import Character, CharacterUpdate
+from storage import check_amount, leaderboard_entry
+
+
+class _CachedCharacter:
+    __slots__ = ("character", "dirty", "flushing", "claims", "last_access")
+
+    def __init__(self, character: Character):
+        self.character = character
+        self.dirty = set()
+        # Fields of a bulk write still in flight, not yet readable from the database
+        self.flushing = set()
+        # Quest claims paid into this character, written with its next flush
+        self.claims = set()
+        self.last_access = time.monotonic()
+
+
+class WriteBehindGameDatabase(GameDatabase):
+    """GameDatabase that buffers character writes in memory.
+
+    Hot characters are kept in an LRU map and mutated in place; the fields
+    each mutation touched are coalesced and written in one bulk write every
+    ``flush_interval`` seconds, before a character is evicted, and on
+    ``stop``. ``flush_interval`` is therefore the window of character
+    changes that a crash can lose. The cache is per process, so this only
+    suits deployments that route each player to a single worker.
+
+    Leaderboards are read from the database with the buffered values
+    merged in, so reading them never forces a flush.
+    """
+
+    def __init__(self, client, db_name: str, flush_interval: float = 2.0,
+                 max_characters: int = 10000, idle_timeout: float = 300.0):
+        super().__init__(client, db_name)
+        self.flush_interval = flush_interval
+        self.max_characters = max_characters
+        self.idle_timeout = idle_timeout
+
+        self._cached: "OrderedDict[str, _CachedCharacter]" = OrderedDict()
+        self._task: Optional[asyncio.Task] = None
+        # One flush at a time, so no flush evicts an entry another is still writing
+        self._flush_lock = asyncio.Lock()
+
+    async def _entry(self, user_id: str) -> _CachedCharacter:
+        entry = self._cached.get(user_id)
+        if entry is None:
+            character = await super().get_character(user_id)
+            # Another task may have loaded it while we waited
+            entry = self._cached.setdefault(user_id, _CachedCharacter(character))
+        self._cached.move_to_end(user_id)
+        entry.last_access = time.monotonic()
+        return entry
+
+    def _changed(self, entry: _CachedCharacter, *fields: str) -> Character:
+        entry.dirty.update(fields)
+        entry.character.updatedAt = datetime.utcnow()
+        self._publish_change(entry.character.id, "character")
+        return entry.character.model_copy(deep=True)
+
+    # Character methods
+    async def get_character(self, user_id: str) -> Character:
+        """Get character from memory, loading it on first access"""
+        entry = await self._entry(user_id)
+        return entry.character.model_copy(deep=True)
+
+    async def update_character(self, user_id: str, updates: CharacterUpdate,
+                               projection: Optional[Dict] = None) -> Union[Character, Dict]:
+        """Update character data in memory"""
+        entry = await self._entry(user_id)
+        fields = {k for k, v in updates if v is not None}
+        for field in fields:
+            setattr(entry.character, field, getattr(updates, field).model_copy()
+                    if field in ("stats", "equipment", "derivedStats") else getattr(updates, field))
+        character = self._changed(entry, *fields)
+
+        if projection:
+            char_data = character.model_dump(by_alias=True)
+            return {k: v for k, v in char_data.items() if k == "_id" or projection.get(k)}
+        return character
+
+    async def spend_gold(self, user_id: str, amount: int) -> Optional[Character]:
+        """Deduct gold only if the character has at least that much"""
+        check_amount(amount)
+        entry = await self._entry(user_id)
+        if entry.character.gold < amount:
+            return None
+        entry.character.gold -= amount
+        return self._changed(entry, "gold")
+
+    async def grant_rewards(self, user_id: str, experience: int = 0, gold: int = 0) -> Optional[Character]:
+        """Add experience and gold"""
+        entry = await self._entry(user_id)
+        entry.character.experience += experience
+        entry.character.gold += gold
+        return self._changed(entry, "experience", "gold")
+
+    async def grant_quest_rewards(self, user_id: str, claim_id: str, experience: int = 0,
+                                  gold: int = 0) -> Optional[Character]:
+        """Add a claim's experience and gold once, in memory.
+
+        The claim is written in the same update as the gold on the next
+        flush. Claims stay with the cached entry, so a claim flushed while
+        the stored claims were being read is still seen; if the entry was
+        evicted meanwhile, the check runs again against the database.
+        """
+        while True:
+            entry = await self._entry(user_id)
+            if claim_id in entry.claims:
+                return None
+            if await self.characters.count_documents({"_id": user_id, "claimedQuests": claim_id}, limit=1):
+                return None
+            if self._cached.get(user_id) is entry:
+                break
+        if claim_id in entry.claims:
+            return None
+        entry.claims.add(claim_id)
+        entry.character.experience += experience
+        entry.character.gold += gold
+        return self._changed(entry, "experience", "gold")
+
+    async def restore_health(self, user_id: str, amount: int) -> Optional[Character]:
+        """Heal the character, capped at maxHealth"""
+        entry = await self._entry(user_id)
+        character = entry.character
+        character.health = max(0, min(character.health + amount, character.maxHealth))
+        return self._changed(entry, "health")
+
+    async def restore_mana(self, user_id: str, amount: int) -> Optional[Character]:
+        """Restore mana, capped at maxMana"""
+        entry = await self._entry(user_id)
+        character = entry.character
+        character.mana = max(0, min(character.mana + amount, character.maxMana))
+        return self._changed(entry, "mana")
+
+    # Leaderboard methods
+    async def leaderboard_page(self, metric: str, limit: int, after: Optional[Tuple[int, str]] = None,
+                               ahead: bool = False) -> List[Dict]:
+        """Players ranked by metric, with buffered changes merged into the stored ranking.
+
+        Characters whose metric is buffered are left out of the query and
+        placed by their cached value instead; other buffered fields are
+        copied over the stored entries.
+        """
+        moved, changed = {}, {}
+        for user_id, entry in self._cached.items():
+            if metric in entry.dirty or metric in entry.flushing:
+                moved[user_id] = leaderboard_entry(entry.character.model_dump(by_alias=True))
+            elif entry.dirty or entry.flushing:
+                changed[user_id] = entry
+
+        page = await self._stored_leaderboard_page(metric, limit, after, ahead, exclude=list(moved))
+        page = [
+            leaderboard_entry(changed[e["userId"]].character.model_dump(by_alias=True))
+            if e["userId"] in changed else e
+            for e in page
+        ]
+        if not moved:
+            return page
+
+        def key(e: Dict) -> Tuple[int, str]:
+            return -e[metric], e["userId"]
+
+        candidates = list(moved.values())
+        if after is not None:
+            position = (-after[0], after[1])
+            candidates = [e for e in candidates if (key(e) < position if ahead else key(e) > position)]
+        # Nearest first when listing the players above
+        return sorted(page + candidates, key=key, reverse=ahead)[:limit]
+
+    # Write-behind
+    async def flush(self):
+        """Write all buffered changes, then evict idle and excess characters.
+
+        Flushes run one at a time: a concurrent flush would see entries
+        whose write is still in flight as clean and could evict them, and a
+        reload would then read the document from before that write.
+        """
+        async with self._flush_lock:
+            writes, flushed = [], []
+            for user_id, entry in self._cached.items():
+                if not entry.dirty:
+                    continue
+                char_data = entry.character.model_dump(by_alias=True)
+                update = {field: char_data[field] for field in entry.dirty}
+                update["updatedAt"] = char_data["updatedAt"]
+                operations = {"$set": update}
+                if entry.claims:
+                    operations["$addToSet"] = {"claimedQuests": {"$each": sorted(entry.claims)}}
+                writes.append(UpdateOne({"_id": user_id}, operations))
+                flushed.append((entry, entry.dirty))
+                entry.flushing = entry.dirty
+                entry.dirty = set()
+
+            if writes:
+                try:
+                    await self.characters.bulk_write(writes, ordered=False)
+                except Exception:
+                    # Keep the changes buffered for the next attempt
+                    for entry, fields in flushed:
+                        entry.dirty |= fields
+                    raise
+                finally:
+                    for entry, _ in flushed:
+                        entry.flushing = set()
+
+            now = time.monotonic()
+            for user_id in list(self._cached):
+                entry = self._cached[user_id]
+                if entry.dirty:
+                    continue
+                if len(self._cached) > self.max_characters or now - entry.last_access > self.idle_timeout:
+                    del self._cached[user_id]
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing characters: {e}")
+
+    async def start(self):
+        """Start the periodic flush task"""
+        await super().start()
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the flush task and write out everything buffered"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+        await super().stop()
@@ -1,13 +1,339 @@
 from motor.motor_asyncio import AsyncIOMotorClient
-from pymongo.errors import DuplicateKeyError
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from typing import Collection, Dict, List, Optional, Tuple, Union
 from models import *
+from catalog import CatalogCache
+from indexes import IndexManager, IndexReport
+from storage import LEADERBOARD_FIELDS, GameStorage, check_amount, check_quantities, leaderboard_entry, value_histogram
+from serialization import construct_trusted
 import os
+import asyncio
+import logging
 from datetime import datetime
 import uuid
 
+logger = logging.getLogger(__name__)
+
+
+# Sample items
+SAMPLE_ITEMS = [
+    {
+        "_id": "item_1",
+        "name": "Lángoló Kard",
+        "type": "weapon",
+        "rarity": "rare",
+        "damage": 15,
+        "price": 200,
+        "description": "Egy forró láng borítja"
+    },
+    {
+        "_id": "item_2", 
+        "name": "Acél Páncél",
+        "type": "armor",
+        "rarity": "common",
+        "defense": 12,
+        "price": 150,
+        "description": "Erős acél páncélzat"
+    },
+    {
+        "_id": "item_3",
+        "name": "Harcos Sisak", 
+        "type": "helmet",
+        "rarity": "common",
+        "defense": 5,
+        "price": 75,
+        "description": "Védő sisak harcosoknak"
+    },
+    {
+        "_id": "item_4",
+        "name": "Gyors Csizmák",
+        "type": "boots", 
+        "rarity": "uncommon",
+        "speed": 3,
+        "price": 100,
+        "description": "Növeli a sebességet"
+    },
+    {
+        "_id": "item_5",
+        "name": "Erő Gyűrűje",
+        "type": "accessory",
+        "rarity": "rare", 
+        "strength": 2,
+        "price": 300,
+        "description": "Növeli az erőt"
+    },
+    {
+        "_id": "item_6",
+        "name": "Gyógyító Bájital",
+        "type": "consumable",
+        "rarity": "common",
+        "effect": "heal",
+        "value": 50,
+        "price": 25,
+        "description": "Visszaad 50 HP-t"
+    },
+    {
+        "_id": "item_7", 
+        "name": "Mana Bájital",
+        "type": "consumable",
+        "rarity": "common",
+        "effect": "mana",
+        "value": 30,
+        "price": 20,
+        "description": "Visszaad 30 mana-t"
+    },
+    {
+        "_id": "item_8",
+        "name": "Vas Kard",
+        "type": "weapon",
+        "rarity": "common", 
+        "damage": 10,
+        "price": 100,
+        "description": "Egyszerű vas kard"
+    },
+    {
+        "_id": "item_9",
+        "name": "Bőr Páncél",
+        "type": "armor",
+        "rarity": "common",
+        "defense": 8,
+        "price": 80,
+        "description": "Könnyű bőr páncél"
+    },
+    {
+        "_id": "item_10",
+        "name": "Titán Pajzs", 
+        "type": "shield",
+        "rarity": "epic",
+        "defense": 15,
+        "price": 500,
+        "description": "Legendás titán pajzs"
+    }
+]
+
+# Sample enemies
+SAMPLE_ENEMIES = [
+    {
+        "_id": "enemy_1",
+        "name": "Goblin Harcos",
+        "level": 8,
+        "health": 60,
+        "maxHealth": 60, 
+        "attack": 12,
+        "defense": 5,
+        "experience": 120,
+        "goldReward": 25,
+        "image": "🧌"
+    },
+    {
+        "_id": "enemy_2",
+        "name": "Vad Farkas",
+        "level": 10,
+        "health": 80,
+        "maxHealth": 80,
+        "attack": 15, 
+        "defense": 3,
+        "experience": 150,
+        "goldReward": 30,
+        "image": "🐺"
+    },
+    {
+        "_id": "enemy_3",
+        "name": "Koponya Mágus",
+        "level": 15,
+        "health": 120,
+        "maxHealth": 120,
+        "attack": 25,
+        "defense": 8,
+        "experience": 300,
+        "goldReward": 75,
+        "image": "💀"
+    },
+    {
+        "_id": "enemy_4", 
+        "name": "Ősi Sárkány",
+        "level": 25,
+        "health": 300,
+        "maxHealth": 300,
+        "attack": 45,
+        "defense": 20,
+        "experience": 1000,
+        "goldReward": 500,
+        "image": "🐲"
+    }
+]
+
+# Sample quests
+SAMPLE_QUESTS = [
+    {
+        "_id": "quest_1",
+        "title": "Goblin Fenyegetés", 
+        "description": "Győzz le 5 goblin harcost a falu védelmében",
+        "type": "kill",
+        "target": "Goblin Harcos",
+        "required": 5,
+        "reward": {
+            "experience": 500,
+            "gold": 100
+        },
+        "isActive": True
+    },
+    {
+        "_id": "quest_2",
+        "title": "A Mágus Próbája",
+        "description": "Érj el 15. szintet",
+        "type": "level", 
+        "required": 15,
+        "reward": {
+            "experience": 0,
+            "gold": 300,
+            "item": "item_5"
+        },
+        "isActive": True
+    },
+    {
+        "_id": "quest_3",
+        "title": "Kincsvadászat",
+        "description": "Gyűjts össze 1000 aranyat",
+        "type": "collect",
+        "target": "gold",
+        "required": 1000,
+        "reward": {
+            "experience": 800,
+            "gold": 0,
+            "item": "item_10" 
+        },
+        "isActive": True
+    }
+]
+
+
+def default_character(user_id: str) -> Character:
+    """Starting character for a new player"""
+    return Character(
+        id=user_id,
+        name="Kalandor",
+        level=12,
+        experience=2400,
+        experienceToNext=3000,
+        gold=850,
+        health=100,
+        maxHealth=100,
+        mana=75,
+        maxMana=75,
+        stats=CharacterStats(
+            strength=18,
+            dexterity=14,
+            intelligence=16,
+            constitution=15,
+            wisdom=12,
+            charisma=10
+        ),
+        equipment=Equipment(
+            weapon="item_1",
+            armor="item_2", 
+            helmet="item_3",
+            boots="item_4",
+            accessory="item_5"
+        )
+    )
+
+
+# Starting inventory for a new player
+DEFAULT_INVENTORY_ITEMS = [
+    {"itemId": "item_6", "quantity": 5, "equipped": False},
+    {"itemId": "item_7", "quantity": 3, "equipped": False}, 
+    {"itemId": "item_8", "quantity": 1, "equipped": False},
+    {"itemId": "item_9", "quantity": 1, "equipped": False},
+    {"itemId": "item_10", "quantity": 1, "equipped": False}
+]
+
+# Quests a new player starts with, as (questId, progress)
+STARTER_QUESTS = [
+    ("quest_1", 3),
+    ("quest_2", 12)
+]
+
+
+def inventory_slots(items: List[Dict]) -> Dict[str, Dict]:
+    """Keyed inventory slots from a list of inventory entries"""
+    slots = {}
+    for item in items:
+        slot = slots.setdefault(item["itemId"], {"quantity": 0, "equipped": False})
+        slot["quantity"] += item.get("quantity", 1)
+        slot["equipped"] = slot["equipped"] or item.get("equipped", False)
+    return slots
+
+
+def inventory_entries(inventory: Dict) -> List[Dict]:
+    """Inventory entries in stored order, for either storage layout"""
+    if "slots" not in inventory:
+        return inventory.get("items", [])
+    return [
+        {"itemId": item_id, "quantity": slot["quantity"], "equipped": slot.get("equipped", False)}
+        for item_id, slot in inventory["slots"].items()
+        if slot["quantity"] > 0
+    ]
+
+
+# Collections followed for player changes, and the part of a player each one holds
+WATCHED_COLLECTIONS = {"characters": "character", "inventories": "inventory", "player_quests": "quests"}
+
+# Sampled characters per leaderboard histogram range
+HISTOGRAM_SAMPLE_PER_BUCKET = 20
+
+# Server error codes meaning change streams are not offered (standalone server)
+CHANGE_STREAMS_UNSUPPORTED = (40573, 40324)
+
+# Server error codes meaning a change stream cannot be resumed where it stopped
+CHANGE_STREAM_LOST = (280, 286)
+
+# Seconds before reopening a failed change stream, doubling up to the maximum
+WATCH_RETRY_DELAY = 1.0
+WATCH_RETRY_MAX_DELAY = 60.0
+
+
+def _owner_from_key(collection: str, document_id) -> Optional[str]:
+    """The player a document belongs to, when its ID is derived from the user ID"""
+    if not isinstance(document_id, str):
+        return None
+    if collection == "characters":
+        return document_id
+    if collection == "inventories" and document_id.startswith("inv_"):
+        return document_id[len("inv_"):]
+    if collection == "player_quests" and document_id.startswith("pq_"):
+        user_id, _, number = document_id[len("pq_"):].rpartition("_")
+        if user_id and number.isdigit():
+            return user_id
+    return None
+
+
+def _duplicate_keys_only(error: Exception) -> bool:
+    """Whether a write error is nothing but duplicate key errors"""
+    if isinstance(error, DuplicateKeyError):
+        return True
+    write_errors = error.details.get("writeErrors", [])
+    return bool(write_errors) and not error.details.get("writeConcernErrors") and all(
+        write_error.get("code") == 11000 for write_error in write_errors
+    )
+
+
+def _capped_inc(field: str, max_field: str, amount: int) -> List[Dict]:
+    """Pipeline update adding amount to field, clamped to [0, max_field]"""
+    return [
+        {"$set": {
+            field: {"$max": [0, {"$min": [{"$add": [f"${field}", amount]}, f"${max_field}"]}]},
+            "updatedAt": datetime.utcnow(),
+        }}
+    ]
+
+
+class GameDatabase(GameStorage):
+    """Game storage on MongoDB"""
 
-class GameDatabase:
     def __init__(self, client: AsyncIOMotorClient, db_name: str):
+        super().__init__()
         self.client = client
         self.db = client[db_name]
         
@@ -20,373 +346,415 @@ class GameDatabase:
         self.player_quests = self.db.player_quests
         self.battles = self.db.battles
 
-    async def initialize_game_data(self):
-        """Initialize the game with sample data"""
-        
-        # Initialize Items
-        sample_items = [
-            {
-                "_id": "item_1",
-                "name": "Lángoló Kard",
-                "type": "weapon",
-                "rarity": "rare",
-                "damage": 15,
-                "price": 200,
-                "description": "Egy forró láng borítja"
-            },
-            {
-                "_id": "item_2", 
-                "name": "Acél Páncél",
-                "type": "armor",
-                "rarity": "common",
-                "defense": 12,
-                "price": 150,
-                "description": "Erős acél páncélzat"
-            },
-            {
-                "_id": "item_3",
-                "name": "Harcos Sisak", 
-                "type": "helmet",
-                "rarity": "common",
-                "defense": 5,
-                "price": 75,
-                "description": "Védő sisak harcosoknak"
-            },
-            {
-                "_id": "item_4",
-                "name": "Gyors Csizmák",
-                "type": "boots", 
-                "rarity": "uncommon",
-                "speed": 3,
-                "price": 100,
-                "description": "Növeli a sebességet"
-            },
-            {
-                "_id": "item_5",
-                "name": "Erő Gyűrűje",
-                "type": "accessory",
-                "rarity": "rare", 
-                "strength": 2,
-                "price": 300,
-                "description": "Növeli az erőt"
-            },
-            {
-                "_id": "item_6",
-                "name": "Gyógyító Bájital",
-                "type": "consumable",
-                "rarity": "common",
-                "effect": "heal",
-                "value": 50,
-                "price": 25,
-                "description": "Visszaad 50 HP-t"
-            },
-            {
-                "_id": "item_7", 
-                "name": "Mana Bájital",
-                "type": "consumable",
-                "rarity": "common",
-                "effect": "mana",
-                "value": 30,
-                "price": 20,
-                "description": "Visszaad 30 mana-t"
-            },
-            {
-                "_id": "item_8",
-                "name": "Vas Kard",
-                "type": "weapon",
-                "rarity": "common", 
-                "damage": 10,
-                "price": 100,
-                "description": "Egyszerű vas kard"
-            },
-            {
-                "_id": "item_9",
-                "name": "Bőr Páncél",
-                "type": "armor",
-                "rarity": "common",
-                "defense": 8,
-                "price": 80,
-                "description": "Könnyű bőr páncél"
-            },
-            {
-                "_id": "item_10",
-                "name": "Titán Pajzs", 
-                "type": "shield",
-                "rarity": "epic",
-                "defense": 15,
-                "price": 500,
-                "description": "Legendás titán pajzs"
-            }
-        ]
+        # Static game data served from memory
+        self.catalog = CatalogCache(self._load_catalog)
 
-        # Initialize Enemies
-        sample_enemies = [
-            {
-                "_id": "enemy_1",
-                "name": "Goblin Harcos",
-                "level": 8,
-                "health": 60,
-                "maxHealth": 60, 
-                "attack": 12,
-                "defense": 5,
-                "experience": 120,
-                "goldReward": 25,
-                "image": "🧌"
-            },
-            {
-                "_id": "enemy_2",
-                "name": "Vad Farkas",
-                "level": 10,
-                "health": 80,
-                "maxHealth": 80,
-                "attack": 15, 
-                "defense": 3,
-                "experience": 150,
-                "goldReward": 30,
-                "image": "🐺"
-            },
-            {
-                "_id": "enemy_3",
-                "name": "Koponya Mágus",
-                "level": 15,
-                "health": 120,
-                "maxHealth": 120,
-                "attack": 25,
-                "defense": 8,
-                "experience": 300,
-                "goldReward": 75,
-                "image": "💀"
-            },
-            {
-                "_id": "enemy_4", 
-                "name": "Ősi Sárkány",
-                "level": 25,
-                "health": 300,
-                "maxHealth": 300,
-                "attack": 45,
-                "defense": 20,
-                "experience": 1000,
-                "goldReward": 500,
-                "image": "🐲"
-            }
-        ]
+        # In-flight provisioning runs, by user ID
+        self._provisioning: Dict[str, asyncio.Future] = {}
 
-        # Initialize Quests
-        sample_quests = [
-            {
-                "_id": "quest_1",
-                "title": "Goblin Fenyegetés", 
-                "description": "Győzz le 5 goblin harcost a falu védelmében",
-                "type": "kill",
-                "target": "Goblin Harcos",
-                "required": 5,
-                "reward": {
-                    "experience": 500,
-                    "gold": 100
-                },
-                "isActive": True
-            },
-            {
-                "_id": "quest_2",
-                "title": "A Mágus Próbája",
-                "description": "Érj el 15. szintet",
-                "type": "level", 
-                "required": 15,
-                "reward": {
-                    "experience": 0,
-                    "gold": 300,
-                    "item": "item_5"
-                },
-                "isActive": True
-            },
-            {
-                "_id": "quest_3",
-                "title": "Kincsvadászat",
-                "description": "Gyűjts össze 1000 aranyat",
-                "type": "collect",
-                "target": "gold",
-                "required": 1000,
-                "reward": {
-                    "experience": 800,
-                    "gold": 0,
-                    "item": "item_10" 
-                },
-                "isActive": True
-            }
+        # Change stream task, run while anyone follows changes
+        self._watch_task: Optional[asyncio.Task] = None
+        self._change_streams = True
+
+    # Lifecycle
+    def follow_changes(self, follow: bool):
+        """Follow player changes made by any process, where MongoDB offers change streams"""
+        if follow and self._watch_task is None and self._change_streams:
+            self._watch_task = asyncio.create_task(self._watch_changes())
+        elif not follow and self._watch_task is not None:
+            self._watch_task.cancel()
+            self._watch_task = None
+
+    async def stop(self):
+        """Stop following changes"""
+        if self._watch_task is not None:
+            self._watch_task.cancel()
+            try:
+                await self._watch_task
+            except asyncio.CancelledError:
+                pass
+            self._watch_task = None
+
+    async def _watch_changes(self):
+        """Publish every committed write to a player's documents, from any process.
+
+        Writes made here are also published directly, so listeners see
+        them twice and should coalesce. Players are found from the changed
+        document's key, without fetching the document. The stream resumes
+        from the last change seen after errors; on a standalone server, which
+        has no change streams, only this process's writes are published.
+        """
+        pipeline = [
+            {"$match": {
+                "ns.coll": {"$in": list(WATCHED_COLLECTIONS)},
+                "operationType": {"$in": ["insert", "update", "replace"]}
+            }},
+            {"$project": {"ns.coll": 1, "documentKey": 1}},
         ]
+        resume_after = None
+        delay = WATCH_RETRY_DELAY
+        while True:
+            try:
+                async with self.db.watch(pipeline, resume_after=resume_after) as stream:
+                    delay = WATCH_RETRY_DELAY
+                    async for change in stream:
+                        resume_after = stream.resume_token
+                        collection = change["ns"]["coll"]
+                        document_id = change["documentKey"]["_id"]
+                        user_id = _owner_from_key(collection, document_id)
+                        if user_id is None:
+                            # Documents from before IDs were derived from the user
+                            owner = await self.db[collection].find_one({"_id": document_id}, {"userId": 1})
+                            user_id = owner and owner.get("userId")
+                        if user_id is not None:
+                            self._publish_change(user_id, WATCHED_COLLECTIONS[collection])
+            except OperationFailure as e:
+                if e.code in CHANGE_STREAMS_UNSUPPORTED:
+                    logger.warning("Change streams unavailable, only this process's changes are published")
+                    self._change_streams = False
+                    self._watch_task = None
+                    return
+                if e.code in CHANGE_STREAM_LOST:
+                    # The resume point has left the oplog; start again from now
+                    resume_after = None
+                logger.error("Error following changes, retrying in %.0fs: %s", delay, e)
+            except Exception:
+                logger.exception("Error following changes, retrying in %.0fs", delay)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WATCH_RETRY_MAX_DELAY)
 
+    async def _load_catalog(self):
+        return await asyncio.gather(
+            self.items.find({}).to_list(None),
+            self.enemies.find({}).to_list(None),
+            self.quests.find({}).to_list(None)
+        )
+
+    async def ensure_indexes(self) -> IndexReport:
+        """Create any missing indexes"""
+        return await IndexManager(self.db).ensure()
+
+    async def initialize_game_data(self):
+        """Initialize the game with sample data"""
+        
         # Insert data if collections are empty
         try:
             if await self.items.count_documents({}) == 0:
-                await self.items.insert_many(sample_items)
+                await self.items.insert_many(SAMPLE_ITEMS)
+                self.catalog.invalidate()
                 print("✅ Items initialized")
                 
             if await self.enemies.count_documents({}) == 0:
-                await self.enemies.insert_many(sample_enemies)
+                await self.enemies.insert_many(SAMPLE_ENEMIES)
+                self.catalog.invalidate()
                 print("✅ Enemies initialized")
                 
             if await self.quests.count_documents({}) == 0:
-                await self.quests.insert_many(sample_quests)
+                await self.quests.insert_many(SAMPLE_QUESTS)
+                self.catalog.invalidate()
                 print("✅ Quests initialized")
                 
         except Exception as e:
             print(f"Error initializing game data: {e}")
 
+    # Player provisioning
+    async def provision_player(self, user_id: str) -> Dict:
+        """Create the default character, inventory and starter quests if missing.
+
+        Every document is written as a $setOnInsert upsert on a deterministic
+        _id, so this is idempotent and safe to race. The three collections
+        are written concurrently, and concurrent calls for the same user in
+        this process share one provisioning run.
+        """
+        task = self._provisioning.get(user_id)
+        if task is None:
+            task = asyncio.ensure_future(self._provision_player(user_id))
+            self._provisioning[user_id] = task
+            task.add_done_callback(lambda _: self._provisioning.pop(user_id, None))
+        return await asyncio.shield(task)
+
+    async def _provision_player(self, user_id: str) -> Dict:
+        now = datetime.utcnow()
+        char_doc = default_character(user_id).model_dump(by_alias=True)
+        del char_doc["_id"]
+        quest_writes = [
+            UpdateOne(
+                {"_id": f"pq_{user_id}_{i}"},
+                {"$setOnInsert": {
+                    "userId": user_id,
+                    "questId": quest_id,
+                    "progress": progress,
+                    "completed": False,
+                    "active": True,
+                    "startedAt": now
+                }},
+                upsert=True
+            )
+            for i, (quest_id, progress) in enumerate(STARTER_QUESTS, start=1)
+        ]
+
+        for attempt in range(2):
+            try:
+                character, inventory, _ = await asyncio.gather(
+                    self.characters.find_one_and_update(
+                        {"_id": user_id},
+                        {"$setOnInsert": char_doc},
+                        upsert=True,
+                        return_document=ReturnDocument.AFTER
+                    ),
+                    self.inventories.find_one_and_update(
+                        {"_id": f"inv_{user_id}"},
+                        {"$setOnInsert": {"userId": user_id, "slots": inventory_slots(DEFAULT_INVENTORY_ITEMS)}},
+                        upsert=True,
+                        return_document=ReturnDocument.AFTER
+                    ),
+                    self.player_quests.bulk_write(quest_writes, ordered=False)
+                )
+                return {"character": character, "inventory": inventory}
+            except (DuplicateKeyError, BulkWriteError) as e:
+                # Lost an upsert race with another process; the retry matches
+                if attempt or not _duplicate_keys_only(e):
+                    raise
+
     # Character methods
     async def get_character(self, user_id: str) -> Character:
         """Get character by user ID, create if doesn't exist"""
         char_data = await self.characters.find_one({"_id": user_id})
         
         if not char_data:
-            # Create default character
-            new_char = Character(
-                id=user_id,
-                name="Kalandor",
-                level=12,
-                experience=2400,
-                experienceToNext=3000,
-                gold=850,
-                health=100,
-                maxHealth=100,
-                mana=75,
-                maxMana=75,
-                stats=CharacterStats(
-                    strength=18,
-                    dexterity=14,
-                    intelligence=16,
-                    constitution=15,
-                    wisdom=12,
-                    charisma=10
-                ),
-                equipment=Equipment(
-                    weapon="item_1",
-                    armor="item_2", 
-                    helmet="item_3",
-                    boots="item_4",
-                    accessory="item_5"
-                )
-            )
-            await self.characters.insert_one(new_char.model_dump(by_alias=True))
-            return new_char
+            char_data = (await self.provision_player(user_id))["character"]
             
-        return Character(**char_data)
+        return construct_trusted(Character, char_data)
+
+    async def update_character(self, user_id: str, updates: CharacterUpdate,
+                               projection: Optional[Dict] = None) -> Union[Character, Dict]:
+        """Update character data and return the updated document.
 
-    async def update_character(self, user_id: str, updates: CharacterUpdate) -> Character:
-        """Update character data"""
+        With a projection the projected raw document is returned instead of
+        a Character.
+        """
         update_data = {k: v for k, v in updates.model_dump().items() if v is not None}
         update_data["updatedAt"] = datetime.utcnow()
         
-        await self.characters.update_one(
-            {"_id": user_id},
-            {"$set": update_data}
+        return await self._modify_character(user_id, {}, {"$set": update_data}, projection)
+
+    # Atomic character mutations
+    async def _modify_character(self, user_id: str, guard: Dict, update,
+                                projection: Optional[Dict] = None) -> Union[Character, Dict, None]:
+        """Apply a guarded update in one round trip and return the post-image.
+
+        Returns None if the guard does not match. A missing character is
+        provisioned and the update retried once.
+        """
+        query = {"_id": user_id, **guard}
+        for _ in range(2):
+            char_data = await self.characters.find_one_and_update(
+                query, update, projection=projection, return_document=ReturnDocument.AFTER
+            )
+            if char_data:
+                self._publish_change(user_id, "character")
+                return char_data if projection else construct_trusted(Character, char_data)
+            if await self.characters.count_documents({"_id": user_id}, limit=1):
+                return None
+            await self.provision_player(user_id)
+        return None
+
+    async def spend_gold(self, user_id: str, amount: int) -> Optional[Character]:
+        """Deduct gold only if the character has at least that much"""
+        check_amount(amount)
+        return await self._modify_character(
+            user_id,
+            {"gold": {"$gte": amount}},
+            {"$inc": {"gold": -amount}, "$set": {"updatedAt": datetime.utcnow()}},
+        )
+
+    async def grant_rewards(self, user_id: str, experience: int = 0, gold: int = 0) -> Optional[Character]:
+        """Add experience and gold"""
+        return await self._modify_character(
+            user_id,
+            {},
+            {"$inc": {"experience": experience, "gold": gold}, "$set": {"updatedAt": datetime.utcnow()}},
         )
-        return await self.get_character(user_id)
+
+    async def restore_health(self, user_id: str, amount: int) -> Optional[Character]:
+        """Heal the character, capped at maxHealth"""
+        return await self._modify_character(user_id, {}, _capped_inc("health", "maxHealth", amount))
+
+    async def restore_mana(self, user_id: str, amount: int) -> Optional[Character]:
+        """Restore mana, capped at maxMana"""
+        return await self._modify_character(user_id, {}, _capped_inc("mana", "maxMana", amount))
 
     # Inventory methods
+    #
+    # Inventories are stored keyed by item id:
+    #   {"_id": "inv_<user>", "userId": ..., "slots": {"<itemId>": {"quantity": n, "equipped": bool}}}
+    # so a quantity change is a single $inc on "slots.<itemId>.quantity".
+    # Documents still using the older "items" array layout are read as-is
+    # and migrated on their first write, or in bulk by migrate_inventories.
     async def get_inventory(self, user_id: str) -> List[Dict]:
         """Get user inventory with item details"""
         inventory = await self.inventories.find_one({"userId": user_id})
         
         if not inventory:
-            # Create default inventory
-            default_items = [
-                {"itemId": "item_6", "quantity": 5, "equipped": False},
-                {"itemId": "item_7", "quantity": 3, "equipped": False}, 
-                {"itemId": "item_8", "quantity": 1, "equipped": False},
-                {"itemId": "item_9", "quantity": 1, "equipped": False},
-                {"itemId": "item_10", "quantity": 1, "equipped": False}
-            ]
-            
-            new_inventory = {
-                "_id": f"inv_{user_id}",
-                "userId": user_id,
-                "items": default_items
-            }
-            await self.inventories.insert_one(new_inventory)
-            inventory = new_inventory
-
-        # Get item details
+            inventory = (await self.provision_player(user_id))["inventory"]
+
+        return await self.hydrate_inventory_items(inventory_entries(inventory))
+
+    async def hydrate_inventory_items(self, inv_items: List[Dict]) -> List[Dict]:
+        """Merge item details into inventory entries, keeping their order"""
+        catalog = await self.catalog.get()
+        item_docs = catalog.item_docs
+
+        # Items missing from the catalog are fetched in one batched query
+        missing_ids = list({inv["itemId"] for inv in inv_items if inv["itemId"] not in item_docs})
+        if missing_ids:
+            fetched = await self.items.find({"_id": {"$in": missing_ids}}).to_list(None)
+            item_docs = {**item_docs, **{doc["_id"]: doc for doc in fetched}}
+
         inventory_with_details = []
-        for inv_item in inventory["items"]:
-            item_data = await self.items.find_one({"_id": inv_item["itemId"]})
+        for inv_item in inv_items:
+            item_data = item_docs.get(inv_item["itemId"])
             if item_data:
                 item_with_quantity = {**item_data, **inv_item}
                 inventory_with_details.append(item_with_quantity)
                 
         return inventory_with_details
 
-    async def add_item_to_inventory(self, user_id: str, item_id: str, quantity: int = 1):
-        """Add item to inventory"""
-        # Check if inventory exists
-        inventory = await self.inventories.find_one({"userId": user_id})
-        
-        if not inventory:
-            # Create new inventory
-            new_inventory = {
-                "_id": f"inv_{user_id}",
-                "userId": user_id,
-                "items": [{"itemId": item_id, "quantity": quantity, "equipped": False}]
-            }
-            await self.inventories.insert_one(new_inventory)
-            return
-            
-        # Check if item already exists in inventory
-        existing_item_index = None
-        for i, item in enumerate(inventory["items"]):
-            if item["itemId"] == item_id:
-                existing_item_index = i
-                break
-                
-        if existing_item_index is not None:
-            # Update existing item quantity
-            await self.inventories.update_one(
-                {"userId": user_id},
-                {"$inc": {f"items.{existing_item_index}.quantity": quantity}}
-            )
-        else:
-            # Add new item
-            await self.inventories.update_one(
-                {"userId": user_id},
-                {"$push": {"items": {"itemId": item_id, "quantity": quantity, "equipped": False}}}
+    async def inventory_page(self, user_id: str, limit: Optional[int] = None, after: Optional[str] = None,
+                             item_ids: Optional[Collection[str]] = None,
+                             fields: Optional[Collection[str]] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Stored inventory entries in item id order, paged inside MongoDB.
+
+        Slots are filtered inside the document, and an inventory with no
+        matching slot still yields one empty row, so a missing inventory is
+        told apart from an empty page without another round trip.
+        """
+        conditions = [{"$gt": ["$$slot.v.quantity", 0]}]
+        if after is not None:
+            conditions.append({"$gt": ["$$slot.k", after]})
+        if item_ids is not None:
+            conditions.append({"$in": ["$$slot.k", list(item_ids)]})
+
+        output = {"_id": 0, "itemId": "$slot.k"}
+        if fields is None or "quantity" in fields:
+            output["quantity"] = "$slot.v.quantity"
+        if fields is None or "equipped" in fields:
+            output["equipped"] = {"$ifNull": ["$slot.v.equipped", False]}
+
+        pipeline = [
+            {"$match": {"userId": user_id, "slots": {"$exists": True}}},
+            {"$project": {"_id": 0, "slot": {"$filter": {
+                "input": {"$objectToArray": "$slots"}, "as": "slot", "cond": {"$and": conditions}
+            }}}},
+            {"$unwind": {"path": "$slot", "preserveNullAndEmptyArrays": True}},
+            {"$sort": {"slot.k": 1}},
+            *([{"$limit": limit}] if limit else []),
+            {"$project": output},
+        ]
+
+        rows = await self.inventories.aggregate(pipeline).to_list(None)
+        if not rows:
+            # New players and old layouts get their inventory prepared first
+            await self._prepare_inventory(user_id)
+            rows = await self.inventories.aggregate(pipeline).to_list(None)
+        inv_items = [row for row in rows if "itemId" in row]
+
+        next_after = inv_items[-1]["itemId"] if limit and len(inv_items) == limit else None
+        return inv_items, next_after
+
+    async def add_items_to_inventory(self, user_id: str, items: Dict[str, int]):
+        """Add several items to inventory in one write; raises if the inventory cannot be prepared"""
+        await self._add_items(user_id, items)
+
+    async def add_quest_items(self, user_id: str, claim_id: str, items: Dict[str, int]) -> bool:
+        """Add a claim's items once; False if they were already added"""
+        return await self._add_items(user_id, items, claim_id)
+
+    async def _add_items(self, user_id: str, items: Dict[str, int], claim_id: Optional[str] = None) -> bool:
+        check_quantities(items)
+        query = {"userId": user_id, "slots": {"$exists": True}}
+        update = {"$inc": {f"slots.{item_id}.quantity": quantity for item_id, quantity in items.items()}}
+        if claim_id is not None:
+            # Recorded in the same update, so the items go in at most once per claim
+            query["claimedQuests"] = {"$ne": claim_id}
+            update["$addToSet"] = {"claimedQuests": claim_id}
+
+        for _ in range(2):
+            result = await self.inventories.update_one(query, update)
+            if result.matched_count:
+                self._publish_change(user_id, "inventory")
+                return True
+            if claim_id is not None and await self.inventories.count_documents(
+                    {"userId": user_id, "claimedQuests": claim_id}, limit=1):
+                return False
+            await self._prepare_inventory(user_id)
+        # Callers may already have taken payment, so failing loudly lets them compensate
+        raise RuntimeError(f"Inventory of {user_id} could not be prepared")
+
+    async def remove_items_from_inventory(self, user_id: str, items: Dict[str, int]) -> bool:
+        """Remove several items in one write, only if enough of each is held"""
+        check_quantities(items)
+        guard = {f"slots.{item_id}.quantity": {"$gte": quantity} for item_id, quantity in items.items()}
+        decrements = {f"slots.{item_id}.quantity": -quantity for item_id, quantity in items.items()}
+        for _ in range(2):
+            inventory = await self.inventories.find_one_and_update(
+                {"userId": user_id, **guard},
+                {"$inc": decrements},
+                projection={path: 1 for path in decrements},
+                return_document=ReturnDocument.AFTER
             )
+            if inventory:
+                emptied = [item_id for item_id in items if inventory["slots"][item_id]["quantity"] <= 0]
+                if emptied:
+                    # Drop the slots, unless they were refilled in the meantime
+                    await self.inventories.bulk_write([
+                        UpdateOne(
+                            {"userId": user_id, f"slots.{item_id}.quantity": {"$lte": 0}},
+                            {"$unset": {f"slots.{item_id}": ""}}
+                        )
+                        for item_id in emptied
+                    ], ordered=False)
+                self._publish_change(user_id, "inventory")
+                return True
+            if not await self._migrate_inventory(user_id):
+                return False
+        return False
 
-    async def remove_item_from_inventory(self, user_id: str, item_id: str, quantity: int = 1):
-        """Remove item from inventory"""
-        inventory = await self.inventories.find_one({"userId": user_id})
-        if not inventory:
-            return False
-            
-        # Find item and update quantity
-        for i, item in enumerate(inventory["items"]):
-            if item["itemId"] == item_id:
-                new_quantity = item["quantity"] - quantity
-                if new_quantity <= 0:
-                    # Remove item completely
-                    await self.inventories.update_one(
-                        {"userId": user_id},
-                        {"$pull": {"items": {"itemId": item_id}}}
-                    )
-                else:
-                    # Update quantity
-                    await self.inventories.update_one(
-                        {"userId": user_id},
-                        {"$set": {f"items.{i}.quantity": new_quantity}}
-                    )
+    async def _prepare_inventory(self, user_id: str):
+        """Make sure the user has an inventory in the keyed layout"""
+        if not await self._migrate_inventory(user_id):
+            if not await self.inventories.count_documents({"userId": user_id}, limit=1):
+                await self.provision_player(user_id)
+
+    async def _migrate_inventory(self, user_id: str, inventory: Optional[Dict] = None) -> bool:
+        """Convert an array-layout inventory to the keyed layout.
+
+        Uses compare-and-swap on the old array, so writes racing with the
+        migration are never lost. Returns False if there was nothing to
+        migrate.
+        """
+        for _ in range(5):
+            if inventory is None:
+                inventory = await self.inventories.find_one({"userId": user_id, "items": {"$exists": True}})
+            if not inventory:
+                return False
+
+            result = await self.inventories.update_one(
+                {"_id": inventory["_id"], "items": inventory["items"]},
+                {"$set": {"slots": inventory_slots(inventory["items"])}, "$unset": {"items": ""}}
+            )
+            if result.modified_count:
                 return True
+            inventory = None
         return False
 
-    # Enemy methods
-    async def get_all_enemies(self) -> List[Enemy]:
-        """Get all enemies"""
-        enemies = await self.enemies.find({}).to_list(None)
-        return [Enemy(**enemy) for enemy in enemies]
-
-    async def get_enemy(self, enemy_id: str) -> Enemy:
-        """Get specific enemy"""
-        enemy_data = await self.enemies.find_one({"_id": enemy_id})
-        if enemy_data:
-            return Enemy(**enemy_data)
-        return None
+    async def migrate_inventories(self) -> int:
+        """Migrate every array-layout inventory; returns how many were converted"""
+        migrated = 0
+        async for inventory in self.inventories.find({"items": {"$exists": True}}):
+            if await self._migrate_inventory(inventory["userId"], inventory):
+                migrated += 1
+        return migrated
 
     # Quest methods
     async def get_user_quests(self, user_id: str) -> List[Dict]:
@@ -394,44 +762,175 @@ class GameDatabase:
         player_quests = await self.player_quests.find({"userId": user_id}).to_list(None)
         
         if not player_quests:
-            # Create default player quests
-            default_quests = [
-                {
-                    "_id": f"pq_{user_id}_1",
-                    "userId": user_id,
-                    "questId": "quest_1",
-                    "progress": 3,
-                    "completed": False,
-                    "active": True,
-                    "startedAt": datetime.utcnow()
-                },
-                {
-                    "_id": f"pq_{user_id}_2", 
-                    "userId": user_id,
-                    "questId": "quest_2",
-                    "progress": 12,
-                    "completed": False,
-                    "active": True,
-                    "startedAt": datetime.utcnow()
-                }
-            ]
-            await self.player_quests.insert_many(default_quests)
-            player_quests = default_quests
+            await self.provision_player(user_id)
+            player_quests = await self.player_quests.find({"userId": user_id}).to_list(None)
+
+        return await self.hydrate_player_quests(player_quests)
+
+    async def hydrate_player_quests(self, player_quests: List[Dict]) -> List[Dict]:
+        """Merge quest details into player quests, keeping their order"""
+        catalog = await self.catalog.get()
+        quest_docs = catalog.quest_docs
+
+        # Quests missing from the catalog are fetched in one batched query
+        missing_ids = list({pq["questId"] for pq in player_quests if pq["questId"] not in quest_docs})
+        if missing_ids:
+            fetched = await self.quests.find({"_id": {"$in": missing_ids}}).to_list(None)
+            quest_docs = {**quest_docs, **{doc["_id"]: doc for doc in fetched}}
 
-        # Get quest details
         quests_with_details = []
         for pq in player_quests:
-            quest_data = await self.quests.find_one({"_id": pq["questId"]})
+            quest_data = quest_docs.get(pq["questId"])
             if quest_data:
                 quest_with_progress = {**quest_data, **pq}
                 quests_with_details.append(quest_with_progress)
                 
         return quests_with_details
 
-    # Shop methods  
-    async def get_shop_items(self) -> List[Item]:
-        """Get all shop items"""
-        # For now, return some items as shop items
-        shop_item_ids = ["item_8", "item_9", "item_6", "item_7", "item_5", "item_10"]
-        items = await self.items.find({"_id": {"$in": shop_item_ids}}).to_list(None)
-        return [Item(**item) for item in items]
\ No newline at end of file
+    async def player_quests_page(self, user_id: str, limit: Optional[int] = None, after: Optional[str] = None,
+                                 quest_ids: Optional[Collection[str]] = None, active: Optional[bool] = None,
+                                 fields: Optional[Collection[str]] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Stored player quests in id order, walking the userId_id index.
+
+        A filtered first page also reports, in the same aggregation, whether
+        the user has any quests, so an empty page needs no extra count.
+        """
+        query = {}
+        if after is not None:
+            query["_id"] = {"$gt": after}
+        if quest_ids is not None:
+            query["questId"] = {"$in": list(quest_ids)}
+        if active is not None:
+            query["active"] = active
+        projection = None if fields is None else {"questId": 1, **dict.fromkeys(fields, 1)}
+
+        for _ in range(2):
+            if after is not None or not query:
+                # A zero limit means no limit to MongoDB
+                cursor = self.player_quests.find({"userId": user_id, **query}, projection).sort("_id", 1)
+                player_quests = await cursor.limit(limit or 0).to_list(None)
+                provisioned = player_quests or after is not None
+            else:
+                page = [{"$match": query}, {"$sort": {"_id": 1}}, *([{"$limit": limit}] if limit else [])]
+                if projection:
+                    page.append({"$project": projection})
+                result = await self.player_quests.aggregate([
+                    {"$match": {"userId": user_id}},
+                    {"$facet": {"page": page, "any": [{"$limit": 1}, {"$project": {"_id": 1}}]}}
+                ]).to_list(None)
+                player_quests = result[0]["page"] if result else []
+                provisioned = bool(result and result[0]["any"])
+            if provisioned:
+                break
+            await self.provision_player(user_id)
+
+        next_after = player_quests[-1]["_id"] if limit and len(player_quests) == limit else None
+        return player_quests, next_after
+
+    async def add_quest_progress(self, increments: Dict[Tuple[str, str], int],
+                                 maxima: Dict[Tuple[str, str], int]):
+        """Update the progress of active player quests in one bulk write"""
+        writes = [
+            UpdateOne({"userId": user_id, "questId": quest_id, "active": True}, {"$inc": {"progress": amount}})
+            for (user_id, quest_id), amount in increments.items()
+        ]
+        writes.extend(
+            UpdateOne({"userId": user_id, "questId": quest_id, "active": True}, {"$max": {"progress": value}})
+            for (user_id, quest_id), value in maxima.items()
+        )
+        if writes:
+            await self.player_quests.bulk_write(writes, ordered=False)
+            for user_id in {user_id for user_id, _ in (*increments, *maxima)}:
+                self._publish_change(user_id, "quests")
+
+    async def claim_player_quest(self, user_id: str, quest_id: str) -> Optional[str]:
+        """Mark an active player quest completed with its reward pending, in one write"""
+        player_quest = await self.player_quests.find_one_and_update(
+            {"userId": user_id, "questId": quest_id, "$or": [{"active": True}, {"rewardPending": True}]},
+            {"$set": {"completed": True, "active": False, "rewardPending": True}},
+            projection={"_id": 1, "active": 1}
+        )
+        if not player_quest:
+            return None
+        if player_quest["active"]:
+            self._publish_change(user_id, "quests")
+        return player_quest["_id"]
+
+    async def grant_quest_rewards(self, user_id: str, claim_id: str, experience: int = 0,
+                                  gold: int = 0) -> Optional[Character]:
+        """Add a claim's experience and gold once, recording the claim on the character"""
+        return await self._modify_character(
+            user_id,
+            {"claimedQuests": {"$ne": claim_id}},
+            {"$inc": {"experience": experience, "gold": gold}, "$addToSet": {"claimedQuests": claim_id}}
+        )
+
+    async def finish_player_quest_claim(self, user_id: str, claim_id: str):
+        """Clear the pending reward once it is fully paid"""
+        await self.player_quests.update_one({"_id": claim_id}, {"$unset": {"rewardPending": ""}})
+
+    # Leaderboard methods
+    @staticmethod
+    def _rank_filter(metric: str, after: Optional[Tuple[int, str]], ahead: bool) -> Dict:
+        if after is None:
+            return {}
+        value, user_id = after
+        if ahead:
+            return {"$or": [{metric: {"$gt": value}}, {metric: value, "_id": {"$lt": user_id}}]}
+        return {"$or": [{metric: {"$lt": value}}, {metric: value, "_id": {"$gt": user_id}}]}
+
+    async def leaderboard_page(self, metric: str, limit: int, after: Optional[Tuple[int, str]] = None,
+                               ahead: bool = False) -> List[Dict]:
+        """Players ranked by metric, walking its rank index from the cursor"""
+        return await self._stored_leaderboard_page(metric, limit, after, ahead)
+
+    async def _stored_leaderboard_page(self, metric: str, limit: int, after: Optional[Tuple[int, str]],
+                                       ahead: bool, exclude: Collection[str] = ()) -> List[Dict]:
+        if limit < 1:
+            # A zero limit means no limit to MongoDB
+            return []
+        query = self._rank_filter(metric, after, ahead)
+        if exclude:
+            query["_id"] = {"$nin": list(exclude)}
+        order = 1 if ahead else -1
+        cursor = self.characters.find(
+            query,
+            dict.fromkeys(LEADERBOARD_FIELDS, 1)
+        ).sort([(metric, order), ("_id", -order)]).limit(limit)
+        return [leaderboard_entry(char_data) async for char_data in cursor]
+
+    async def leaderboard_rank(self, metric: str, value: int, user_id: str) -> Optional[int]:
+        """Not counted: the index would have to be walked over every player above"""
+        return None
+
+    async def leaderboard_histogram(self, metric: str, buckets: int) -> List[Tuple[int, int, int]]:
+        """Players per value range, estimated from a random sample of characters.
+
+        The sample size is fixed, so the cost does not grow with the number
+        of players; collections smaller than the sample are read whole.
+        """
+        total = await self.characters.estimated_document_count()
+        size = buckets * HISTOGRAM_SAMPLE_PER_BUCKET
+        if total <= size:
+            pipeline = [{"$project": {"_id": 0, metric: 1}}]
+        else:
+            pipeline = [{"$sample": {"size": size}}, {"$project": {"_id": 0, metric: 1}}]
+        rows = await self.characters.aggregate(pipeline).to_list(None)
+        values = sorted((row[metric] for row in rows if metric in row), reverse=True)
+        return value_histogram(values, buckets, max(total, len(values)))
+
+    # Battle methods
+    async def load_battle(self, battle_id: str) -> Optional[Battle]:
+        """Get a stored battle"""
+        battle_data = await self.battles.find_one({"_id": battle_id})
+        if battle_data:
+            return construct_trusted(Battle, battle_data)
+        return None
+
+    async def save_battles(self, battles: List[Battle]):
+        """Store battles, replacing earlier versions"""
+        if battles:
+            await self.battles.bulk_write(
+                [ReplaceOne({"_id": battle.id}, battle.model_dump(by_alias=True), upsert=True) for battle in battles],
+                ordered=False
+            )
@@ -0,0 +1,118 @@
+import asyncio
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Tuple
+
+from models import QuestType
+from storage import GameStorage
+
+
+@dataclass(frozen=True, slots=True)
+class GameEvent:
+    """Something a player did that quests may count"""
+    type: QuestType
+    userId: str
+    # Enemy name for kills, "gold" or an item id for collecting, None for levels
+    target: Optional[str] = None
+    amount: int = 1
+
+
+class GameEventBus:
+    """Delivers game events to in-process subscribers.
+
+    Handlers run synchronously inside ``publish`` and must not block, so
+    publishing never adds a round trip to the request that caused it.
+    """
+
+    def __init__(self):
+        self._handlers: List[Callable[[GameEvent], None]] = []
+
+    def subscribe(self, handler: Callable[[GameEvent], None]):
+        self._handlers.append(handler)
+
+    def publish(self, *events: GameEvent):
+        for event in events:
+            for handler in self._handlers:
+                handler(event)
+
+
+class QuestProgressTracker:
+    """Counts game events towards the quests they match, write-behind.
+
+    Events are matched through an index of catalog quests keyed by
+    (quest type, target), rebuilt whenever the catalog version changes.
+    Matches are summed in memory per player quest and written in one bulk
+    update every ``flush_interval`` seconds, and once more on shutdown.
+    Kill and collect quests add up amounts; level quests keep the highest
+    level seen. Only active player quests are updated.
+    """
+
+    def __init__(self, db: GameStorage, flush_interval: float = 1.0):
+        self.db = db
+        self.flush_interval = flush_interval
+
+        self._index: Dict[Tuple[QuestType, Optional[str]], List[str]] = {}
+        self._index_version = None
+        self._increments: Dict[Tuple[str, str], int] = defaultdict(int)
+        self._maxima: Dict[Tuple[str, str], int] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def _quest_index(self) -> Dict[Tuple[QuestType, Optional[str]], List[str]]:
+        catalog = self.db.catalog.snapshot
+        if catalog is not None and catalog.version != self._index_version:
+            index = defaultdict(list)
+            for quest_id, quest in catalog.quests.items():
+                if quest.isActive:
+                    index[(quest.type, quest.target)].append(quest_id)
+            self._index = dict(index)
+            self._index_version = catalog.version
+        return self._index
+
+    def handle(self, event: GameEvent):
+        """Queue progress for every quest the event matches"""
+        for quest_id in self._quest_index().get((event.type, event.target), ()):
+            key = (event.userId, quest_id)
+            if event.type == QuestType.level:
+                self._maxima[key] = max(self._maxima.get(key, 0), event.amount)
+            else:
+                self._increments[key] += event.amount
+
+    async def flush(self):
+        """Write all queued progress in one batch"""
+        if not self._increments and not self._maxima:
+            return
+        increments, self._increments = self._increments, defaultdict(int)
+        maxima, self._maxima = self._maxima, {}
+        try:
+            await self.db.add_quest_progress(increments, maxima)
+        except Exception:
+            # Keep it queued for the next attempt
+            for key, amount in increments.items():
+                self._increments[key] += amount
+            for key, level in maxima.items():
+                self._maxima[key] = max(self._maxima.get(key, 0), level)
+            raise
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Error flushing quest progress: {e}")
+
+    def start(self):
+        """Start the periodic flush task"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the flush task and write out everything queued"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
@@ -0,0 +1,64 @@
+import hashlib
+import json
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+
+from catalog import CatalogCache, CatalogSnapshot
+
+
+def render_json(content) -> bytes:
+    """Serialize content the same way FastAPI's JSONResponse does"""
+    return json.dumps(
+        jsonable_encoder(content),
+        ensure_ascii=False,
+        allow_nan=False,
+        indent=None,
+        separators=(",", ":"),
+    ).encode("utf-8")
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an If-None-Match header against an ETag"""
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+class CatalogResponseCache:
+    """Pre-serialized JSON bodies for catalog routes.
+
+    A body is built once per catalog snapshot and served as raw bytes with
+    an ETag derived from its content, so identical catalogs produce the
+    same ETag on every worker.
+    """
+
+    def __init__(self):
+        self._bodies: Dict[str, Tuple[CatalogSnapshot, bytes, str]] = {}
+
+    async def get(self, key: str, catalog: CatalogCache,
+                  build: Callable[[], Awaitable[object]]) -> Tuple[bytes, str]:
+        """Get the body and ETag for a route, rebuilding on a new catalog version"""
+        snapshot = await catalog.get()
+        cached = self._bodies.get(key)
+        if cached and cached[0] is snapshot:
+            return cached[1], cached[2]
+
+        body = render_json(await build())
+        etag = f'"{hashlib.sha1(body).hexdigest()}"'
+        self._bodies[key] = (snapshot, body, etag)
+        return body, etag
+
+    async def respond(self, request: Request, key: str, catalog: CatalogCache,
+                      build: Callable[[], Awaitable[object]]) -> Response:
+        """Serve a cached body, or 304 if the client already has it"""
+        body, etag = await self.get(key, catalog, build)
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        return Response(content=body, media_type="application/json", headers=headers)
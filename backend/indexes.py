@@ -0,0 +1,93 @@
+from dataclasses import dataclass, field
+from typing import Dict, List, Tuple, Union
+
+from pymongo.errors import PyMongoError
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    """An index the game expects to exist on a collection"""
+    collection: str
+    # Direction 1 or -1, or an index kind such as "hashed" or "text"
+    keys: Tuple[Tuple[str, Union[int, str]], ...]
+    name: str
+    unique: bool = False
+
+
+# Indexes backing the per-player lookups and the leaderboards
+REQUIRED_INDEXES = [
+    IndexSpec("inventories", (("userId", 1),), "userId_unique", unique=True),
+    IndexSpec(
+        "player_quests",
+        (("userId", 1), ("questId", 1), ("active", 1)),
+        "userId_questId_active",
+    ),
+    IndexSpec("player_quests", (("userId", 1), ("_id", 1)), "userId_id"),
+    # Leaderboard ranking, ties broken by id so cursors are stable
+    IndexSpec("characters", (("level", -1), ("_id", 1)), "level_rank"),
+    IndexSpec("characters", (("experience", -1), ("_id", 1)), "experience_rank"),
+    IndexSpec("characters", (("gold", -1), ("_id", 1)), "gold_rank"),
+]
+
+
+@dataclass
+class IndexReport:
+    """Outcome of an index check, by "collection.name" """
+    present: List[str] = field(default_factory=list)
+    created: List[str] = field(default_factory=list)
+    missing: List[str] = field(default_factory=list)
+
+
+def _direction(direction) -> Union[int, str]:
+    """Key direction as declared; the server may report 1 as 1.0, while kinds like "hashed" stay strings"""
+    return int(direction) if isinstance(direction, (int, float)) else direction
+
+
+class IndexManager:
+    """Checks the required indexes and creates any that are missing"""
+
+    def __init__(self, db, specs: List[IndexSpec] = None):
+        self.db = db
+        self.specs = REQUIRED_INDEXES if specs is None else specs
+
+    async def _existing(self, collection: str) -> Dict[Tuple, dict]:
+        info = await self.db[collection].index_information()
+        return {tuple((k, _direction(d)) for k, d in index["key"]): index for index in info.values()}
+
+    def _matches(self, spec: IndexSpec, existing: Dict[Tuple, dict]) -> bool:
+        index = existing.get(spec.keys)
+        return index is not None and bool(index.get("unique", False)) == spec.unique
+
+    async def verify(self) -> IndexReport:
+        """Report which required indexes are present without creating any"""
+        report = IndexReport()
+        cache = {}
+        for spec in self.specs:
+            if spec.collection not in cache:
+                cache[spec.collection] = await self._existing(spec.collection)
+            label = f"{spec.collection}.{spec.name}"
+            if self._matches(spec, cache[spec.collection]):
+                report.present.append(label)
+            else:
+                report.missing.append(label)
+        return report
+
+    async def ensure(self) -> IndexReport:
+        """Create missing indexes; anything that could not be built stays missing"""
+        report = await self.verify()
+        specs = {f"{spec.collection}.{spec.name}": spec for spec in self.specs}
+
+        still_missing = []
+        for label in report.missing:
+            spec = specs[label]
+            try:
+                await self.db[spec.collection].create_index(
+                    list(spec.keys), name=spec.name, unique=spec.unique
+                )
+                report.created.append(label)
+            except PyMongoError as e:
+                print(f"Error creating index {label}: {e}")
+                still_missing.append(label)
+
+        report.missing = still_missing
+        return report
@@ -0,0 +1,160 @@
+import asyncio
+import bisect
+import time
+from typing import Dict, List, Optional, Tuple
+
+from models import Character, LeaderboardMetric
+from pagination import decode_cursor, encode_cursor
+from storage import GameStorage, leaderboard_entry
+
+
+def encode_rank_cursor(entry: Dict, metric: str) -> str:
+    """Cursor for the position right after this entry"""
+    return encode_cursor([entry[metric], entry["userId"], entry["rank"]])
+
+
+def decode_rank_cursor(cursor: str) -> Tuple[int, str, int]:
+    """(value, user id, rank) of a cursor; raises ValueError if malformed"""
+    position = decode_cursor(cursor)
+    if len(position) != 3:
+        raise ValueError("Invalid cursor")
+    value, user_id, rank = position
+    if not isinstance(value, int) or not isinstance(user_id, str) or not isinstance(rank, int):
+        raise ValueError("Invalid cursor")
+    return value, user_id, rank
+
+
+def estimate_rank(histogram: List[Tuple[int, int, int]], value: int) -> int:
+    """Approximate 1-based rank of a value, taking values as spread evenly within each range"""
+    above = 0.0
+    for lowest, highest, count in histogram:
+        if lowest > value:
+            above += count
+        elif highest > value:
+            above += count * (highest - value) / (highest - lowest + 1)
+        else:
+            break
+    return int(above) + 1
+
+
+def _key(metric: str, entry: Dict) -> Tuple[int, str]:
+    return -entry[metric], entry["userId"]
+
+
+class _Board:
+    __slots__ = ("entries", "keys", "complete", "loaded_at")
+
+    def __init__(self, metric: str, entries: List[Dict], size: int):
+        self.entries = entries
+        self.keys = [_key(metric, entry) for entry in entries]
+        # Whether every player fits on the board
+        self.complete = len(entries) < size
+        self.loaded_at = time.monotonic()
+
+
+class LeaderboardCache:
+    """Top ``size`` players per metric, held in memory.
+
+    Each board is loaded from storage on first use and again every
+    ``refresh_interval`` seconds, which also picks up changes made by other
+    processes. In between, characters changed in this process are merged
+    in place through ``observe``. When a listed player drops below the last
+    place, whoever takes their spot is unknown, so that board is dropped
+    and reloaded on the next read.
+
+    Ranks on the board are exact. Below it, storage that cannot count a
+    rank cheaply is asked for a histogram of ``histogram_buckets`` value
+    ranges every ``histogram_interval`` seconds, and ranks are estimated
+    from that.
+    """
+
+    def __init__(self, db: GameStorage, size: int = 100, refresh_interval: float = 30.0,
+                 histogram_buckets: int = 100, histogram_interval: float = 300.0):
+        self.db = db
+        self.size = size
+        self.refresh_interval = refresh_interval
+        self.histogram_buckets = histogram_buckets
+        self.histogram_interval = histogram_interval
+
+        self._boards: Dict[str, _Board] = {}
+        self._histograms: Dict[str, Tuple[float, List[Tuple[int, int, int]]]] = {}
+        self._lock = asyncio.Lock()
+
+    async def _board(self, metric: str) -> _Board:
+        board = self._boards.get(metric)
+        if board is not None and time.monotonic() - board.loaded_at < self.refresh_interval:
+            return board
+
+        async with self._lock:
+            # Another task may have reloaded while we waited for the lock
+            board = self._boards.get(metric)
+            if board is None or time.monotonic() - board.loaded_at >= self.refresh_interval:
+                board = _Board(metric, await self.db.leaderboard_page(metric, self.size), self.size)
+                self._boards[metric] = board
+            return board
+
+    async def top(self, metric: str, limit: int) -> Optional[List[Dict]]:
+        """Best ``limit`` players with their ranks, or None if that is more than the board holds"""
+        if limit > self.size:
+            return None
+        board = await self._board(metric)
+        return [{"rank": rank, **entry} for rank, entry in enumerate(board.entries[:limit], start=1)]
+
+    async def rank(self, metric: str, value: int, user_id: str) -> Tuple[int, bool]:
+        """1-based rank of the player at this position, and whether it is exact"""
+        board = await self._board(metric)
+        key = (-value, user_id)
+        if board.complete or (board.keys and key <= board.keys[-1]):
+            ahead = bisect.bisect_left(board.keys, key)
+            # The board may still list the player at an older position
+            if any(entry["userId"] == user_id for entry in board.entries[:ahead]):
+                ahead -= 1
+            return ahead + 1, True
+
+        rank = await self.db.leaderboard_rank(metric, value, user_id)
+        if rank is not None:
+            return rank, True
+        histogram = await self._histogram(metric)
+        # Known to be below everyone on the board
+        return max(estimate_rank(histogram, value), len(board.entries) + 1), False
+
+    async def _histogram(self, metric: str) -> List[Tuple[int, int, int]]:
+        cached = self._histograms.get(metric)
+        if cached is not None and time.monotonic() - cached[0] < self.histogram_interval:
+            return cached[1]
+
+        async with self._lock:
+            cached = self._histograms.get(metric)
+            if cached is None or time.monotonic() - cached[0] >= self.histogram_interval:
+                cached = time.monotonic(), await self.db.leaderboard_histogram(metric, self.histogram_buckets)
+                self._histograms[metric] = cached
+            return cached[1]
+
+    def observe(self, character: Character):
+        """Merge a changed character into every loaded board"""
+        entry = leaderboard_entry(character.model_dump(by_alias=True))
+        for metric in LeaderboardMetric:
+            board = self._boards.get(metric.value)
+            if board is not None:
+                self._merge(metric.value, board, entry)
+
+    def _merge(self, metric: str, board: _Board, entry: Dict):
+        listed = False
+        for index, current in enumerate(board.entries):
+            if current["userId"] == entry["userId"]:
+                del board.entries[index]
+                del board.keys[index]
+                listed = True
+                break
+
+        key = _key(metric, entry)
+        if board.complete or (board.keys and key < board.keys[-1]):
+            index = bisect.bisect_left(board.keys, key)
+            board.entries.insert(index, entry)
+            board.keys.insert(index, key)
+            if len(board.entries) > self.size:
+                board.entries.pop()
+                board.keys.pop()
+                board.complete = False
+        elif listed:
+            del self._boards[metric]
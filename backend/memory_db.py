@@ -0,0 +1,474 @@
+import asyncio
+import bisect
+import os
+from copy import deepcopy
+from datetime import datetime
+from typing import Collection, Dict, List, Optional, Tuple, Union
+
+from bson import json_util
+
+from catalog import CatalogCache
+from database import (
+    DEFAULT_INVENTORY_ITEMS, SAMPLE_ENEMIES, SAMPLE_ITEMS, SAMPLE_QUESTS, STARTER_QUESTS,
+    default_character, inventory_entries, inventory_slots,
+)
+from models import Battle, Character, CharacterUpdate, LeaderboardMetric
+from serialization import construct_trusted
+from storage import GameStorage, check_amount, check_quantities, leaderboard_entry, project, value_histogram
+
+
+def _copy_value(value):
+    if isinstance(value, dict):
+        return {key: _copy_value(v) for key, v in value.items()}
+    if isinstance(value, list):
+        return [_copy_value(v) for v in value]
+    return value
+
+
+def _copy_documents(collection: Dict[str, Dict]) -> List[Dict]:
+    """Documents of a collection with their dicts and lists copied; leaves are immutable"""
+    return [_copy_value(doc) for doc in collection.values()]
+
+
+class InMemoryGameDatabase(GameStorage):
+    """Game storage held in process memory, with optional snapshots to disk.
+
+    Documents keep the same shape as in MongoDB, so responses are
+    identical. No operation awaits between reading and writing a document,
+    which makes each one atomic on the event loop, like the guarded
+    MongoDB updates. With a ``snapshot_path`` the state is loaded at
+    startup and saved every ``snapshot_interval`` seconds and on stop.
+    """
+
+    def __init__(self, snapshot_path: Optional[str] = None, snapshot_interval: float = 60.0):
+        super().__init__()
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+
+        # Collections, keyed by _id (inventories by userId)
+        self.characters: Dict[str, Dict] = {}
+        self.items: Dict[str, Dict] = {}
+        self.inventories: Dict[str, Dict] = {}
+        self.enemies: Dict[str, Dict] = {}
+        self.quests: Dict[str, Dict] = {}
+        self.player_quests: Dict[str, Dict] = {}
+        self.battles: Dict[str, Dict] = {}
+
+        # Player quest ids by userId, in insertion order
+        self._player_quest_ids: Dict[str, List[str]] = {}
+
+        # Sorted (-value, userId) keys per leaderboard metric, kept up to date on
+        # character writes, and the key each character is currently ranked under
+        self._rank_keys: Dict[str, List[Tuple[int, str]]] = {metric.value: [] for metric in LeaderboardMetric}
+        self._ranked: Dict[str, Dict[str, Tuple[int, str]]] = {metric.value: {} for metric in LeaderboardMetric}
+
+        self.catalog = CatalogCache(self._load_catalog)
+        self._task: Optional[asyncio.Task] = None
+
+    async def _load_catalog(self):
+        return (
+            deepcopy(list(self.items.values())),
+            deepcopy(list(self.enemies.values())),
+            deepcopy(list(self.quests.values()))
+        )
+
+    # Lifecycle
+    async def initialize_game_data(self):
+        """Load the last snapshot, then seed anything still empty"""
+        if self.snapshot_path and os.path.exists(self.snapshot_path):
+            self.load_snapshot()
+            print(f"✅ Snapshot loaded from {self.snapshot_path}")
+
+        for collection, sample in ((self.items, SAMPLE_ITEMS), (self.enemies, SAMPLE_ENEMIES),
+                                   (self.quests, SAMPLE_QUESTS)):
+            if not collection:
+                collection.update({doc["_id"]: deepcopy(doc) for doc in sample})
+                self.catalog.invalidate()
+
+    async def start(self):
+        """Start periodic snapshots, if a snapshot path is set"""
+        if self.snapshot_path and self._task is None:
+            self._task = asyncio.create_task(self._snapshot_loop())
+
+    async def stop(self):
+        """Stop periodic snapshots and save a final one"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.snapshot_path:
+            await self.save_snapshot()
+
+    async def _snapshot_loop(self):
+        while True:
+            await asyncio.sleep(self.snapshot_interval)
+            try:
+                await self.save_snapshot()
+            except Exception as e:
+                print(f"Error saving snapshot: {e}")
+
+    async def save_snapshot(self):
+        """Write all collections to the snapshot file, replacing it atomically.
+
+        Documents are mutated in place, so their containers are copied on
+        the loop, where no write can interleave; encoding and writing the
+        file then run in a thread so requests are not held up by them.
+        """
+        state = {
+            "characters": _copy_documents(self.characters),
+            "items": _copy_documents(self.items),
+            "inventories": _copy_documents(self.inventories),
+            "enemies": _copy_documents(self.enemies),
+            "quests": _copy_documents(self.quests),
+            "player_quests": _copy_documents(self.player_quests),
+            "battles": _copy_documents(self.battles),
+        }
+        await asyncio.to_thread(self._write_snapshot, state)
+
+    def _write_snapshot(self, state: Dict[str, List[Dict]]):
+        tmp_path = f"{self.snapshot_path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(json_util.dumps(state))
+        os.replace(tmp_path, self.snapshot_path)
+
+    def load_snapshot(self):
+        """Replace all collections with the snapshot file's contents"""
+        with open(self.snapshot_path) as f:
+            state = json_util.loads(f.read())
+
+        self.characters = {doc["_id"]: doc for doc in state.get("characters", [])}
+        self.items = {doc["_id"]: doc for doc in state.get("items", [])}
+        self.inventories = {doc["userId"]: doc for doc in state.get("inventories", [])}
+        self.enemies = {doc["_id"]: doc for doc in state.get("enemies", [])}
+        self.quests = {doc["_id"]: doc for doc in state.get("quests", [])}
+        self.player_quests = {doc["_id"]: doc for doc in state.get("player_quests", [])}
+        self.battles = {doc["_id"]: doc for doc in state.get("battles", [])}
+
+        self._player_quest_ids = {}
+        for pq in self.player_quests.values():
+            self._player_quest_ids.setdefault(pq["userId"], []).append(pq["_id"])
+
+        for metric in self._rank_keys:
+            self._ranked[metric] = {
+                user_id: (-char_data[metric], user_id) for user_id, char_data in self.characters.items()
+            }
+            self._rank_keys[metric] = sorted(self._ranked[metric].values())
+        self.catalog.invalidate()
+
+    # Players
+    async def provision_player(self, user_id: str) -> Dict:
+        """Create the default character, inventory and starter quests if missing"""
+        if user_id not in self.characters:
+            self.characters[user_id] = default_character(user_id).model_dump(by_alias=True)
+            self._rerank(self.characters[user_id])
+        if user_id not in self.inventories:
+            self.inventories[user_id] = {
+                "_id": f"inv_{user_id}",
+                "userId": user_id,
+                "slots": inventory_slots(DEFAULT_INVENTORY_ITEMS)
+            }
+
+        now = datetime.utcnow()
+        quest_ids = self._player_quest_ids.setdefault(user_id, [])
+        for i, (quest_id, progress) in enumerate(STARTER_QUESTS, start=1):
+            pq_id = f"pq_{user_id}_{i}"
+            if pq_id not in self.player_quests:
+                self.player_quests[pq_id] = {
+                    "_id": pq_id,
+                    "userId": user_id,
+                    "questId": quest_id,
+                    "progress": progress,
+                    "completed": False,
+                    "active": True,
+                    "startedAt": now
+                }
+                quest_ids.append(pq_id)
+
+        return {"character": self.characters[user_id], "inventory": self.inventories[user_id]}
+
+    # Character methods
+    async def _character_doc(self, user_id: str) -> Dict:
+        if user_id not in self.characters:
+            await self.provision_player(user_id)
+        return self.characters[user_id]
+
+    async def get_character(self, user_id: str) -> Character:
+        """Get character by user ID, create if doesn't exist"""
+        return construct_trusted(Character, await self._character_doc(user_id))
+
+    def _character_written(self, char_data: Dict):
+        self._rerank(char_data)
+        self._publish_change(char_data["_id"], "character")
+
+    def _rerank(self, char_data: Dict):
+        """Move the character to its new place on every leaderboard it moved on"""
+        user_id = char_data["_id"]
+        for metric, keys in self._rank_keys.items():
+            key = (-char_data[metric], user_id)
+            previous = self._ranked[metric].get(user_id)
+            if previous == key:
+                continue
+            if previous is not None:
+                del keys[bisect.bisect_left(keys, previous)]
+            bisect.insort(keys, key)
+            self._ranked[metric][user_id] = key
+
+    async def update_character(self, user_id: str, updates: CharacterUpdate,
+                               projection: Optional[Dict] = None) -> Union[Character, Dict]:
+        """Update character data and return the updated document"""
+        char_data = await self._character_doc(user_id)
+        char_data.update({k: v for k, v in updates.model_dump().items() if v is not None})
+        char_data["updatedAt"] = datetime.utcnow()
+        self._character_written(char_data)
+
+        if projection:
+            return {k: deepcopy(v) for k, v in char_data.items() if k == "_id" or projection.get(k)}
+        return construct_trusted(Character, char_data)
+
+    async def spend_gold(self, user_id: str, amount: int) -> Optional[Character]:
+        """Deduct gold only if the character has at least that much"""
+        check_amount(amount)
+        char_data = await self._character_doc(user_id)
+        if char_data["gold"] < amount:
+            return None
+        char_data["gold"] -= amount
+        char_data["updatedAt"] = datetime.utcnow()
+        self._character_written(char_data)
+        return construct_trusted(Character, char_data)
+
+    async def grant_rewards(self, user_id: str, experience: int = 0, gold: int = 0) -> Optional[Character]:
+        """Add experience and gold"""
+        char_data = await self._character_doc(user_id)
+        char_data["experience"] += experience
+        char_data["gold"] += gold
+        char_data["updatedAt"] = datetime.utcnow()
+        self._character_written(char_data)
+        return construct_trusted(Character, char_data)
+
+    async def _restore(self, user_id: str, field: str, max_field: str, amount: int) -> Character:
+        char_data = await self._character_doc(user_id)
+        char_data[field] = max(0, min(char_data[field] + amount, char_data[max_field]))
+        char_data["updatedAt"] = datetime.utcnow()
+        self._character_written(char_data)
+        return construct_trusted(Character, char_data)
+
+    async def restore_health(self, user_id: str, amount: int) -> Optional[Character]:
+        """Heal the character, capped at maxHealth"""
+        return await self._restore(user_id, "health", "maxHealth", amount)
+
+    async def restore_mana(self, user_id: str, amount: int) -> Optional[Character]:
+        """Restore mana, capped at maxMana"""
+        return await self._restore(user_id, "mana", "maxMana", amount)
+
+    # Inventory methods
+    async def get_inventory(self, user_id: str) -> List[Dict]:
+        """Get user inventory with item details"""
+        if user_id not in self.inventories:
+            await self.provision_player(user_id)
+
+        return await self.hydrate_inventory_items(inventory_entries(self.inventories[user_id]))
+
+    async def hydrate_inventory_items(self, inv_items: List[Dict]) -> List[Dict]:
+        """Merge item details into inventory entries, keeping their order"""
+        catalog = await self.catalog.get()
+        inventory_with_details = []
+        for inv_item in inv_items:
+            item_data = catalog.item_docs.get(inv_item["itemId"])
+            if item_data:
+                inventory_with_details.append({**item_data, **inv_item})
+        return inventory_with_details
+
+    async def inventory_page(self, user_id: str, limit: Optional[int] = None, after: Optional[str] = None,
+                             item_ids: Optional[Collection[str]] = None,
+                             fields: Optional[Collection[str]] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Stored inventory entries in item id order, starting after an item id"""
+        if user_id not in self.inventories:
+            await self.provision_player(user_id)
+
+        wanted = None if item_ids is None else set(item_ids)
+        slots = self.inventories[user_id]["slots"]
+        page_ids = sorted(
+            item_id for item_id, slot in slots.items()
+            if slot["quantity"] > 0 and (after is None or item_id > after) and (wanted is None or item_id in wanted)
+        )[:limit or None]
+
+        inv_items = []
+        for item_id in page_ids:
+            inv_item = {"itemId": item_id, "quantity": slots[item_id]["quantity"],
+                        "equipped": slots[item_id].get("equipped", False)}
+            inv_items.append(project(inv_item, fields, ("itemId",)))
+
+        next_after = page_ids[-1] if limit and len(page_ids) == limit else None
+        return inv_items, next_after
+
+    async def add_items_to_inventory(self, user_id: str, items: Dict[str, int]):
+        """Add several items to inventory in one write"""
+        check_quantities(items)
+        if user_id not in self.inventories:
+            await self.provision_player(user_id)
+        slots = self.inventories[user_id]["slots"]
+        for item_id, quantity in items.items():
+            slot = slots.setdefault(item_id, {"quantity": 0, "equipped": False})
+            slot["quantity"] += quantity
+        self._publish_change(user_id, "inventory")
+
+    async def remove_items_from_inventory(self, user_id: str, items: Dict[str, int]) -> bool:
+        """Remove several items in one write, only if enough of each is held"""
+        check_quantities(items)
+        inventory = self.inventories.get(user_id)
+        if not inventory:
+            return False
+        slots = inventory["slots"]
+        for item_id, quantity in items.items():
+            if item_id not in slots or slots[item_id]["quantity"] < quantity:
+                return False
+        for item_id, quantity in items.items():
+            slots[item_id]["quantity"] -= quantity
+            if slots[item_id]["quantity"] <= 0:
+                del slots[item_id]
+        self._publish_change(user_id, "inventory")
+        return True
+
+    # Quest methods
+    async def get_user_quests(self, user_id: str) -> List[Dict]:
+        """Get user quests with details"""
+        if not self._player_quest_ids.get(user_id):
+            await self.provision_player(user_id)
+
+        return await self.hydrate_player_quests(
+            [self.player_quests[pq_id] for pq_id in self._player_quest_ids[user_id]]
+        )
+
+    async def hydrate_player_quests(self, player_quests: List[Dict]) -> List[Dict]:
+        """Merge quest details into player quests, keeping their order"""
+        catalog = await self.catalog.get()
+        quests_with_details = []
+        for pq in player_quests:
+            quest_data = catalog.quest_docs.get(pq["questId"])
+            if quest_data:
+                quests_with_details.append({**quest_data, **pq})
+        return quests_with_details
+
+    async def player_quests_page(self, user_id: str, limit: Optional[int] = None, after: Optional[str] = None,
+                                 quest_ids: Optional[Collection[str]] = None, active: Optional[bool] = None,
+                                 fields: Optional[Collection[str]] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Stored player quests in id order, starting after a player quest id"""
+        if not self._player_quest_ids.get(user_id):
+            await self.provision_player(user_id)
+
+        wanted = None if quest_ids is None else set(quest_ids)
+        page = sorted(
+            (self.player_quests[pq_id] for pq_id in self._player_quest_ids[user_id]),
+            key=lambda pq: pq["_id"]
+        )
+        page = [
+            pq for pq in page
+            if (after is None or pq["_id"] > after) and (wanted is None or pq["questId"] in wanted)
+            and (active is None or pq["active"] == active)
+        ][:limit or None]
+
+        next_after = page[-1]["_id"] if limit and len(page) == limit else None
+        return [project(pq, fields, ("_id", "questId")) for pq in page], next_after
+
+    async def add_quest_progress(self, increments: Dict[Tuple[str, str], int],
+                                 maxima: Dict[Tuple[str, str], int]):
+        """Update the progress of active player quests"""
+        updated = set()
+        for (user_id, quest_id), amount in increments.items():
+            for pq in self._active_player_quests(user_id, quest_id):
+                pq["progress"] += amount
+                updated.add(user_id)
+        for (user_id, quest_id), value in maxima.items():
+            for pq in self._active_player_quests(user_id, quest_id):
+                pq["progress"] = max(pq["progress"], value)
+                updated.add(user_id)
+        for user_id in updated:
+            self._publish_change(user_id, "quests")
+
+    def _active_player_quests(self, user_id: str, quest_id: str) -> List[Dict]:
+        return [
+            self.player_quests[pq_id] for pq_id in self._player_quest_ids.get(user_id, [])
+            if self.player_quests[pq_id]["questId"] == quest_id and self.player_quests[pq_id]["active"]
+        ]
+
+    async def claim_player_quest(self, user_id: str, quest_id: str) -> Optional[str]:
+        """Mark an active player quest completed with its reward pending"""
+        for pq_id in self._player_quest_ids.get(user_id, []):
+            pq = self.player_quests[pq_id]
+            if pq["questId"] != quest_id or not (pq["active"] or pq.get("rewardPending")):
+                continue
+            if pq["active"]:
+                pq["completed"] = True
+                pq["active"] = False
+                pq["rewardPending"] = True
+                self._publish_change(user_id, "quests")
+            return pq_id
+        return None
+
+    async def grant_quest_rewards(self, user_id: str, claim_id: str, experience: int = 0,
+                                  gold: int = 0) -> Optional[Character]:
+        """Add a claim's experience and gold once, recording the claim on the character"""
+        char_data = await self._character_doc(user_id)
+        claimed = char_data.setdefault("claimedQuests", [])
+        if claim_id in claimed:
+            return None
+        claimed.append(claim_id)
+        return await self.grant_rewards(user_id, experience, gold)
+
+    async def add_quest_items(self, user_id: str, claim_id: str, items: Dict[str, int]) -> bool:
+        """Add a claim's items once, recording the claim on the inventory"""
+        check_quantities(items)
+        if user_id not in self.inventories:
+            await self.provision_player(user_id)
+        claimed = self.inventories[user_id].setdefault("claimedQuests", [])
+        if claim_id in claimed:
+            return False
+        claimed.append(claim_id)
+        await self.add_items_to_inventory(user_id, items)
+        return True
+
+    async def finish_player_quest_claim(self, user_id: str, claim_id: str):
+        """Clear the pending reward once it is fully paid"""
+        pq = self.player_quests.get(claim_id)
+        if pq is not None:
+            pq.pop("rewardPending", None)
+
+    # Leaderboard methods
+    async def leaderboard_page(self, metric: str, limit: int, after: Optional[Tuple[int, str]] = None,
+                               ahead: bool = False) -> List[Dict]:
+        """Players ranked by metric, read off the maintained ranking"""
+        keys = self._rank_keys[metric]
+        if after is None:
+            page = keys[:limit]
+        elif ahead:
+            end = bisect.bisect_left(keys, (-after[0], after[1]))
+            page = keys[max(0, end - limit):end][::-1]
+        else:
+            start = bisect.bisect_right(keys, (-after[0], after[1]))
+            page = keys[start:start + limit]
+        return [leaderboard_entry(self.characters[user_id]) for _, user_id in page]
+
+    async def leaderboard_rank(self, metric: str, value: int, user_id: str) -> Optional[int]:
+        """1-based rank of the player at this position, by bisecting the ranking"""
+        return bisect.bisect_left(self._rank_keys[metric], (-value, user_id)) + 1
+
+    async def leaderboard_histogram(self, metric: str, buckets: int) -> List[Tuple[int, int, int]]:
+        """Players per value range, counted exactly off the ranking"""
+        keys = self._rank_keys[metric]
+        return value_histogram([-key[0] for key in keys], buckets, len(keys))
+
+    # Battle methods
+    async def load_battle(self, battle_id: str) -> Optional[Battle]:
+        """Get a stored battle"""
+        battle_data = self.battles.get(battle_id)
+        if battle_data:
+            return construct_trusted(Battle, deepcopy(battle_data))
+        return None
+
+    async def save_battles(self, battles: List[Battle]):
+        """Store battles, replacing earlier versions"""
+        for battle in battles:
+            self.battles[battle.id] = battle.model_dump(by_alias=True)
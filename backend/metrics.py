@@ -0,0 +1,203 @@
+"""Request and MongoDB metrics in Prometheus text format.
+
+MetricsMiddleware times every HTTP request by route template, and
+MongoCommandListener times every command the driver sends, by collection
+and command name. Both feed a MetricsRegistry rendered on /metrics.
+"""
+import bisect
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+
+from pymongo import monitoring
+from starlette.routing import Match
+
+# Histogram bucket upper bounds, in seconds
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _labels(names: Tuple[str, ...], values: Tuple) -> str:
+    pairs = []
+    for name, value in zip(names, values):
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        pairs.append(f'{name}="{value}"')
+    return ",".join(pairs)
+
+
+def route_template(scope) -> Tuple[Optional[str], Dict]:
+    """Template of the route the router will pick for a request, and its path parameters"""
+    for route in scope["app"].routes:
+        match, child_scope = route.matches(scope)
+        if match == Match.FULL:
+            return route.path, child_scope.get("path_params", {})
+    return None, {}
+
+
+class MetricsRegistry:
+    """Counters, gauges and latency histograms keyed by label values"""
+
+    def __init__(self):
+        # Mongo events arrive on driver threads
+        self._lock = threading.Lock()
+
+        self.http_latency: Dict[Tuple, Histogram] = defaultdict(Histogram)
+        self.http_requests: Dict[Tuple, int] = defaultdict(int)
+        self.http_in_flight: Dict[Tuple, int] = defaultdict(int)
+        self.http_shed: Dict[Tuple, int] = defaultdict(int)
+        self.mongo_latency: Dict[Tuple, Histogram] = defaultdict(Histogram)
+        self.mongo_commands: Dict[Tuple, int] = defaultdict(int)
+
+    def request_started(self, method: str):
+        with self._lock:
+            self.http_in_flight[(method,)] += 1
+
+    def request_finished(self, method: str, route: str, status: int, duration: float):
+        with self._lock:
+            self.http_in_flight[(method,)] -= 1
+            self.http_latency[(method, route)].observe(duration)
+            self.http_requests[(method, route, status)] += 1
+
+    def request_shed(self, route: str, reason: str):
+        with self._lock:
+            self.http_shed[(route, reason)] += 1
+
+    def mongo_command(self, collection: str, command: str, outcome: str, duration: float):
+        with self._lock:
+            self.mongo_latency[(collection, command)].observe(duration)
+            self.mongo_commands[(collection, command, outcome)] += 1
+
+    def render(self) -> str:
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            self._render_histogram(lines, "http_request_duration_seconds", "HTTP request latency",
+                                   ("method", "route"), self.http_latency)
+            self._render_values(lines, "http_requests_total", "counter", "HTTP requests by status",
+                                ("method", "route", "status"), self.http_requests)
+            self._render_values(lines, "http_requests_in_flight", "gauge", "HTTP requests being served",
+                                ("method",), self.http_in_flight)
+            self._render_values(lines, "http_requests_shed_total", "counter",
+                                "HTTP requests rejected by admission control", ("route", "reason"), self.http_shed)
+            self._render_histogram(lines, "mongodb_command_duration_seconds", "MongoDB command latency",
+                                   ("collection", "command"), self.mongo_latency)
+            self._render_values(lines, "mongodb_commands_total", "counter", "MongoDB commands by outcome",
+                                ("collection", "command", "outcome"), self.mongo_commands)
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _render_values(lines, name, kind, help_text, label_names, values):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for key, value in sorted(values.items()):
+            lines.append(f"{name}{{{_labels(label_names, key)}}} {value}")
+
+    @staticmethod
+    def _render_histogram(lines, name, help_text, label_names, histograms):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} histogram")
+        for key, histogram in sorted(histograms.items()):
+            labels = _labels(label_names, key)
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+            lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+            lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+            lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording latency, status and in-flight requests.
+
+    Requests are labelled with their route template, so path parameters do
+    not explode the label space. The template is taken from
+    ``scope["route_template"]`` when middleware further in resolved it,
+    which also covers requests answered before the router runs; otherwise
+    from the endpoint the router picked. Requests that match no route are
+    labelled "unmatched".
+    """
+
+    def __init__(self, app, registry: MetricsRegistry):
+        self.app = app
+        self.registry = registry
+        self._routes: Dict = {}
+
+    def _route(self, scope) -> str:
+        template = scope.get("route_template")
+        if template is not None:
+            return template
+        endpoint = scope.get("endpoint")
+        if endpoint is None:
+            return "unmatched"
+        route = self._routes.get(endpoint)
+        if route is None:
+            for candidate in scope["app"].routes:
+                if getattr(candidate, "endpoint", None) is endpoint:
+                    route = candidate.path
+                    break
+            else:
+                route = getattr(endpoint, "__name__", "unknown")
+            self._routes[endpoint] = route
+        return route
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self.registry.request_started(method)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            self.registry.request_finished(method, self._route(scope), status, time.perf_counter() - start)
+
+
+class MongoCommandListener(monitoring.CommandListener):
+    """Driver listener recording MongoDB command latency per collection"""
+
+    def __init__(self, registry: MetricsRegistry):
+        self.registry = registry
+        self._collections: Dict[Tuple, str] = {}
+
+    def started(self, event):
+        collection = event.command.get(event.command_name)
+        if event.command_name == "getMore":
+            collection = event.command.get("collection")
+        if not isinstance(collection, str):
+            collection = "admin" if event.database_name == "admin" else "-"
+        self._collections[(event.connection_id, event.request_id)] = collection
+
+    def _finished(self, event, outcome: str):
+        collection = self._collections.pop((event.connection_id, event.request_id), "-")
+        self.registry.mongo_command(collection, event.command_name, outcome, event.duration_micros / 1e6)
+
+    def succeeded(self, event):
+        self._finished(event, "success")
+
+    def failed(self, event):
+        self._finished(event, "failure")
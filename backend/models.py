@@ -30,6 +30,12 @@ class QuestType(str, Enum):
     explore = "explore"
 
 
+class LeaderboardMetric(str, Enum):
+    level = "level"
+    experience = "experience"
+    gold = "gold"
+
+
 # Character Models
 class CharacterStats(BaseModel):
     strength: int = 10
@@ -48,6 +54,16 @@ class Equipment(BaseModel):
     accessory: Optional[str] = None
 
 
+class DerivedStats(BaseModel):
+    """Bonuses summed over the equipped items"""
+    damage: int = 0
+    defense: int = 0
+    speed: int = 0
+    strength: int = 0
+    # Fingerprint of the item catalog these were computed from
+    catalogVersion: Optional[str] = None
+
+
 class Character(BaseModel):
     id: str = Field(default_factory=lambda: "player1", alias="_id")
     name: str
@@ -61,6 +77,7 @@ class Character(BaseModel):
     maxMana: int = 50
     stats: CharacterStats = Field(default_factory=CharacterStats)
     equipment: Equipment = Field(default_factory=Equipment)
+    derivedStats: Optional[DerivedStats] = None
     createdAt: datetime = Field(default_factory=datetime.utcnow)
     updatedAt: datetime = Field(default_factory=datetime.utcnow)
 
@@ -77,6 +94,7 @@ class CharacterUpdate(BaseModel):
     mana: Optional[int] = None
     stats: Optional[CharacterStats] = None
     equipment: Optional[Equipment] = None
+    derivedStats: Optional[DerivedStats] = None
 
 
 # Item Models
@@ -181,6 +199,26 @@ class Battle(BaseModel):
         populate_by_name = True
 
 
+# Leaderboard Models
+class LeaderboardEntry(BaseModel):
+    rank: int
+    userId: str
+    name: str
+    level: int
+    experience: int
+    gold: int
+
+
+class LeaderboardPage(BaseModel):
+    metric: LeaderboardMetric
+    # The requested player's rank, for the around view
+    rank: Optional[int] = None
+    # Whether the ranks are estimated, which they are below the cached top players
+    approximate: bool = False
+    entries: List[LeaderboardEntry]
+    nextCursor: Optional[str] = None
+
+
 # Request/Response Models
 class BattleStartRequest(BaseModel):
     userId: str
@@ -188,6 +226,7 @@ class BattleStartRequest(BaseModel):
 
 
 class BattleActionRequest(BaseModel):
+    userId: str
     battleId: str
     action: str  # "attack", "defend", "magic"
 
@@ -206,13 +245,23 @@ class BattleActionResponse(BaseModel):
 class ShopPurchaseRequest(BaseModel):
     userId: str
     itemId: str
-    quantity: int = 1
+    quantity: int = Field(1, gt=0)
+
+
+class CartLine(BaseModel):
+    itemId: str
+    quantity: int = Field(1, gt=0)
+
+
+class CartRequest(BaseModel):
+    userId: str
+    items: List[CartLine]
 
 
 class UseItemRequest(BaseModel):
     userId: str
     itemId: str
-    quantity: int = 1
+    quantity: int = Field(1, gt=0)
 
 
 class EquipItemRequest(BaseModel):
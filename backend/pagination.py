@@ -0,0 +1,26 @@
+import base64
+import json
+from typing import List, Optional
+
+
+def encode_cursor(position: list) -> str:
+    """Opaque cursor for a position in a listing"""
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode()
+
+
+def decode_cursor(cursor: str) -> list:
+    """Position of a cursor; raises ValueError if malformed"""
+    try:
+        position = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(position, list):
+        raise ValueError("Invalid cursor")
+    return position
+
+
+def parse_fields(fields: Optional[str]) -> Optional[List[str]]:
+    """Field names from a comma separated list, None for all fields"""
+    if fields is None:
+        return None
+    return [field.strip() for field in fields.split(",") if field.strip()]
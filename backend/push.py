@@ -0,0 +1,171 @@
+import asyncio
+from collections import defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import pydantic_core
+from fastapi import WebSocket
+
+from storage import CHANGE_PARTS, GameStorage
+
+# Key of each entry in the list parts
+ENTRY_KEYS = {"inventory": "itemId", "quests": "_id"}
+
+
+def diff_part(part: str, before: Any, after: Any) -> Optional[Dict]:
+    """Message turning ``before`` into ``after``, or None if they are equal"""
+    if part == "character":
+        changes = {field: value for field, value in after.items() if before.get(field) != value}
+        return {"type": part, "changes": changes} if changes else None
+
+    updated = [entry for key, entry in after.items() if before.get(key) != entry]
+    removed = [key for key in before if key not in after]
+    if not updated and not removed:
+        return None
+    return {"type": part, "updated": updated, "removed": removed}
+
+
+class _Subscriber:
+    __slots__ = ("websocket", "state", "missed")
+
+    def __init__(self, websocket: WebSocket, state: Dict[str, Any]):
+        self.websocket = websocket
+        # What this socket has been sent so far, by part
+        self.state = state
+        # Parts changed while the snapshot loaded, which it may predate
+        self.missed: Set[str] = set()
+
+
+class PushHub:
+    """Pushes character, inventory and quest diffs to connected players.
+
+    Storage reports which parts of a player changed after every committed
+    write, whichever request or background task made it. Reports are
+    coalesced for ``debounce`` seconds; then the changed parts are reloaded
+    once per player with an open socket, and each socket is sent only what
+    differs from what it last received. Players without a socket cost a set
+    lookup per write. While any socket is open, storage is asked to follow
+    writes by other processes too (a change stream on MongoDB); without
+    one they show up with the next change or reconnect.
+    """
+
+    def __init__(self, db: GameStorage, debounce: float = 0.05):
+        self.db = db
+        self.debounce = debounce
+
+        self._subscribers: Dict[str, List[_Subscriber]] = {}
+        self._pending: Dict[str, Set[str]] = defaultdict(set)
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def changed(self, user_id: str, parts: Iterable[str]):
+        """Storage change listener; queues a push if the player is connected"""
+        if user_id in self._subscribers:
+            self._pending[user_id].update(parts)
+            self._wakeup.set()
+
+    async def connect(self, user_id: str, websocket: WebSocket):
+        """Accept a socket and send it a full snapshot"""
+        await websocket.accept()
+        subscriber = _Subscriber(websocket, {})
+        if not self._subscribers:
+            self.db.follow_changes(True)
+        # Register first so changes made while the snapshot loads are pushed after it
+        self._subscribers.setdefault(user_id, []).append(subscriber)
+        state = await self._load(user_id, CHANGE_PARTS)
+        await websocket.send_json({
+            "type": "snapshot",
+            "character": state["character"],
+            "inventory": list(state["inventory"].values()),
+            "quests": list(state["quests"].values())
+        })
+        subscriber.state = state
+        if subscriber.missed:
+            # Diff those parts against the snapshot once it has been sent
+            self.changed(user_id, subscriber.missed)
+            subscriber.missed = set()
+
+    def disconnect(self, user_id: str, websocket: WebSocket):
+        subscribers = self._subscribers.get(user_id, [])
+        subscribers[:] = [s for s in subscribers if s.websocket is not websocket]
+        if not subscribers:
+            self._subscribers.pop(user_id, None)
+            self._pending.pop(user_id, None)
+            if not self._subscribers:
+                self.db.follow_changes(False)
+
+    async def _load(self, user_id: str, parts: Iterable[str]) -> Dict[str, Any]:
+        parts = list(parts)
+        loaders = {
+            "character": self.db.get_character,
+            "inventory": self.db.get_inventory,
+            "quests": self.db.get_user_quests
+        }
+        values = await asyncio.gather(*(loaders[part](user_id) for part in parts))
+
+        state = {}
+        for part, value in zip(parts, values):
+            value = pydantic_core.to_jsonable_python(value, by_alias=True)
+            if part in ENTRY_KEYS:
+                value = {entry[ENTRY_KEYS[part]]: entry for entry in value}
+            state[part] = value
+        return state
+
+    async def _push(self, user_id: str, parts: Set[str]):
+        subscribers = self._subscribers.get(user_id)
+        if not subscribers:
+            return
+        fresh = await self._load(user_id, sorted(parts))
+
+        for subscriber in list(subscribers):
+            # Still loading its snapshot, which may have been read before this change
+            if not subscriber.state:
+                subscriber.missed.update(parts)
+                continue
+            messages = []
+            for part, value in fresh.items():
+                message = diff_part(part, subscriber.state[part], value)
+                if message:
+                    messages.append(message)
+                    subscriber.state[part] = value
+            try:
+                for message in messages:
+                    await subscriber.websocket.send_json(message)
+            except Exception:
+                self.disconnect(user_id, subscriber.websocket)
+
+    async def _push_loop(self):
+        while True:
+            await self._wakeup.wait()
+            await asyncio.sleep(self.debounce)
+            self._wakeup.clear()
+            pending, self._pending = self._pending, defaultdict(set)
+            results = await asyncio.gather(
+                *(self._push(user_id, parts) for user_id, parts in pending.items()), return_exceptions=True
+            )
+            for user_id, result in zip(pending, results):
+                if isinstance(result, Exception):
+                    print(f"Error pushing changes to {user_id}: {result}")
+
+    def start(self):
+        """Start the push task"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._push_loop())
+
+    async def stop(self):
+        """Stop the push task and close every socket"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for subscribers in list(self._subscribers.values()):
+            for subscriber in subscribers:
+                try:
+                    await subscriber.websocket.close(code=1001)
+                except Exception:
+                    pass
+        if self._subscribers:
+            self.db.follow_changes(False)
+        self._subscribers.clear()
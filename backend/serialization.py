@@ -0,0 +1,74 @@
+import typing
+from enum import Enum
+from functools import lru_cache
+from typing import Any, Dict, Mapping, Type, TypeVar
+
+import pydantic_core
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+ModelT = TypeVar("ModelT", bound=BaseModel)
+
+
+def _unwrap(annotation):
+    # Optional[X] -> X
+    args = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+    if typing.get_origin(annotation) is typing.Union and len(args) == 1:
+        return args[0]
+    return annotation
+
+
+@lru_cache(maxsize=None)
+def _field_plan(model: Type[BaseModel]):
+    """(name, key in the document, nested type) for each field of a model"""
+    plan = []
+    for name, field in model.model_fields.items():
+        annotation = _unwrap(field.annotation)
+        nested = None
+        if isinstance(annotation, type) and issubclass(annotation, (BaseModel, Enum)):
+            nested = annotation
+        elif typing.get_origin(annotation) is list:
+            (item_type,) = typing.get_args(annotation) or (None,)
+            if isinstance(item_type, type) and issubclass(item_type, BaseModel):
+                nested = [item_type]
+        plan.append((name, field.alias or name, nested))
+    return tuple(plan)
+
+
+def _convert(nested, value):
+    if value is None or nested is None:
+        return value
+    if isinstance(nested, list):
+        return [construct_trusted(nested[0], item) for item in value]
+    if issubclass(nested, Enum):
+        return nested(value)
+    if isinstance(value, Mapping):
+        return construct_trusted(nested, value)
+    return value
+
+
+def construct_trusted(model: Type[ModelT], doc: Mapping[str, Any]) -> ModelT:
+    """Build a model from a document we wrote ourselves, skipping validation.
+
+    Nested models and enums are still built, so attribute access behaves as
+    with a validated model; missing fields take their defaults. Only use
+    this for documents that were produced from the same model.
+    """
+    values: Dict[str, Any] = {}
+    for name, key, nested in _field_plan(model):
+        if key in doc:
+            values[name] = _convert(nested, doc[key])
+        elif name in doc:
+            values[name] = _convert(nested, doc[name])
+    return model.model_construct(**values)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSON response serialized by pydantic-core.
+
+    Models are dumped by alias without re-validation, producing the same
+    bytes FastAPI's response_model path would for trusted data.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return pydantic_core.to_json(content, by_alias=True)
@@ -1,14 +1,31 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends
+from fastapi import FastAPI, APIRouter, HTTPException, Depends, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from motor.motor_asyncio import AsyncIOMotorClient
 from dotenv import load_dotenv
 from pathlib import Path
 import os
+import random
+import asyncio
 import logging
 from contextlib import asynccontextmanager
+from typing import Tuple
 
 from models import *
+from storage import GameStorage, leaderboard_entry
 from database import GameDatabase
+from memory_db import InMemoryGameDatabase
+from character_cache import WriteBehindGameDatabase
+from battle import BattleSession, BattleStore
+from stats import derive_stats
+from leaderboard import LeaderboardCache, decode_rank_cursor, encode_rank_cursor
+from pagination import decode_cursor, encode_cursor, parse_fields
+from events import GameEvent, GameEventBus, QuestProgressTracker
+from push import PushHub
+from http_cache import CatalogResponseCache
+from serialization import FastJSONResponse
+from metrics import MetricsMiddleware, MetricsRegistry, MongoCommandListener
+from admission import AdmissionController, AdmissionMiddleware, parse_route_limits
 
 # Load environment variables
 ROOT_DIR = Path(__file__).parent
@@ -17,25 +34,117 @@ load_dotenv(ROOT_DIR / '.env')
 # Global database instance
 game_db = None
 
+# Running battles, persisted write-behind
+battle_store = None
+battle_rng = random.Random()
+
+# Top players per leaderboard metric
+leaderboard = None
+
+# Game events, counted towards quests write-behind
+game_events = None
+quest_progress = None
+
+# Open player sockets, pushed every committed change
+push_hub = None
+
+# Serialized catalog responses, rebuilt when the catalog version changes
+catalog_responses = CatalogResponseCache()
+
+# Request and MongoDB metrics exposed on /metrics
+metrics = MetricsRegistry()
+
+# Rate limits and load shedding; ADMISSION_ROUTE_LIMITS overrides per-route limits as JSON
+admission = AdmissionController(
+    route_limits=parse_route_limits(os.environ.get('ADMISSION_ROUTE_LIMITS')),
+    global_rate=float(os.environ.get('ADMISSION_GLOBAL_RATE', 2000)) or None,
+    global_burst=int(os.environ.get('ADMISSION_GLOBAL_BURST', 4000)),
+    max_in_flight=int(os.environ.get('ADMISSION_MAX_IN_FLIGHT', 500)),
+    max_loop_lag=float(os.environ.get('ADMISSION_MAX_LOOP_LAG_MS', 250)) / 1000
+)
+admission.enabled = os.environ.get('ADMISSION_CONTROL', 'on') != 'off'
+
+
+async def migrate_inventories(db: GameStorage):
+    try:
+        migrated = await db.migrate_inventories()
+        if migrated:
+            print(f"✅ Inventories migrated: {migrated}")
+    except Exception as e:
+        logger.error(f"Error migrating inventories: {e}")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup
-    global game_db
-    mongo_url = os.environ['MONGO_URL']
-    db_name = os.environ['DB_NAME']
+    global game_db, battle_store, leaderboard, game_events, quest_progress, push_hub
+    client = None
     
-    client = AsyncIOMotorClient(mongo_url)
-    game_db = GameDatabase(client, db_name)
+    if os.environ.get('STORAGE_BACKEND', 'mongodb') == 'memory':
+        # Single-node storage in process memory, optionally snapshotted to disk
+        game_db = InMemoryGameDatabase(
+            snapshot_path=os.environ.get('MEMORY_SNAPSHOT_PATH'),
+            snapshot_interval=float(os.environ.get('MEMORY_SNAPSHOT_SECONDS', 60))
+        )
+        print("✅ In-memory storage enabled")
+    else:
+        mongo_url = os.environ['MONGO_URL']
+        db_name = os.environ['DB_NAME']
+        client = AsyncIOMotorClient(mongo_url, event_listeners=[MongoCommandListener(metrics)])
+        
+        # Optional write-behind character cache; the interval bounds the loss window
+        character_flush_seconds = float(os.environ.get('CHARACTER_FLUSH_SECONDS', 0))
+        if character_flush_seconds > 0:
+            game_db = WriteBehindGameDatabase(client, db_name, flush_interval=character_flush_seconds)
+            print(f"✅ Character write-behind enabled ({character_flush_seconds}s)")
+        else:
+            game_db = GameDatabase(client, db_name)
+    
+    admission.start()
     
     # Initialize game data
     await game_db.initialize_game_data()
+    await game_db.start()
+    
+    # Make sure lookup indexes exist
+    index_report = await game_db.ensure_indexes()
+    for name in index_report.created:
+        print(f"✅ Index created: {name}")
+    for name in index_report.missing:
+        print(f"⚠️ Index missing: {name}")
+    
+    # Move array-layout inventories to the keyed layout in the background
+    migration = asyncio.create_task(migrate_inventories(game_db))
+    
+    # Load static catalog into memory
+    catalog = await game_db.catalog.reload()
+    print(f"✅ Catalog loaded (v{catalog.version})")
+    
+    battle_store = BattleStore(game_db)
+    battle_store.start()
+    leaderboard = LeaderboardCache(game_db)
+    
+    game_events = GameEventBus()
+    quest_progress = QuestProgressTracker(game_db)
+    game_events.subscribe(quest_progress.handle)
+    quest_progress.start()
+    
+    push_hub = PushHub(game_db)
+    game_db.add_change_listener(push_hub.changed)
+    push_hub.start()
     print("✅ RPG Game Backend Started!")
     
     yield
     
     # Shutdown
-    client.close()
+    migration.cancel()
+    await battle_store.stop()
+    await quest_progress.stop()
+    await game_db.stop()
+    await push_hub.stop()
+    await admission.stop()
+    if client is not None:
+        client.close()
     print("👋 RPG Game Backend Stopped!")
 
 
@@ -47,10 +156,56 @@ api_router = APIRouter(prefix="/api")
 
 
 # Dependency to get database
-async def get_db() -> GameDatabase:
+async def get_db() -> GameStorage:
     return game_db
 
 
+async def get_battle_store() -> BattleStore:
+    return battle_store
+
+
+async def get_leaderboard() -> LeaderboardCache:
+    return leaderboard
+
+
+def publish_collected(user_id: str, gold: int = 0, items: Optional[Dict[str, int]] = None):
+    """Publish collect events for the gold and items a player received"""
+    events = [GameEvent(QuestType.collect, user_id, item_id, quantity) for item_id, quantity in (items or {}).items()]
+    if gold > 0:
+        events.append(GameEvent(QuestType.collect, user_id, "gold", gold))
+    game_events.publish(*events)
+
+
+def after_position(cursor: Optional[str]) -> Optional[str]:
+    """Id a listing continues after, from its cursor"""
+    if cursor is None:
+        return None
+    try:
+        position = decode_cursor(cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if len(position) != 1 or not isinstance(position[0], str):
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return position[0]
+
+
+def page_response(entries: List[Dict], next_after: Optional[str]) -> FastJSONResponse:
+    """A listing page, with the cursor of the next page in X-Next-Cursor"""
+    response = FastJSONResponse(entries)
+    if next_after is not None:
+        response.headers["X-Next-Cursor"] = encode_cursor([next_after])
+    return response
+
+
+def character_changed(character: Optional[Character]):
+    """Update the in-memory views built from characters"""
+    if character is not None:
+        leaderboard.observe(character)
+
+
+# Admission control, inside CORS so rejections still carry CORS headers
+app.add_middleware(AdmissionMiddleware, controller=admission, registry=metrics)
+
 # CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -58,8 +213,12 @@ app.add_middleware(
     allow_origins=["*"],
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Retry-After"],
 )
 
+# Metrics middleware, outermost so it times the whole request
+app.add_middleware(MetricsMiddleware, registry=metrics)
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -68,25 +227,63 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+# ============= BOOTSTRAP ENDPOINT =============
+
+@api_router.get("/bootstrap/{user_id}")
+async def get_bootstrap(user_id: str, db: GameStorage = Depends(get_db)):
+    """Get the full player view in one request"""
+    try:
+        # Load the catalog once up front so every lookup below shares it
+        await db.catalog.get()
+        
+        character, inventory, quests, enemies, shop_items = await asyncio.gather(
+            db.get_character_with_stats(user_id),
+            db.get_inventory(user_id),
+            db.get_user_quests(user_id),
+            db.get_all_enemies(),
+            db.get_shop_items()
+        )
+        
+        return FastJSONResponse({
+            "character": character,
+            "inventory": inventory,
+            "quests": quests,
+            "enemies": enemies,
+            "shopItems": shop_items
+        })
+        
+    except Exception as e:
+        logger.error(f"Error getting bootstrap data: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # ============= CHARACTER ENDPOINTS =============
 
 @api_router.get("/character/{user_id}", response_model=Character)
-async def get_character(user_id: str, db: GameDatabase = Depends(get_db)):
+async def get_character(user_id: str, db: GameStorage = Depends(get_db)):
     """Get character data"""
     try:
-        character = await db.get_character(user_id)
-        return character
+        character = await db.get_character_with_stats(user_id)
+        return FastJSONResponse(character)
     except Exception as e:
         logger.error(f"Error getting character: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @api_router.put("/character/{user_id}", response_model=Character)
-async def update_character(user_id: str, updates: CharacterUpdate, db: GameDatabase = Depends(get_db)):
+async def update_character(user_id: str, updates: CharacterUpdate, db: GameStorage = Depends(get_db)):
     """Update character data"""
     try:
+        # Derived stats follow the equipment, they are never taken from the client
+        updates.derivedStats = None
+        if updates.equipment is not None:
+            updates.derivedStats = derive_stats(updates.equipment, await db.catalog.get())
+        
         character = await db.update_character(user_id, updates)
-        return character
+        character_changed(character)
+        if updates.level is not None:
+            game_events.publish(GameEvent(QuestType.level, user_id, amount=updates.level))
+        return FastJSONResponse(character)
     except Exception as e:
         logger.error(f"Error updating character: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -95,41 +292,47 @@ async def update_character(user_id: str, updates: CharacterUpdate, db: GameDatab
 # ============= INVENTORY ENDPOINTS =============
 
 @api_router.get("/inventory/{user_id}")
-async def get_inventory(user_id: str, db: GameDatabase = Depends(get_db)):
-    """Get player inventory"""
+async def get_inventory(user_id: str, limit: Optional[int] = Query(None, ge=1, le=200),
+                        cursor: Optional[str] = None, item_type: Optional[ItemType] = Query(None, alias="type"),
+                        rarity: Optional[ItemRarity] = None, fields: Optional[str] = None,
+                        db: GameStorage = Depends(get_db)):
+    """Get player inventory, optionally a filtered page of it"""
     try:
-        inventory = await db.get_inventory(user_id)
-        return inventory
+        if limit is None and cursor is None and item_type is None and rarity is None and fields is None:
+            inventory = await db.get_inventory(user_id)
+            return FastJSONResponse(inventory)
+        
+        # Paged in item id order
+        inventory, next_after = await db.get_inventory_page(
+            user_id, limit, after_position(cursor), item_type, rarity, parse_fields(fields)
+        )
+        return page_response(inventory, next_after)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting inventory: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @api_router.post("/inventory/{user_id}/use")
-async def use_item(user_id: str, request: UseItemRequest, db: GameDatabase = Depends(get_db)):
+async def use_item(user_id: str, request: UseItemRequest, db: GameStorage = Depends(get_db)):
     """Use item from inventory"""
     try:
         # Get item details
-        item_data = await db.items.find_one({"_id": request.itemId})
-        if not item_data:
+        item = await db.get_item(request.itemId)
+        if not item:
             raise HTTPException(status_code=404, detail="Item not found")
         
-        item = Item(**item_data)
-        
         # Remove item from inventory
         success = await db.remove_item_from_inventory(user_id, request.itemId, request.quantity)
         if not success:
             raise HTTPException(status_code=400, detail="Item not in inventory")
         
         # Apply item effect
-        character = await db.get_character(user_id)
-        
         if item.effect == "heal":
-            new_health = min(character.health + item.value, character.maxHealth)
-            await db.update_character(user_id, CharacterUpdate(health=new_health))
+            character_changed(await db.restore_health(user_id, item.value))
         elif item.effect == "mana":
-            new_mana = min(character.mana + item.value, character.maxMana)
-            await db.update_character(user_id, CharacterUpdate(mana=new_mana))
+            character_changed(await db.restore_mana(user_id, item.value))
         
         return {"message": f"{item.name} használatba véve!", "success": True}
         
@@ -141,15 +344,14 @@ async def use_item(user_id: str, request: UseItemRequest, db: GameDatabase = Dep
 
 
 @api_router.post("/inventory/{user_id}/equip")
-async def equip_item(user_id: str, request: EquipItemRequest, db: GameDatabase = Depends(get_db)):
+async def equip_item(user_id: str, request: EquipItemRequest, db: GameStorage = Depends(get_db)):
     """Equip item"""
     try:
         # Get item details
-        item_data = await db.items.find_one({"_id": request.itemId})
-        if not item_data:
+        item = await db.get_item(request.itemId)
+        if not item:
             raise HTTPException(status_code=404, detail="Item not found")
         
-        item = Item(**item_data)
         character = await db.get_character(user_id)
         
         # Update equipment based on item type
@@ -168,8 +370,12 @@ async def equip_item(user_id: str, request: EquipItemRequest, db: GameDatabase =
         else:
             raise HTTPException(status_code=400, detail="Item cannot be equipped")
         
-        # Update character
-        await db.update_character(user_id, CharacterUpdate(equipment=new_equipment))
+        # Update character, with the stat bonuses of the new equipment
+        derived_stats = derive_stats(new_equipment, await db.catalog.get())
+        character = await db.update_character(
+            user_id, CharacterUpdate(equipment=new_equipment, derivedStats=derived_stats)
+        )
+        character_changed(character)
         
         return {"message": f"{item.name} felszerelve!", "success": True}
         
@@ -183,68 +389,133 @@ async def equip_item(user_id: str, request: EquipItemRequest, db: GameDatabase =
 # ============= ENEMY ENDPOINTS =============
 
 @api_router.get("/enemies", response_model=List[Enemy])
-async def get_enemies(db: GameDatabase = Depends(get_db)):
+async def get_enemies(request: Request, db: GameStorage = Depends(get_db)):
     """Get all enemies"""
     try:
-        enemies = await db.get_all_enemies()
-        return enemies
+        return await catalog_responses.respond(request, "enemies", db.catalog, db.get_all_enemies)
     except Exception as e:
         logger.error(f"Error getting enemies: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# ============= BATTLE ENDPOINTS =============
+
+@api_router.post("/battle/start", response_model=Battle)
+async def start_battle(request: BattleStartRequest, db: GameStorage = Depends(get_db),
+                       battles: BattleStore = Depends(get_battle_store)):
+    """Start a battle against an enemy"""
+    try:
+        enemy = await db.get_enemy(request.enemyId)
+        if not enemy:
+            raise HTTPException(status_code=404, detail="Enemy not found")
+        
+        character = await db.get_character_with_stats(request.userId)
+        session = BattleSession.start(character, enemy)
+        battles.add(session)
+        
+        return session.battle
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error starting battle: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@api_router.post("/battle/action", response_model=BattleActionResponse)
+async def battle_action(request: BattleActionRequest, db: GameStorage = Depends(get_db),
+                        battles: BattleStore = Depends(get_battle_store)):
+    """Perform a battle action"""
+    try:
+        session = battles.get(request.battleId)
+        # Another player's battle is reported as missing; userId is what the action is rate limited by
+        if not session or session.battle.userId != request.userId:
+            raise HTTPException(status_code=404, detail="Battle not found or already ended")
+        
+        try:
+            result = session.act(request.action, battle_rng)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        battles.mark_dirty(request.battleId)
+        
+        # Rewards are paid once, on the action that wins the battle
+        if result.rewards:
+            character = await db.grant_rewards(
+                session.battle.userId,
+                experience=result.rewards["experience"],
+                gold=result.rewards["gold"]
+            )
+            character_changed(character)
+            game_events.publish(GameEvent(QuestType.kill, session.battle.userId, session.enemy.name))
+            publish_collected(session.battle.userId, gold=result.rewards["gold"])
+        
+        return result
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error in battle action: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@api_router.get("/battle/status/{battle_id}", response_model=Battle)
+async def get_battle_status(battle_id: str, battles: BattleStore = Depends(get_battle_store)):
+    """Get current battle status"""
+    try:
+        battle = await battles.load(battle_id)
+        if not battle:
+            raise HTTPException(status_code=404, detail="Battle not found")
+        return FastJSONResponse(battle)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting battle status: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # ============= QUEST ENDPOINTS =============
 
 @api_router.get("/quests/{user_id}")
-async def get_user_quests(user_id: str, db: GameDatabase = Depends(get_db)):
-    """Get player quests"""
+async def get_user_quests(user_id: str, limit: Optional[int] = Query(None, ge=1, le=200),
+                          cursor: Optional[str] = None, quest_type: Optional[QuestType] = Query(None, alias="type"),
+                          active: Optional[bool] = None, fields: Optional[str] = None,
+                          db: GameStorage = Depends(get_db)):
+    """Get player quests, optionally a filtered page of them"""
     try:
-        quests = await db.get_user_quests(user_id)
-        return quests
+        if limit is None and cursor is None and quest_type is None and active is None and fields is None:
+            quests = await db.get_user_quests(user_id)
+            return FastJSONResponse(quests)
+        
+        # Paged in player quest id order
+        quests, next_after = await db.get_user_quests_page(
+            user_id, limit, after_position(cursor), quest_type, active, parse_fields(fields)
+        )
+        return page_response(quests, next_after)
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error getting quests: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @api_router.post("/quests/{user_id}/complete/{quest_id}")
-async def complete_quest(user_id: str, quest_id: str, db: GameDatabase = Depends(get_db)):
+async def complete_quest(user_id: str, quest_id: str, db: GameStorage = Depends(get_db)):
     """Complete a quest"""
     try:
-        # Find player quest
-        player_quest = await db.player_quests.find_one({
-            "userId": user_id,
-            "questId": quest_id,
-            "active": True
-        })
-        
-        if not player_quest:
-            raise HTTPException(status_code=404, detail="Quest not found or not active")
-        
         # Get quest details
-        quest_data = await db.quests.find_one({"_id": quest_id})
-        if not quest_data:
+        quest = await db.get_quest(quest_id)
+        if not quest:
             raise HTTPException(status_code=404, detail="Quest not found")
         
-        quest = Quest(**quest_data)
-        
-        # Mark quest as completed
-        await db.player_quests.update_one(
-            {"userId": user_id, "questId": quest_id},
-            {"$set": {"completed": True, "active": False}}
-        )
-        
-        # Give rewards
-        character = await db.get_character(user_id)
-        updates = CharacterUpdate(
-            experience=character.experience + quest.reward.experience,
-            gold=character.gold + quest.reward.gold
-        )
-        
-        await db.update_character(user_id, updates)
-        
-        # Add item reward if any
-        if quest.reward.item:
-            await db.add_item_to_inventory(user_id, quest.reward.item, 1)
+        # Claim the quest and give rewards, once even if the request is repeated
+        completed = await db.complete_quest(user_id, quest)
+        if not completed:
+            raise HTTPException(status_code=404, detail="Quest not found or not active")
+        character, paid = completed
+        character_changed(character)
+        if paid:
+            publish_collected(user_id, quest.reward.gold, {quest.reward.item: 1} if quest.reward.item else None)
         
         return {
             "message": f"{quest.title} teljesítve!",
@@ -265,41 +536,32 @@ async def complete_quest(user_id: str, quest_id: str, db: GameDatabase = Depends
 # ============= SHOP ENDPOINTS =============
 
 @api_router.get("/shop/items", response_model=List[Item])
-async def get_shop_items(db: GameDatabase = Depends(get_db)):
+async def get_shop_items(request: Request, db: GameStorage = Depends(get_db)):
     """Get shop items"""
     try:
-        items = await db.get_shop_items()
-        return items
+        return await catalog_responses.respond(request, "shop_items", db.catalog, db.get_shop_items)
     except Exception as e:
         logger.error(f"Error getting shop items: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @api_router.post("/shop/buy")
-async def buy_item(request: ShopPurchaseRequest, db: GameDatabase = Depends(get_db)):
+async def buy_item(request: ShopPurchaseRequest, db: GameStorage = Depends(get_db)):
     """Buy item from shop"""
     try:
         # Get item details
-        item_data = await db.items.find_one({"_id": request.itemId})
-        if not item_data:
+        item = await db.get_item(request.itemId)
+        if not item:
             raise HTTPException(status_code=404, detail="Item not found")
         
-        item = Item(**item_data)
         total_cost = item.price * request.quantity
         
-        # Check if player has enough gold
-        character = await db.get_character(request.userId)
-        if character.gold < total_cost:
+        # Deduct gold and add the item, refunding the gold if the item cannot be added
+        character = await db.buy_items(request.userId, {request.itemId: request.quantity}, total_cost)
+        if not character:
             raise HTTPException(status_code=400, detail="Not enough gold")
-        
-        # Deduct gold
-        await db.update_character(
-            request.userId, 
-            CharacterUpdate(gold=character.gold - total_cost)
-        )
-        
-        # Add item to inventory
-        await db.add_item_to_inventory(request.userId, request.itemId, request.quantity)
+        character_changed(character)
+        publish_collected(request.userId, items={request.itemId: request.quantity})
         
         return {
             "message": f"{item.name} megvásárolva {total_cost} aranyért!",
@@ -314,28 +576,22 @@ async def buy_item(request: ShopPurchaseRequest, db: GameDatabase = Depends(get_
 
 
 @api_router.post("/shop/sell")
-async def sell_item(request: UseItemRequest, db: GameDatabase = Depends(get_db)):
+async def sell_item(request: UseItemRequest, db: GameStorage = Depends(get_db)):
     """Sell item to shop"""
     try:
         # Get item details
-        item_data = await db.items.find_one({"_id": request.itemId})
-        if not item_data:
+        item = await db.get_item(request.itemId)
+        if not item:
             raise HTTPException(status_code=404, detail="Item not found")
         
-        item = Item(**item_data)
         sell_price = int(item.price * 0.5) * request.quantity
         
-        # Remove item from inventory
-        success = await db.remove_item_from_inventory(request.userId, request.itemId, request.quantity)
-        if not success:
+        # Remove the item and add gold, giving the item back if the gold cannot be added
+        character = await db.sell_items(request.userId, {request.itemId: request.quantity}, sell_price)
+        if not character:
             raise HTTPException(status_code=400, detail="Item not in inventory")
-        
-        # Add gold
-        character = await db.get_character(request.userId)
-        await db.update_character(
-            request.userId,
-            CharacterUpdate(gold=character.gold + sell_price)
-        )
+        character_changed(character)
+        publish_collected(request.userId, gold=sell_price)
         
         return {
             "message": f"{item.name} eladva {sell_price} aranyért!",
@@ -349,6 +605,176 @@ async def sell_item(request: UseItemRequest, db: GameDatabase = Depends(get_db))
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def cart_quantities(cart: CartRequest) -> Dict[str, int]:
+    """Merge cart lines into a quantity per item"""
+    if not cart.items:
+        raise HTTPException(status_code=400, detail="Cart is empty")
+    
+    quantities = {}
+    for line in cart.items:
+        quantities[line.itemId] = quantities.get(line.itemId, 0) + line.quantity
+    return quantities
+
+
+async def cart_items(cart: CartRequest, db: GameStorage) -> Tuple[Dict[str, int], List[Item]]:
+    """Quantities and catalog items for a cart"""
+    quantities = cart_quantities(cart)
+    catalog = await db.catalog.get()
+    
+    items = []
+    for item_id in quantities:
+        item = catalog.items.get(item_id)
+        if not item:
+            raise HTTPException(status_code=404, detail=f"Item not found: {item_id}")
+        items.append(item)
+    return quantities, items
+
+
+@api_router.post("/shop/cart/buy")
+async def buy_cart(request: CartRequest, db: GameStorage = Depends(get_db)):
+    """Buy several items from the shop at once"""
+    try:
+        quantities, items = await cart_items(request, db)
+        total_cost = sum(item.price * quantities[item.id] for item in items)
+        
+        # Deduct gold and add every item, or nothing if gold is short
+        character = await db.buy_items(request.userId, quantities, total_cost)
+        if not character:
+            raise HTTPException(status_code=400, detail="Not enough gold")
+        character_changed(character)
+        publish_collected(request.userId, items=quantities)
+        
+        return {
+            "message": f"{sum(quantities.values())} tárgy megvásárolva {total_cost} aranyért!",
+            "success": True,
+            "gold": character.gold
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error buying cart: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@api_router.post("/shop/cart/sell")
+async def sell_cart(request: CartRequest, db: GameStorage = Depends(get_db)):
+    """Sell several items to the shop at once"""
+    try:
+        quantities, items = await cart_items(request, db)
+        sell_price = sum(int(item.price * 0.5) * quantities[item.id] for item in items)
+        
+        # Remove every item and add gold, or nothing if any item is short
+        character = await db.sell_items(request.userId, quantities, sell_price)
+        if not character:
+            raise HTTPException(status_code=400, detail="Item not in inventory")
+        character_changed(character)
+        publish_collected(request.userId, gold=sell_price)
+        
+        return {
+            "message": f"{sum(quantities.values())} tárgy eladva {sell_price} aranyért!",
+            "success": True,
+            "gold": character.gold
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error selling cart: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# ============= LEADERBOARD ENDPOINTS =============
+
+@api_router.get("/leaderboard/{metric}", response_model=LeaderboardPage)
+async def get_leaderboard_page(metric: LeaderboardMetric, limit: int = Query(20, ge=1, le=100),
+                               cursor: Optional[str] = None, db: GameStorage = Depends(get_db),
+                               boards: LeaderboardCache = Depends(get_leaderboard)):
+    """Get players ranked by a metric, one page per cursor"""
+    try:
+        if cursor is None:
+            # The first page usually comes straight from the cached board
+            entries = await boards.top(metric.value, limit)
+            if entries is None:
+                page = await db.leaderboard_page(metric.value, limit)
+                entries = [{"rank": rank, **entry} for rank, entry in enumerate(page, start=1)]
+        else:
+            try:
+                value, after_user_id, after_rank = decode_rank_cursor(cursor)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            page = await db.leaderboard_page(metric.value, limit, after=(value, after_user_id))
+            entries = [{"rank": rank, **entry} for rank, entry in enumerate(page, start=after_rank + 1)]
+        
+        return FastJSONResponse({
+            "metric": metric.value,
+            "entries": entries,
+            "nextCursor": encode_rank_cursor(entries[-1], metric.value) if len(entries) == limit else None
+        })
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error getting leaderboard: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@api_router.get("/leaderboard/{metric}/around/{user_id}", response_model=LeaderboardPage)
+async def get_leaderboard_around(metric: LeaderboardMetric, user_id: str,
+                                 radius: int = Query(5, ge=0, le=50), db: GameStorage = Depends(get_db),
+                                 boards: LeaderboardCache = Depends(get_leaderboard)):
+    """Get a player's rank with the players right above and below"""
+    try:
+        character = await db.get_character(user_id)
+        value = getattr(character, metric.value)
+        position = (value, user_id)
+        
+        # Exact on the cached board, estimated below it
+        (rank, exact), above, below = await asyncio.gather(
+            boards.rank(metric.value, value, user_id),
+            db.leaderboard_page(metric.value, radius, after=position, ahead=True),
+            db.leaderboard_page(metric.value, radius, after=position)
+        )
+        
+        # The stored document may lag behind a buffered character
+        above = [entry for entry in above if entry["userId"] != user_id]
+        below = [entry for entry in below if entry["userId"] != user_id]
+        
+        entries = [{"rank": rank - i, **entry} for i, entry in enumerate(above, start=1)][::-1]
+        entries.append({"rank": rank, **leaderboard_entry(character.model_dump(by_alias=True))})
+        entries.extend({"rank": rank + i, **entry} for i, entry in enumerate(below, start=1))
+        
+        return FastJSONResponse({
+            "metric": metric.value,
+            "rank": rank,
+            "approximate": not exact,
+            "entries": entries,
+            "nextCursor": encode_rank_cursor(entries[-1], metric.value)
+        })
+        
+    except Exception as e:
+        logger.error(f"Error getting leaderboard position: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# ============= PUSH ENDPOINT =============
+
+@app.websocket("/ws/{user_id}")
+async def player_updates(websocket: WebSocket, user_id: str):
+    """Snapshot of the player's state, then diffs as it changes"""
+    try:
+        await push_hub.connect(user_id, websocket)
+        # Nothing is expected from the client, this only waits for it to go away
+        while True:
+            await websocket.receive_text()
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Error pushing player updates: {e}")
+    finally:
+        push_hub.disconnect(user_id, websocket)
+
+
 # ============= ROOT ENDPOINT =============
 
 @api_router.get("/")
@@ -356,6 +782,14 @@ async def root():
     return {"message": "Fantasy RPG API is running! 🎮⚔️"}
 
 
+# ============= METRICS ENDPOINT =============
+
+@app.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    """Prometheus metrics"""
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 # Include the router in the main app
 app.include_router(api_router)
 
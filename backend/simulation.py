@@ -0,0 +1,178 @@
+"""Monte Carlo combat balance simulator.
+
+Plays large numbers of attack-only fights between character builds and
+enemies using the damage rules in battle.py, with NumPy-batched rolls
+fanned out over a process pool.
+
+    python simulation.py --fights 1000000
+    python simulation.py --builds builds.json --json results.json
+"""
+import argparse
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from battle import ENEMY_BASE_DAMAGE, PLAYER_BASE_DAMAGE, PLAYER_DEFENSE
+from database import SAMPLE_ENEMIES
+from models import Character, CharacterStats, Enemy
+from stats import effective_strength
+
+# Each turn is the player's action plus the enemy's delayed reply in the client
+SECONDS_PER_TURN = 3.0
+CHUNK_SIZE = 20_000
+
+LEVEL_BANDS = [(1, 9), (10, 19), (20, 29), (30, 99)]
+
+
+def level_band(level: int) -> str:
+    for low, high in LEVEL_BANDS:
+        if low <= level <= high:
+            return f"{low}-{high}"
+    return f"{level}+"
+
+
+def default_builds() -> List[Character]:
+    """Starter character plus scaled variants across the level bands"""
+    builds = []
+    for level, strength, health in [(5, 12, 70), (12, 18, 100), (20, 24, 140), (30, 30, 200)]:
+        builds.append(Character(
+            id=f"build_{level}",
+            name=f"Szint {level}",
+            level=level,
+            health=health,
+            maxHealth=health,
+            stats=CharacterStats(strength=strength)
+        ))
+    return builds
+
+
+def _finishing_turn(hits: np.ndarray, health: int) -> np.ndarray:
+    """First turn (0-based) on which cumulative damage reaches health"""
+    finished = np.cumsum(hits, axis=1) >= health
+    return np.where(finished.any(axis=1), finished.argmax(axis=1), hits.shape[1])
+
+
+def simulate_chunk(args: Tuple[int, int, int, int, int, int, np.random.SeedSequence]) -> Dict[str, float]:
+    """Run one batch of fights; returns summed outcomes for aggregation"""
+    fights, strength, player_health, enemy_health, enemy_attack, enemy_defense, seed = args
+    rng = np.random.default_rng(seed)
+
+    # Both sides deal at least 1 damage per turn, so this bounds the fight
+    max_turns = max(1, min(player_health, enemy_health))
+
+    player_hits = rng.integers(0, max(1, strength), size=(fights, max_turns), dtype=np.int32)
+    player_hits = np.maximum(1, player_hits + PLAYER_BASE_DAMAGE - enemy_defense)
+    enemy_hits = rng.integers(0, max(1, enemy_attack), size=(fights, max_turns), dtype=np.int32)
+    enemy_hits = np.maximum(1, enemy_hits + ENEMY_BASE_DAMAGE - PLAYER_DEFENSE)
+
+    kill_turn = _finishing_turn(player_hits, enemy_health)
+    death_turn = _finishing_turn(enemy_hits, player_health)
+
+    # The player strikes first each turn
+    wins = kill_turn <= death_turn
+    turns = np.where(wins, kill_turn, death_turn) + 1
+
+    return {
+        "fights": fights,
+        "wins": int(wins.sum()),
+        "turns": int(turns.sum()),
+        "win_turns": int(turns[wins].sum()),
+    }
+
+
+def _chunks(fights: int, build: Character, enemy: Enemy, seed: np.random.SeedSequence):
+    sizes = [CHUNK_SIZE] * (fights // CHUNK_SIZE)
+    if fights % CHUNK_SIZE:
+        sizes.append(fights % CHUNK_SIZE)
+    for size, child in zip(sizes, seed.spawn(len(sizes))):
+        yield (size, effective_strength(build), build.health, enemy.health,
+               enemy.attack, enemy.defense, child)
+
+
+def simulate(builds: List[Character], enemies: List[Enemy], fights: int,
+             workers: Optional[int] = None, seed: Optional[int] = None,
+             seconds_per_turn: float = SECONDS_PER_TURN) -> List[Dict]:
+    """Simulate every build against every enemy and summarize the results"""
+    root = np.random.SeedSequence(seed)
+    pairs = [(build, enemy) for build in builds for enemy in enemies]
+    pair_seeds = root.spawn(len(pairs))
+
+    jobs = []
+    for index, ((build, enemy), pair_seed) in enumerate(zip(pairs, pair_seeds)):
+        jobs.extend((index, chunk) for chunk in _chunks(fights, build, enemy, pair_seed))
+
+    totals = [{"fights": 0, "wins": 0, "turns": 0, "win_turns": 0} for _ in pairs]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(simulate_chunk, [chunk for _, chunk in jobs])
+        for (index, _), result in zip(jobs, results):
+            for key, value in result.items():
+                totals[index][key] += value
+
+    summary = []
+    for (build, enemy), total in zip(pairs, totals):
+        win_rate = total["wins"] / total["fights"]
+        minutes_per_fight = total["turns"] / total["fights"] * seconds_per_turn / 60
+        summary.append({
+            "build": build.name,
+            "level": build.level,
+            "levelBand": level_band(build.level),
+            "enemy": enemy.name,
+            "enemyLevel": enemy.level,
+            "fights": total["fights"],
+            "winRate": win_rate,
+            "turnsToKill": total["win_turns"] / total["wins"] if total["wins"] else None,
+            "goldPerMinute": win_rate * enemy.goldReward / minutes_per_fight,
+            "xpPerMinute": win_rate * enemy.experience / minutes_per_fight,
+        })
+    return summary
+
+
+def print_summary(summary: List[Dict]):
+    header = f"{'Band':<7} {'Build':<10} {'Enemy':<16} {'Win %':>7} {'TTK':>6} {'Gold/min':>9} {'XP/min':>9}"
+    print(header)
+    print("-" * len(header))
+    for row in summary:
+        ttk = "-" if row["turnsToKill"] is None else f"{row['turnsToKill']:.1f}"
+        print(
+            f"{row['levelBand']:<7} {row['build']:<10} {row['enemy']:<16} "
+            f"{row['winRate'] * 100:>6.1f}% {ttk:>6} "
+            f"{row['goldPerMinute']:>9.1f} {row['xpPerMinute']:>9.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Simulate fights to check enemy balance")
+    parser.add_argument("--fights", type=int, default=100_000, help="fights per build/enemy pair")
+    parser.add_argument("--builds", help="JSON file with a list of character documents")
+    parser.add_argument("--enemies", help="JSON file with a list of enemy documents")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument("--seed", type=int, help="seed for reproducible runs")
+    parser.add_argument("--seconds-per-turn", type=float, default=SECONDS_PER_TURN)
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    args = parser.parse_args()
+
+    if args.builds:
+        with open(args.builds) as f:
+            builds = [Character(**doc) for doc in json.load(f)]
+    else:
+        builds = default_builds()
+
+    if args.enemies:
+        with open(args.enemies) as f:
+            enemies = [Enemy(**doc) for doc in json.load(f)]
+    else:
+        enemies = [Enemy(**doc) for doc in SAMPLE_ENEMIES]
+
+    summary = simulate(builds, enemies, args.fights, args.workers, args.seed, args.seconds_per_turn)
+    print_summary(summary)
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,28 @@
+from catalog import CatalogSnapshot
+from models import Character, DerivedStats, Equipment
+
+EQUIPMENT_SLOTS = ("weapon", "armor", "helmet", "boots", "accessory")
+BONUS_STATS = ("damage", "defense", "speed", "strength")
+
+
+def derive_stats(equipment: Equipment, catalog: CatalogSnapshot) -> DerivedStats:
+    """Sum the bonuses of the equipped items"""
+    totals = dict.fromkeys(BONUS_STATS, 0)
+    for slot in EQUIPMENT_SLOTS:
+        item = catalog.items.get(getattr(equipment, slot))
+        if item:
+            for stat in BONUS_STATS:
+                totals[stat] += getattr(item, stat) or 0
+    return DerivedStats(**totals, catalogVersion=catalog.fingerprint)
+
+
+def stats_current(character: Character, catalog: CatalogSnapshot) -> bool:
+    """Whether the character's derived stats match this catalog"""
+    derived = character.derivedStats
+    return derived is not None and derived.catalogVersion == catalog.fingerprint
+
+
+def effective_strength(character: Character) -> int:
+    """Base strength plus the bonus from equipped items"""
+    bonus = character.derivedStats.strength if character.derivedStats else 0
+    return character.stats.strength + bonus
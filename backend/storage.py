@@ -0,0 +1,401 @@
+import asyncio
+from abc import ABC, abstractmethod
+from typing import Callable, Collection, Dict, List, Optional, Tuple, Union
+
+from catalog import CatalogCache
+from indexes import IndexReport
+from models import Battle, Character, CharacterUpdate, Enemy, Item, ItemRarity, ItemType, Quest, QuestType
+from stats import derive_stats, stats_current
+
+# Items offered in the shop, for now a fixed selection
+SHOP_ITEM_IDS = ["item_8", "item_9", "item_6", "item_7", "item_5", "item_10"]
+
+# Character fields shown on the leaderboards
+LEADERBOARD_FIELDS = ("name", "level", "experience", "gold")
+
+
+# Inventory entry and player quest fields as stored, the rest comes from the catalog
+SLOT_FIELDS = ("quantity", "equipped")
+PLAYER_QUEST_FIELDS = ("userId", "progress", "completed", "active", "startedAt")
+
+# Parts of a player's state that change notifications name
+CHANGE_PARTS = ("character", "inventory", "quests")
+
+
+def project(entry: Dict, fields: Optional[Collection[str]], keys: Tuple[str, ...]) -> Dict:
+    """Keep only the requested fields of an entry, plus its key fields"""
+    if fields is None:
+        return entry
+    return {field: entry[field] for field in (*keys, *fields) if field in entry}
+
+
+def check_amount(amount: int, name: str = "Amount"):
+    """Raise ValueError unless amount is positive; guarded writes only bound it from above"""
+    if amount <= 0:
+        raise ValueError(f"{name} must be positive, got {amount}")
+
+
+def check_quantities(items: Dict[str, int]):
+    """Raise ValueError unless there are items and every quantity is positive"""
+    if not items:
+        raise ValueError("No items given")
+    for item_id, quantity in items.items():
+        check_amount(quantity, f"Quantity of {item_id}")
+
+
+def value_histogram(values: List[int], buckets: int, total: int) -> List[Tuple[int, int, int]]:
+    """(lowest, highest, count) ranges of about equal size over values sorted best first.
+
+    ``values`` may be a sample of ``total`` players; counts are scaled up
+    to match.
+    """
+    if not values:
+        return []
+    size = -(-len(values) // buckets)
+    scale = total / len(values)
+    return [
+        (chunk[-1], chunk[0], round(len(chunk) * scale))
+        for chunk in (values[start:start + size] for start in range(0, len(values), size))
+    ]
+
+
+def leaderboard_entry(char_data: Dict) -> Dict:
+    """Leaderboard view of a character document"""
+    entry = {"userId": char_data["_id"]}
+    for field in LEADERBOARD_FIELDS:
+        entry[field] = char_data[field]
+    return entry
+
+
+class GameStorage(ABC):
+    """Storage operations the API is built on.
+
+    GameDatabase implements this on MongoDB and InMemoryGameDatabase on
+    plain dicts. Catalog lookups are shared here since they only need the
+    catalog cache.
+    """
+
+    catalog: CatalogCache
+
+    def __init__(self):
+        self._change_listeners: List[Callable[[str, Tuple[str, ...]], None]] = []
+
+    # Change notifications
+    def add_change_listener(self, listener: Callable[[str, Tuple[str, ...]], None]):
+        """Call ``listener(user_id, parts)`` after every committed change to a player.
+
+        ``parts`` names what changed, out of CHANGE_PARTS. Listeners run
+        synchronously inside the write and must not block.
+        """
+        self._change_listeners.append(listener)
+
+    def _publish_change(self, user_id: str, *parts: str):
+        for listener in self._change_listeners:
+            listener(user_id, parts)
+
+    def follow_changes(self, follow: bool):
+        """Also publish changes other processes make, while ``follow`` is set.
+
+        Following costs a feed of every player write, so callers should only
+        ask for it while someone listens. Storage no other process writes to
+        ignores this.
+        """
+
+    # Lifecycle
+    async def start(self):
+        """Start background work (nothing by default)"""
+
+    async def stop(self):
+        """Stop background work and write out anything buffered"""
+
+    @abstractmethod
+    async def initialize_game_data(self):
+        """Seed the catalog if it is empty"""
+
+    async def ensure_indexes(self) -> IndexReport:
+        """Create any missing indexes (nothing to do by default)"""
+        return IndexReport()
+
+    async def migrate_inventories(self) -> int:
+        """Migrate old inventory layouts; returns how many were converted"""
+        return 0
+
+    # Players
+    @abstractmethod
+    async def provision_player(self, user_id: str) -> Dict:
+        """Create the default character, inventory and starter quests if missing"""
+
+    # Character methods
+    @abstractmethod
+    async def get_character(self, user_id: str) -> Character:
+        """Get character by user ID, create if doesn't exist"""
+
+    @abstractmethod
+    async def update_character(self, user_id: str, updates: CharacterUpdate,
+                               projection: Optional[Dict] = None) -> Union[Character, Dict]:
+        """Update character data and return the updated document"""
+
+    async def get_character_with_stats(self, user_id: str) -> Character:
+        """Get character with derived stats matching the current catalog"""
+        return await self.refresh_derived_stats(await self.get_character(user_id))
+
+    async def refresh_derived_stats(self, character: Character) -> Character:
+        """Recompute derived stats if the item catalog changed since they were stored"""
+        catalog = await self.catalog.get()
+        if stats_current(character, catalog):
+            return character
+        return await self.update_character(
+            character.id, CharacterUpdate(derivedStats=derive_stats(character.equipment, catalog))
+        )
+
+    @abstractmethod
+    async def spend_gold(self, user_id: str, amount: int) -> Optional[Character]:
+        """Deduct gold only if the character has at least that much; raises ValueError unless amount is positive"""
+
+    @abstractmethod
+    async def grant_rewards(self, user_id: str, experience: int = 0, gold: int = 0) -> Optional[Character]:
+        """Add experience and gold"""
+
+    @abstractmethod
+    async def restore_health(self, user_id: str, amount: int) -> Optional[Character]:
+        """Heal the character, capped at maxHealth"""
+
+    @abstractmethod
+    async def restore_mana(self, user_id: str, amount: int) -> Optional[Character]:
+        """Restore mana, capped at maxMana"""
+
+    # Inventory methods
+    @abstractmethod
+    async def get_inventory(self, user_id: str) -> List[Dict]:
+        """Get user inventory with item details"""
+
+    @abstractmethod
+    async def hydrate_inventory_items(self, inv_items: List[Dict]) -> List[Dict]:
+        """Merge item details into inventory entries, keeping their order"""
+
+    @abstractmethod
+    async def inventory_page(self, user_id: str, limit: Optional[int] = None, after: Optional[str] = None,
+                             item_ids: Optional[Collection[str]] = None,
+                             fields: Optional[Collection[str]] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Stored inventory entries in item id order, starting after an item id.
+
+        Only ``item_ids`` are listed if given, and only the ``fields`` of
+        SLOT_FIELDS read. Also returns the item id to continue after, or
+        None on the last page.
+        """
+
+    async def get_inventory_page(self, user_id: str, limit: Optional[int] = None, after: Optional[str] = None,
+                                 item_type: Optional[ItemType] = None, rarity: Optional[ItemRarity] = None,
+                                 fields: Optional[Collection[str]] = None) -> Tuple[List[Dict], Optional[str]]:
+        """One page of the inventory with item details, filtered by item type and rarity"""
+        item_ids = None
+        if item_type is not None or rarity is not None:
+            catalog = await self.catalog.get()
+            item_ids = [
+                item_id for item_id, item in catalog.items.items()
+                if (item_type is None or item.type == item_type) and (rarity is None or item.rarity == rarity)
+            ]
+
+        inv_items, next_after = await self.inventory_page(
+            user_id, limit, after, item_ids, None if fields is None else [f for f in fields if f in SLOT_FIELDS]
+        )
+        inventory = await self.hydrate_inventory_items(inv_items)
+        return [project(entry, fields, ("itemId",)) for entry in inventory], next_after
+
+    @abstractmethod
+    async def add_items_to_inventory(self, user_id: str, items: Dict[str, int]):
+        """Add several items to inventory in one write; raises ValueError unless every quantity is positive"""
+
+    @abstractmethod
+    async def remove_items_from_inventory(self, user_id: str, items: Dict[str, int]) -> bool:
+        """Remove several items in one write, only if enough of each is held.
+
+        Raises ValueError unless every quantity is positive.
+        """
+
+    async def add_item_to_inventory(self, user_id: str, item_id: str, quantity: int = 1):
+        """Add item to inventory"""
+        await self.add_items_to_inventory(user_id, {item_id: quantity})
+
+    async def remove_item_from_inventory(self, user_id: str, item_id: str, quantity: int = 1) -> bool:
+        """Remove item from inventory, only if enough of it is held"""
+        return await self.remove_items_from_inventory(user_id, {item_id: quantity})
+
+    # Shop methods
+    async def buy_items(self, user_id: str, items: Dict[str, int], cost: int) -> Optional[Character]:
+        """Spend gold on items; None if the character cannot afford them.
+
+        The gold and the inventory live in separate documents, so a failed
+        inventory write refunds the gold rather than losing it.
+        """
+        character = await self.spend_gold(user_id, cost)
+        if character is None:
+            return None
+        try:
+            await self.add_items_to_inventory(user_id, items)
+        except Exception:
+            await self.grant_rewards(user_id, gold=cost)
+            raise
+        return character
+
+    async def sell_items(self, user_id: str, items: Dict[str, int], proceeds: int) -> Optional[Character]:
+        """Sell items for gold; None if any of them is not held in that quantity.
+
+        Like buy_items, a failed gold write gives the items back rather than
+        losing them.
+        """
+        if not await self.remove_items_from_inventory(user_id, items):
+            return None
+        try:
+            return await self.grant_rewards(user_id, gold=proceeds)
+        except Exception:
+            await self.add_items_to_inventory(user_id, items)
+            raise
+
+    # Quest methods
+    @abstractmethod
+    async def get_user_quests(self, user_id: str) -> List[Dict]:
+        """Get user quests with details"""
+
+    @abstractmethod
+    async def hydrate_player_quests(self, player_quests: List[Dict]) -> List[Dict]:
+        """Merge quest details into player quests, keeping their order"""
+
+    @abstractmethod
+    async def player_quests_page(self, user_id: str, limit: Optional[int] = None, after: Optional[str] = None,
+                                 quest_ids: Optional[Collection[str]] = None, active: Optional[bool] = None,
+                                 fields: Optional[Collection[str]] = None) -> Tuple[List[Dict], Optional[str]]:
+        """Stored player quests in id order, starting after a player quest id.
+
+        Only ``quest_ids`` are listed if given, and only the ``fields`` of
+        PLAYER_QUEST_FIELDS read. Also returns the id to continue after, or
+        None on the last page.
+        """
+
+    async def get_user_quests_page(self, user_id: str, limit: Optional[int] = None, after: Optional[str] = None,
+                                   quest_type: Optional[QuestType] = None, active: Optional[bool] = None,
+                                   fields: Optional[Collection[str]] = None) -> Tuple[List[Dict], Optional[str]]:
+        """One page of the user's quests with details, filtered by quest type and state"""
+        quest_ids = None
+        if quest_type is not None:
+            catalog = await self.catalog.get()
+            quest_ids = [quest_id for quest_id, quest in catalog.quests.items() if quest.type == quest_type]
+
+        player_quests, next_after = await self.player_quests_page(
+            user_id, limit, after, quest_ids, active,
+            None if fields is None else [f for f in fields if f in PLAYER_QUEST_FIELDS]
+        )
+        quests = await self.hydrate_player_quests(player_quests)
+        return [project(quest, fields, ("_id", "questId")) for quest in quests], next_after
+
+    @abstractmethod
+    async def add_quest_progress(self, increments: Dict[Tuple[str, str], int],
+                                 maxima: Dict[Tuple[str, str], int]):
+        """Update the progress of active player quests, keyed by (user id, quest id).
+
+        ``increments`` are added to the progress, ``maxima`` raise it to at
+        least that value.
+        """
+
+    @abstractmethod
+    async def claim_player_quest(self, user_id: str, quest_id: str) -> Optional[str]:
+        """Mark an active player quest completed with its reward pending.
+
+        Returns the player quest id, also for a quest claimed earlier whose
+        reward is still pending, or None if there is nothing to pay out.
+        """
+
+    @abstractmethod
+    async def grant_quest_rewards(self, user_id: str, claim_id: str, experience: int = 0,
+                                  gold: int = 0) -> Optional[Character]:
+        """Add a claim's experience and gold once; None if it was already paid"""
+
+    @abstractmethod
+    async def add_quest_items(self, user_id: str, claim_id: str, items: Dict[str, int]) -> bool:
+        """Add a claim's items once; False if they were already added"""
+
+    @abstractmethod
+    async def finish_player_quest_claim(self, user_id: str, claim_id: str):
+        """Clear the pending reward once it is fully paid"""
+
+    async def complete_quest(self, user_id: str, quest: Quest) -> Optional[Tuple[Character, bool]]:
+        """Claim an active quest and pay out its rewards exactly once.
+
+        The claim marks the player quest completed with its reward pending.
+        Each reward write is guarded by the player quest id, recorded in the
+        same document in the same update, so repeating it changes nothing.
+        If a payout fails halfway, completing the quest again finishes it
+        instead of failing. Returns the character and whether this call paid
+        the gold, or None if the quest was neither active nor pending.
+        """
+        claim_id = await self.claim_player_quest(user_id, quest.id)
+        if claim_id is None:
+            return None
+
+        reward = quest.reward
+        writes = [self.grant_quest_rewards(user_id, claim_id, reward.experience, reward.gold)]
+        if reward.item:
+            writes.append(self.add_quest_items(user_id, claim_id, {reward.item: 1}))
+        character, *_ = await asyncio.gather(*writes)
+        await self.finish_player_quest_claim(user_id, claim_id)
+        if character is None:
+            return await self.get_character(user_id), False
+        return character, True
+
+    # Battle methods
+    @abstractmethod
+    async def load_battle(self, battle_id: str) -> Optional[Battle]:
+        """Get a stored battle"""
+
+    @abstractmethod
+    async def save_battles(self, battles: List[Battle]):
+        """Store battles, replacing earlier versions"""
+
+    # Leaderboard methods
+    @abstractmethod
+    async def leaderboard_page(self, metric: str, limit: int, after: Optional[Tuple[int, str]] = None,
+                               ahead: bool = False) -> List[Dict]:
+        """Players ranked by metric, highest first and ties by user id.
+
+        ``after`` is a (value, user id) position: the page starts right
+        below it, or with ``ahead`` lists the players right above it,
+        nearest first.
+        """
+
+    @abstractmethod
+    async def leaderboard_rank(self, metric: str, value: int, user_id: str) -> Optional[int]:
+        """1-based rank of the player at this position.
+
+        None if counting it would mean walking every player above, which
+        is O(rank); callers then estimate it from leaderboard_histogram.
+        """
+
+    @abstractmethod
+    async def leaderboard_histogram(self, metric: str, buckets: int) -> List[Tuple[int, int, int]]:
+        """Players per value range as (lowest, highest, count), best range first; may be estimated"""
+
+    # Catalog methods; the returned models are shared with the catalog cache, do not mutate them
+    async def get_item(self, item_id: str) -> Optional[Item]:
+        """Get specific item from the catalog"""
+        catalog = await self.catalog.get()
+        return catalog.items.get(item_id)
+
+    async def get_all_enemies(self) -> List[Enemy]:
+        """Get all enemies"""
+        catalog = await self.catalog.get()
+        return list(catalog.enemies.values())
+
+    async def get_enemy(self, enemy_id: str) -> Optional[Enemy]:
+        """Get specific enemy"""
+        catalog = await self.catalog.get()
+        return catalog.enemies.get(enemy_id)
+
+    async def get_quest(self, quest_id: str) -> Optional[Quest]:
+        """Get specific quest from the catalog"""
+        catalog = await self.catalog.get()
+        return catalog.quests.get(quest_id)
+
+    async def get_shop_items(self) -> List[Item]:
+        """Get all shop items"""
+        catalog = await self.catalog.get()
+        return [item for item_id, item in catalog.items.items() if item_id in SHOP_ITEM_IDS]
@@ -8,6 +8,17 @@ const USER_ID = 'player1';
 
 // API Service class
 class RPGApiService {
+  // Bootstrap API
+  async getBootstrap(userId = USER_ID) {
+    try {
+      const response = await axios.get(`${API}/bootstrap/${userId}`);
+      return response.data;
+    } catch (error) {
+      console.error('Error getting bootstrap data:', error);
+      throw error;
+    }
+  }
+
   // Character API
   async getCharacter(userId = USER_ID) {
     try {
@@ -40,6 +51,17 @@ class RPGApiService {
     }
   }
 
+  // params: limit, cursor, type, rarity, fields
+  async getInventoryPage(userId = USER_ID, params = {}) {
+    try {
+      const response = await axios.get(`${API}/inventory/${userId}`, { params });
+      return { items: response.data, nextCursor: response.headers['x-next-cursor'] || null };
+    } catch (error) {
+      console.error('Error getting inventory page:', error);
+      throw error;
+    }
+  }
+
   async useItem(userId = USER_ID, itemId, quantity = 1) {
     try {
       const response = await axios.post(`${API}/inventory/${userId}/use`, {
@@ -78,6 +100,76 @@ class RPGApiService {
     }
   }
 
+  // Battle API
+  async startBattle(userId = USER_ID, enemyId) {
+    try {
+      const response = await axios.post(`${API}/battle/start`, {
+        userId,
+        enemyId
+      });
+      return response.data;
+    } catch (error) {
+      console.error('Error starting battle:', error);
+      throw error;
+    }
+  }
+
+  async battleAction(userId = USER_ID, battleId, action = 'attack') {
+    try {
+      const response = await axios.post(`${API}/battle/action`, {
+        userId,
+        battleId,
+        action
+      });
+      return response.data;
+    } catch (error) {
+      console.error('Error in battle action:', error);
+      throw error;
+    }
+  }
+
+  async getBattleStatus(battleId) {
+    try {
+      const response = await axios.get(`${API}/battle/status/${battleId}`);
+      return response.data;
+    } catch (error) {
+      console.error('Error getting battle status:', error);
+      throw error;
+    }
+  }
+
+  // Leaderboard API
+  async getLeaderboard(metric = 'level', limit = 20, cursor = null) {
+    try {
+      const params = cursor ? { limit, cursor } : { limit };
+      const response = await axios.get(`${API}/leaderboard/${metric}`, { params });
+      return response.data;
+    } catch (error) {
+      console.error('Error getting leaderboard:', error);
+      throw error;
+    }
+  }
+
+  async getLeaderboardAround(metric = 'level', userId = USER_ID, radius = 5) {
+    try {
+      const response = await axios.get(`${API}/leaderboard/${metric}/around/${userId}`, {
+        params: { radius }
+      });
+      return response.data;
+    } catch (error) {
+      console.error('Error getting leaderboard position:', error);
+      throw error;
+    }
+  }
+
+  // Live updates: a snapshot first, then diffs of the character, inventory and quests
+  subscribe(userId = USER_ID, onMessage) {
+    const socket = new WebSocket(`${BACKEND_URL.replace(/^http/, 'ws')}/ws/${userId}`);
+    socket.onmessage = (event) => onMessage(JSON.parse(event.data));
+    socket.onerror = (error) => console.error('Error in live updates:', error);
+    return socket;
+  }
+
   // Quest API
   async getQuests(userId = USER_ID) {
     try {
@@ -89,6 +181,17 @@ class RPGApiService {
     }
   }
 
+  // params: limit, cursor, type, active, fields
+  async getQuestsPage(userId = USER_ID, params = {}) {
+    try {
+      const response = await axios.get(`${API}/quests/${userId}`, { params });
+      return { quests: response.data, nextCursor: response.headers['x-next-cursor'] || null };
+    } catch (error) {
+      console.error('Error getting quests page:', error);
+      throw error;
+    }
+  }
+
   async completeQuest(userId = USER_ID, questId) {
     try {
       const response = await axios.post(`${API}/quests/${userId}/complete/${questId}`);
@@ -137,6 +240,32 @@ class RPGApiService {
       throw error;
     }
   }
+
+  async buyCart(userId = USER_ID, items) {
+    try {
+      const response = await axios.post(`${API}/shop/cart/buy`, {
+        userId,
+        items
+      });
+      return response.data;
+    } catch (error) {
+      console.error('Error buying cart:', error);
+      throw error;
+    }
+  }
+
+  async sellCart(userId = USER_ID, items) {
+    try {
+      const response = await axios.post(`${API}/shop/cart/sell`, {
+        userId,
+        items
+      });
+      return response.data;
+    } catch (error) {
+      console.error('Error selling cart:', error);
+      throw error;
+    }
+  }
 }
 
 // Export singleton instance
@@ -0,0 +1,69 @@
+import os
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+from mongomock_motor import AsyncMongoMockClient
+
+# Backend modules import each other by module name
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from character_cache import WriteBehindGameDatabase  # noqa: E402
+from database import GameDatabase  # noqa: E402
+from memory_db import InMemoryGameDatabase  # noqa: E402
+
+BACKENDS = ("memory", "mongodb", "write_behind")
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+async def open_storage(backend: str):
+    """Seeded storage of the given kind, on mongomock for the MongoDB ones"""
+    if backend == "memory":
+        db = InMemoryGameDatabase()
+    elif backend == "mongodb":
+        db = GameDatabase(AsyncMongoMockClient(), "rpg_test")
+    else:
+        db = WriteBehindGameDatabase(AsyncMongoMockClient(), "rpg_test", flush_interval=3600)
+    await db.initialize_game_data()
+    await db.ensure_indexes()
+    return db
+
+
+@pytest.fixture(params=BACKENDS)
+async def storage(request):
+    db = await open_storage(request.param)
+    yield db
+    await db.stop()
+
+
+@pytest.fixture
+async def make_storage():
+    """Opens storage of a given kind; all of it is stopped after the test"""
+    opened = []
+
+    async def make(backend: str):
+        db = await open_storage(backend)
+        opened.append(db)
+        return db
+
+    yield make
+    for db in opened:
+        await db.stop()
+
+
+@pytest.fixture(params=("memory", "mongodb"))
+def api(request, monkeypatch):
+    """Client for the app on the given storage backend, with admission control off"""
+    import server
+
+    monkeypatch.setenv("STORAGE_BACKEND", request.param)
+    monkeypatch.setenv("MONGO_URL", "mongodb://test")
+    monkeypatch.setenv("DB_NAME", "rpg_test")
+    monkeypatch.setattr(server, "AsyncIOMotorClient", lambda url, **kwargs: AsyncMongoMockClient())
+    monkeypatch.setattr(server.admission, "enabled", False)
+    with TestClient(server.app) as client:
+        yield client
@@ -0,0 +1,93 @@
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+import server
+from admission import AdmissionController, AdmissionMiddleware, RouteLimit
+from metrics import MetricsMiddleware, MetricsRegistry
+
+BUY = "POST /api/shop/buy"
+
+
+def test_user_over_their_limit_gets_429():
+    controller = AdmissionController({BUY: RouteLimit(1, 1)}, global_rate=None)
+
+    assert controller.admit(BUY, "p1") is None
+    status, reason, retry_after = controller.admit(BUY, "p1")
+    assert (status, reason) == (429, "user") and retry_after > 0
+    assert controller.admit(BUY, "p2") is None
+
+
+def test_shedding_gives_back_the_users_tokens():
+    controller = AdmissionController({BUY: RouteLimit(1, 1, 1, 1)}, global_rate=None)
+    assert controller.admit(BUY, "p1") is None
+
+    status, reason, _ = controller.admit(BUY, "p2")
+    assert (status, reason) == (503, "route")
+    assert controller._user_buckets[(BUY, "p2")].tokens == 1
+
+
+@pytest.mark.parametrize("signal, value, reason", [("in_flight", 500, "in_flight"), ("loop_lag", 1.0, "loop_lag")])
+def test_overloaded_server_sheds_with_503(signal, value, reason):
+    controller = AdmissionController()
+    setattr(controller, signal, value)
+
+    assert controller.admit(BUY, "p1") == (503, reason, 1.0)
+    assert controller.admit("GET /metrics", None) is None
+
+
+@pytest.fixture
+def limited():
+    """A small app behind metrics and admission control, as the server stacks them"""
+    registry = MetricsRegistry()
+    controller = AdmissionController({BUY: RouteLimit(1, 1)}, global_rate=None)
+    app = FastAPI()
+
+    @app.post("/api/shop/buy")
+    async def buy():
+        return {}
+
+    @app.get("/api/character/{user_id}")
+    async def character(user_id: str):
+        return {}
+
+    app.add_middleware(AdmissionMiddleware, controller=controller, registry=registry)
+    app.add_middleware(MetricsMiddleware, registry=registry)
+    return TestClient(app), controller, registry
+
+
+def test_shed_requests_are_counted_under_their_route(limited):
+    client, controller, registry = limited
+
+    assert client.post("/api/shop/buy", json={"userId": "p1"}).status_code == 200
+    refused = client.post("/api/shop/buy", json={"userId": "p1"})
+    assert refused.status_code == 429 and int(refused.headers["retry-after"]) >= 1
+    controller.max_in_flight = 0
+    assert client.get("/api/character/p1").status_code == 503
+
+    assert dict(registry.http_requests) == {
+        ("POST", "/api/shop/buy", 200): 1,
+        ("POST", "/api/shop/buy", 429): 1,
+        ("GET", "/api/character/{user_id}", 503): 1,
+    }
+    assert dict(registry.http_shed) == {(BUY, "user"): 1, ("GET /api/character/{user_id}", "in_flight"): 1}
+
+
+def test_battle_actions_are_limited_per_user(api, monkeypatch):
+    monkeypatch.setattr(server.admission, "enabled", True)
+    monkeypatch.setattr(server.admission, "max_loop_lag", float("inf"))
+    monkeypatch.setattr(server.admission, "route_limits", {"POST /api/battle/action": RouteLimit(1, 1)})
+    monkeypatch.setattr(server.admission, "_user_buckets", {})
+    monkeypatch.setattr(server.admission, "_route_buckets", {})
+
+    battles = {}
+    for user_id in ("p1", "p2"):
+        response = api.post("/api/battle/start", json={"userId": user_id, "enemyId": "enemy_1"})
+        battles[user_id] = response.json()["_id"]
+
+    def act(user_id):
+        return api.post("/api/battle/action", json={"userId": user_id, "battleId": battles[user_id], "action": "attack"})
+
+    assert act("p1").status_code == 200
+    assert act("p1").status_code == 429
+    assert act("p2").status_code == 200
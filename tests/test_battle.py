@@ -0,0 +1,86 @@
+import random
+
+import pytest
+
+import server
+from battle import BattleSession
+from database import default_character
+from models import Enemy
+
+
+def _start(api, user_id="p1", enemy_id="enemy_1"):
+    response = api.post("/api/battle/start", json={"userId": user_id, "enemyId": enemy_id})
+    assert response.status_code == 200
+    return response.json()
+
+
+def _act(api, battle, action="attack", user_id="p1"):
+    return api.post("/api/battle/action", json={"userId": user_id, "battleId": battle["_id"], "action": action})
+
+
+def _win(api):
+    """Battle enemy_1 until a battle is won; returns that battle and its last action"""
+    for _ in range(10):
+        api.put("/api/character/p1", json={"health": 100})
+        battle = _start(api)
+        while True:
+            result = _act(api, battle).json()
+            if result["battleEnded"]:
+                break
+        if result["victory"]:
+            return battle, result
+    pytest.fail("No battle won")
+
+
+def test_won_battle_pays_once(api):
+    character = api.get("/api/character/p1").json()
+    enemy = next(enemy for enemy in api.get("/api/enemies").json() if enemy["_id"] == "enemy_1")
+
+    battle, result = _win(api)
+
+    assert result["rewards"] == {"experience": enemy["experience"], "gold": enemy["goldReward"]}
+    after = api.get("/api/character/p1").json()
+    assert after["gold"] == character["gold"] + enemy["goldReward"]
+    assert after["experience"] == character["experience"] + enemy["experience"]
+
+    response = _act(api, battle)
+    assert response.status_code == 400
+    assert api.get("/api/character/p1").json()["gold"] == after["gold"]
+
+
+def test_finished_battles_are_persisted(api):
+    battle, _ = _win(api)
+    api.portal.call(server.battle_store.flush)
+
+    # Evicted from memory, so no more actions, but the status is kept
+    assert _act(api, battle).status_code == 404
+    status = api.get(f"/api/battle/status/{battle['_id']}").json()
+    assert status["victory"] and status["enemyHealth"] == 0
+
+
+def test_actions_are_limited_to_the_owner(api):
+    battle = _start(api)
+
+    assert _act(api, battle, user_id="p2").status_code == 404
+    assert api.post("/api/battle/action", json={"battleId": battle["_id"], "action": "attack"}).status_code == 422
+    assert _act(api, battle, action="dance").status_code == 400
+    assert _act(api, battle).status_code == 200
+
+
+def test_unknown_battles_and_enemies(api):
+    assert api.post("/api/battle/start", json={"userId": "p1", "enemyId": "nope"}).status_code == 404
+    assert _act(api, {"_id": "battle_nope"}).status_code == 404
+    assert api.get("/api/battle/status/battle_nope").status_code == 404
+
+
+def test_magic_needs_mana():
+    character = default_character("p1")
+    character.mana = 5
+    enemy = Enemy(id="e", name="Dummy", level=1, health=50, maxHealth=50, attack=1, defense=0,
+                  experience=1, goldReward=1, image="")
+    session = BattleSession.start(character, enemy)
+
+    with pytest.raises(ValueError):
+        session.act("magic", random.Random(1))
+    result = session.act("defend", random.Random(1))
+    assert result.enemyHealth == 50 and not result.battleEnded
@@ -0,0 +1,89 @@
+import asyncio
+
+import pytest
+
+from models import CharacterUpdate
+
+pytestmark = pytest.mark.anyio
+
+
+async def _stored_gold(db, user_id):
+    return (await db.characters.find_one({"_id": user_id}))["gold"]
+
+
+async def test_changes_are_written_on_flush(make_storage):
+    db = await make_storage("write_behind")
+    gold = (await db.get_character("p1")).gold
+
+    await db.spend_gold("p1", 100)
+    await db.grant_rewards("p1", experience=10)
+    assert await _stored_gold(db, "p1") == gold
+
+    await db.flush()
+    stored = await db.characters.find_one({"_id": "p1"})
+    assert stored["gold"] == gold - 100
+    assert stored["experience"] == 2410
+
+
+async def test_concurrent_flush_does_not_evict_an_entry_being_written(make_storage, monkeypatch):
+    db = await make_storage("write_behind")
+    db.idle_timeout = 0
+    gold = (await db.get_character("p1")).gold
+    await db.spend_gold("p1", 100)
+
+    release = asyncio.Event()
+    bulk_write = db.characters.bulk_write
+
+    async def slow_bulk_write(*args, **kwargs):
+        await release.wait()
+        return await bulk_write(*args, **kwargs)
+
+    monkeypatch.setattr(db.characters, "bulk_write", slow_bulk_write)
+    first = asyncio.create_task(db.flush())
+    await asyncio.sleep(0)
+    second = asyncio.create_task(db.flush())
+    await asyncio.sleep(0)
+
+    # Still cached: reloading now would read the document from before the write
+    assert (await db.get_character("p1")).gold == gold - 100
+    release.set()
+    await asyncio.gather(first, second)
+    assert await _stored_gold(db, "p1") == gold - 100
+
+
+async def test_failed_flush_keeps_changes_buffered(make_storage, monkeypatch):
+    db = await make_storage("write_behind")
+    db.idle_timeout = 0
+    gold = (await db.get_character("p1")).gold
+    await db.spend_gold("p1", 100)
+
+    async def unavailable(*args, **kwargs):
+        raise RuntimeError("storage unavailable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(db.characters, "bulk_write", unavailable)
+        with pytest.raises(RuntimeError):
+            await db.flush()
+
+    assert "p1" in db._cached
+    await db.flush()
+    assert await _stored_gold(db, "p1") == gold - 100
+
+
+async def test_leaderboard_merges_buffered_values_without_flushing(make_storage):
+    memory = await make_storage("memory")
+    db = await make_storage("write_behind")
+    for store in (memory, db):
+        for i in range(12):
+            await store.update_character(f"u{i:02d}", CharacterUpdate(gold=100 * i))
+        await store.spend_gold("u11", 1050)
+        await store.grant_rewards("u00", gold=650)
+        await store.update_character("u05", CharacterUpdate(name="Renamed"))
+    stored = {doc["_id"]: doc["gold"] async for doc in db.characters.find({}, {"gold": 1})}
+
+    assert await db.leaderboard_page("gold", 20) == await memory.leaderboard_page("gold", 20)
+    for after in ((650, "u00"), (500, "u05"), (50, "u11")):
+        for ahead in (False, True):
+            assert (await db.leaderboard_page("gold", 3, after, ahead)
+                    == await memory.leaderboard_page("gold", 3, after, ahead))
+    assert {doc["_id"]: doc["gold"] async for doc in db.characters.find({}, {"gold": 1})} == stored
@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from models import CharacterUpdate
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_parallel_spend_gold_never_overdraws(storage):
+    gold = (await storage.get_character("p1")).gold
+
+    results = await asyncio.gather(*(storage.spend_gold("p1", 100) for _ in range(20)))
+
+    paid = [character for character in results if character is not None]
+    assert len(paid) == gold // 100
+    assert (await storage.get_character("p1")).gold == gold % 100
+
+
+async def test_spend_gold_refuses_more_than_held(storage):
+    gold = (await storage.get_character("p1")).gold
+
+    assert await storage.spend_gold("p1", gold + 1) is None
+    assert (await storage.get_character("p1")).gold == gold
+
+
+async def test_restore_health_is_capped(storage):
+    await storage.update_character("p1", CharacterUpdate(health=40))
+
+    character = await storage.restore_health("p1", 25)
+    assert character.health == 65
+
+    character = await storage.restore_health("p1", 1000)
+    assert character.health == character.maxHealth
+
+    character = await storage.restore_health("p1", -1000)
+    assert character.health == 0
+
+
+@pytest.mark.parametrize("amount", [0, -5])
+async def test_non_positive_amounts_are_rejected(storage, amount):
+    gold = (await storage.get_character("p1")).gold
+    inventory = await storage.get_inventory("p1")
+
+    with pytest.raises(ValueError):
+        await storage.spend_gold("p1", amount)
+    with pytest.raises(ValueError):
+        await storage.remove_items_from_inventory("p1", {"item_6": amount})
+    with pytest.raises(ValueError):
+        await storage.add_items_to_inventory("p1", {"item_6": 1, "item_7": amount})
+
+    assert (await storage.get_character("p1")).gold == gold
+    assert await storage.get_inventory("p1") == inventory
@@ -0,0 +1,98 @@
+import pytest
+
+import server
+from events import GameEvent, GameEventBus, QuestProgressTracker
+from models import QuestType
+
+pytestmark = pytest.mark.anyio
+
+
+async def _tracker(db):
+    await db.get_user_quests("p1")
+    await db.catalog.get()
+    bus = GameEventBus()
+    tracker = QuestProgressTracker(db)
+    bus.subscribe(tracker.handle)
+    return bus, tracker
+
+
+async def _progress(db):
+    return {quest["questId"]: quest["progress"] for quest in await db.get_user_quests("p1")}
+
+
+async def test_matching_events_count_towards_active_quests(storage):
+    bus, tracker = await _tracker(storage)
+    before = await _progress(storage)
+
+    bus.publish(
+        GameEvent(QuestType.kill, "p1", "Goblin Harcos"),
+        GameEvent(QuestType.kill, "p1", "Goblin Harcos", amount=2),
+        GameEvent(QuestType.kill, "p1", "Ork Harcos"),
+        GameEvent(QuestType.level, "p1", amount=14),
+        GameEvent(QuestType.level, "p1", amount=13),
+        GameEvent(QuestType.collect, "p1", "gold", amount=500),
+    )
+    assert await _progress(storage) == before
+    await tracker.flush()
+
+    assert await _progress(storage) == {"quest_1": before["quest_1"] + 3, "quest_2": 14}
+
+
+async def test_level_progress_never_goes_down(storage):
+    bus, tracker = await _tracker(storage)
+
+    bus.publish(GameEvent(QuestType.level, "p1", amount=5))
+    await tracker.flush()
+
+    assert (await _progress(storage))["quest_2"] == 12
+
+
+async def test_completed_quests_stop_counting(storage):
+    bus, tracker = await _tracker(storage)
+    bus.publish(GameEvent(QuestType.level, "p1", amount=15))
+    await tracker.flush()
+    assert await storage.complete_quest("p1", await storage.get_quest("quest_2"))
+
+    bus.publish(GameEvent(QuestType.level, "p1", amount=20))
+    await tracker.flush()
+
+    assert (await _progress(storage))["quest_2"] == 15
+
+
+async def test_failed_flush_keeps_progress_queued(storage, monkeypatch):
+    bus, tracker = await _tracker(storage)
+    bus.publish(GameEvent(QuestType.kill, "p1", "Goblin Harcos"))
+
+    async def unavailable(*args, **kwargs):
+        raise RuntimeError("storage unavailable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(storage, "add_quest_progress", unavailable)
+        with pytest.raises(RuntimeError):
+            await tracker.flush()
+    bus.publish(GameEvent(QuestType.kill, "p1", "Goblin Harcos"))
+    await tracker.flush()
+
+    assert (await _progress(storage))["quest_1"] == 5
+
+
+def test_won_battles_count_towards_kill_quests(api):
+    progress = next(q["progress"] for q in api.get("/api/quests/p1").json() if q["questId"] == "quest_1")
+
+    victories = 0
+    for _ in range(10):
+        battle = api.post("/api/battle/start", json={"userId": "p1", "enemyId": "enemy_1"}).json()
+        while True:
+            result = api.post("/api/battle/action",
+                              json={"userId": "p1", "battleId": battle["_id"], "action": "attack"}).json()
+            if result["battleEnded"]:
+                break
+        victories += result["victory"]
+        if victories:
+            break
+        api.put("/api/character/p1", json={"health": 100})
+    assert victories
+    api.portal.call(server.quest_progress.flush)
+
+    quest = next(q for q in api.get("/api/quests/p1").json() if q["questId"] == "quest_1")
+    assert quest["progress"] == progress + victories
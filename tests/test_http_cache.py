@@ -0,0 +1,48 @@
+import pytest
+
+from http_cache import CatalogResponseCache, etag_matches
+
+
+@pytest.mark.parametrize("path", ["/api/enemies", "/api/shop/items"])
+def test_conditional_get(api, path):
+    first = api.get(path)
+    etag = first.headers["ETag"]
+    assert first.status_code == 200
+    assert first.headers["Cache-Control"] == "no-cache"
+
+    again = api.get(path, headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.content == b""
+    assert again.headers["ETag"] == etag
+
+    assert api.get(path, headers={"If-None-Match": f'"other", W/{etag}'}).status_code == 304
+    changed = api.get(path, headers={"If-None-Match": '"other"'})
+    assert changed.status_code == 200
+    assert changed.content == first.content
+
+
+@pytest.mark.parametrize("header, matches", [
+    (None, False),
+    ('"abc"', True),
+    ('W/"abc"', True),
+    ('"x", "abc"', True),
+    ("*", True),
+    ('"abcd"', False),
+])
+def test_etag_matches(header, matches):
+    assert etag_matches(header, '"abc"') == matches
+
+
+@pytest.mark.anyio
+async def test_new_catalog_version_changes_the_etag(make_storage):
+    db = await make_storage("memory")
+    cache = CatalogResponseCache()
+
+    body, etag = await cache.get("enemies", db.catalog, db.get_all_enemies)
+    assert await cache.get("enemies", db.catalog, db.get_all_enemies) == (body, etag)
+
+    db.enemies["enemy_1"]["name"] = "Renamed"
+    db.catalog.invalidate()
+    new_body, new_etag = await cache.get("enemies", db.catalog, db.get_all_enemies)
+    assert new_etag != etag
+    assert b"Renamed" in new_body
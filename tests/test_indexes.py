@@ -0,0 +1,46 @@
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+from indexes import REQUIRED_INDEXES, IndexManager, IndexSpec
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_missing_indexes_are_created_once():
+    db = AsyncMongoMockClient()["rpg_test"]
+
+    created = await IndexManager(db).ensure()
+    assert len(created.created) == len(REQUIRED_INDEXES)
+    assert not created.missing
+
+    again = await IndexManager(db).ensure()
+    assert not again.created and not again.missing
+    assert len(again.present) == len(REQUIRED_INDEXES)
+
+
+class _Collection:
+    def __init__(self, info):
+        self.info = info
+
+    async def index_information(self):
+        return self.info
+
+
+async def test_other_index_kinds_are_tolerated():
+    db = {"characters": _Collection({
+        "_id_": {"key": [("_id", 1)]},
+        "userId_hashed": {"key": [("userId", "hashed")]},
+        "name_text": {"key": [("_fts", "text"), ("_ftsx", 1)]},
+        "home_2dsphere": {"key": [("home", "2dsphere")]},
+        "gold_rank": {"key": [("gold", -1.0), ("_id", 1.0)]},
+    })}
+    specs = [
+        IndexSpec("characters", (("gold", -1), ("_id", 1)), "gold_rank"),
+        IndexSpec("characters", (("userId", "hashed"),), "userId_hashed"),
+        IndexSpec("characters", (("level", -1), ("_id", 1)), "level_rank"),
+    ]
+
+    report = await IndexManager(db, specs).verify()
+
+    assert report.present == ["characters.gold_rank", "characters.userId_hashed"]
+    assert report.missing == ["characters.level_rank"]
@@ -0,0 +1,86 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+LEGACY_ITEMS = [
+    {"itemId": "item_7", "quantity": 2, "equipped": False},
+    {"itemId": "item_1", "quantity": 1, "equipped": True},
+]
+
+
+def _quantities(inventory):
+    return {entry["_id"]: entry["quantity"] for entry in inventory}
+
+
+async def test_add_and_remove_items(storage):
+    before = _quantities(await storage.get_inventory("p1"))
+
+    await storage.add_items_to_inventory("p1", {"item_7": 2, "item_5": 1})
+    assert await storage.remove_items_from_inventory("p1", {"item_6": 1})
+    assert not await storage.remove_items_from_inventory("p1", {"item_6": 100, "item_7": 1})
+
+    after = _quantities(await storage.get_inventory("p1"))
+    assert after["item_7"] == before["item_7"] + 2
+    assert after["item_5"] == 1
+    assert after["item_6"] == before["item_6"] - 1
+
+
+async def test_emptied_slot_is_dropped(storage):
+    held = _quantities(await storage.get_inventory("p1"))["item_8"]
+
+    assert await storage.remove_items_from_inventory("p1", {"item_8": held})
+
+    assert "item_8" not in _quantities(await storage.get_inventory("p1"))
+
+
+async def test_keyed_layout_changes_slots_in_place(make_storage):
+    db = await make_storage("mongodb")
+    await db.get_inventory("p1")
+
+    await db.add_items_to_inventory("p1", {"item_7": 2})
+    await db.remove_items_from_inventory("p1", {"item_8": 1})
+
+    inventory = await db.inventories.find_one({"userId": "p1"})
+    assert "items" not in inventory
+    assert inventory["slots"]["item_7"] == {"quantity": 5, "equipped": False}
+    assert "item_8" not in inventory["slots"]
+
+
+async def test_legacy_inventory_is_read_and_migrated_on_write(make_storage):
+    db = await make_storage("mongodb")
+    await db.inventories.insert_one({"_id": "inv_old", "userId": "old", "items": LEGACY_ITEMS})
+
+    assert _quantities(await db.get_inventory("old")) == {"item_7": 2, "item_1": 1}
+    assert await db.remove_items_from_inventory("old", {"item_7": 1})
+
+    inventory = await db.inventories.find_one({"userId": "old"})
+    assert "items" not in inventory
+    assert inventory["slots"] == {
+        "item_7": {"quantity": 1, "equipped": False},
+        "item_1": {"quantity": 1, "equipped": True},
+    }
+
+
+async def test_migration_keeps_a_racing_write(make_storage):
+    db = await make_storage("mongodb")
+    await db.inventories.insert_one({"_id": "inv_old", "userId": "old", "items": LEGACY_ITEMS})
+    stale = await db.inventories.find_one({"userId": "old"})
+
+    # Written after the migration read the document, so its compare-and-swap must fail and re-read
+    await db.inventories.update_one({"_id": "inv_old"}, {"$push": {"items": {"itemId": "item_6", "quantity": 4}}})
+    assert await db._migrate_inventory("old", stale)
+
+    inventory = await db.inventories.find_one({"userId": "old"})
+    assert inventory["slots"]["item_6"]["quantity"] == 4
+    assert not await db._migrate_inventory("old")
+
+
+async def test_migrate_inventories(make_storage):
+    db = await make_storage("mongodb")
+    await db.get_inventory("p1")
+    for user_id in ("old1", "old2"):
+        await db.inventories.insert_one({"_id": f"inv_{user_id}", "userId": user_id, "items": LEGACY_ITEMS})
+
+    assert await db.migrate_inventories() == 2
+    assert await db.migrate_inventories() == 0
+    assert not await db.inventories.count_documents({"items": {"$exists": True}})
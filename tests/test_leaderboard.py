@@ -0,0 +1,80 @@
+import pytest
+
+from leaderboard import LeaderboardCache, estimate_rank
+from models import CharacterUpdate
+
+PLAYERS = 30
+
+
+def _seed(api):
+    # Gold ties every third player, so ties are broken by user id
+    for i in range(PLAYERS):
+        assert api.put(f"/api/character/u{i:02d}", json={"gold": 1000 + 10 * (i // 3)}).status_code == 200
+
+
+def _expected():
+    players = [(1000 + 10 * (i // 3), f"u{i:02d}") for i in range(PLAYERS)]
+    return [user_id for _, user_id in sorted(players, key=lambda p: (-p[0], p[1]))]
+
+
+def test_cursor_pages_walk_the_whole_ranking(api):
+    _seed(api)
+
+    seen, ranks, cursor = [], [], None
+    while True:
+        params = {"limit": 7, **({"cursor": cursor} if cursor else {})}
+        page = api.get("/api/leaderboard/gold", params=params).json()
+        seen += [entry["userId"] for entry in page["entries"]]
+        ranks += [entry["rank"] for entry in page["entries"]]
+        cursor = page["nextCursor"]
+        if cursor is None:
+            break
+
+    assert seen == _expected()
+    assert ranks == list(range(1, PLAYERS + 1))
+
+
+@pytest.mark.parametrize("cursor", ["not-a-cursor", "WzFd"])
+def test_bad_cursor_is_rejected(api, cursor):
+    response = api.get("/api/leaderboard/gold", params={"cursor": cursor})
+    assert response.status_code == 400
+
+
+def test_around_lists_the_neighbours(api):
+    _seed(api)
+    ranking = _expected()
+
+    page = api.get("/api/leaderboard/gold/around/u10", params={"radius": 2}).json()
+
+    rank = ranking.index("u10") + 1
+    assert page["rank"] == rank
+    assert not page["approximate"]
+    assert [entry["userId"] for entry in page["entries"]] == ranking[rank - 3:rank + 2]
+    assert [entry["rank"] for entry in page["entries"]] == list(range(rank - 2, rank + 3))
+
+
+def test_estimate_rank():
+    histogram = [(900, 1000, 10), (500, 899, 40), (0, 499, 50)]
+
+    assert estimate_rank(histogram, 1000) == 1
+    assert estimate_rank(histogram, 899) == 11
+    assert estimate_rank(histogram, 700) == 11 + 40 * 199 // 400
+    assert estimate_rank(histogram, -1) == 101
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("backend, exact", [("memory", True), ("mongodb", False)])
+async def test_ranks_below_the_board(make_storage, backend, exact):
+    db = await make_storage(backend)
+    for i in range(250):
+        await db.update_character(f"u{i:03d}", CharacterUpdate(gold=i * 5))
+    boards = LeaderboardCache(db, size=10, histogram_buckets=5)
+
+    assert await boards.rank("gold", 249 * 5, "u249") == (1, True)
+    assert await boards.rank("gold", 240 * 5, "u240") == (10, True)
+
+    rank, is_exact = await boards.rank("gold", 100 * 5, "u100")
+    assert is_exact == exact
+    # Only a sample of the players is read on MongoDB
+    assert abs(rank - 150) <= (0 if exact else 60)
+    assert rank > 10
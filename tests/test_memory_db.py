@@ -0,0 +1,86 @@
+import threading
+
+import pytest
+
+from memory_db import InMemoryGameDatabase
+from models import CharacterUpdate
+
+pytestmark = pytest.mark.anyio
+
+
+def _without_timestamps(value):
+    if isinstance(value, dict):
+        return {key: _without_timestamps(v) for key, v in value.items() if not key.endswith("At")}
+    if isinstance(value, list):
+        return [_without_timestamps(v) for v in value]
+    return value
+
+
+async def _play(db):
+    """A short session touching every kind of write; returns what the player ends up with"""
+    await db.update_character("p1", CharacterUpdate(health=40))
+    await db.restore_health("p1", 30)
+    await db.restore_mana("p1", -20)
+    await db.buy_items("p1", {"item_8": 1, "item_6": 2}, 200)
+    await db.buy_items("p1", {"item_9": 50}, 10 ** 6)
+    await db.sell_items("p1", {"item_7": 3}, 30)
+    await db.sell_items("p1", {"item_7": 1}, 10)
+    await db.add_quest_progress({("p1", "quest_2"): 3}, {})
+    await db.complete_quest("p1", await db.get_quest("quest_2"))
+    await db.complete_quest("p1", await db.get_quest("quest_2"))
+
+    character = await db.get_character("p1")
+    return _without_timestamps({
+        "character": character.model_dump(by_alias=True),
+        "inventory": await db.get_inventory("p1"),
+        "quests": await db.get_user_quests("p1"),
+        "page": (await db.inventory_page("p1", limit=2, item_ids=["item_6", "item_7", "item_8"]))[0],
+    })
+
+
+@pytest.mark.parametrize("backend", ["mongodb", "write_behind"])
+async def test_backends_agree(make_storage, backend):
+    memory = await make_storage("memory")
+    other = await make_storage(backend)
+
+    assert await _play(other) == await _play(memory)
+
+
+async def test_snapshot_round_trip(tmp_path):
+    path = str(tmp_path / "snapshot.json")
+    db = InMemoryGameDatabase(snapshot_path=path)
+    await db.initialize_game_data()
+    await db.buy_items("p1", {"item_8": 2}, 100)
+    await db.add_quest_progress({("p1", "quest_1"): 1}, {})
+    await db.save_snapshot()
+
+    restored = InMemoryGameDatabase(snapshot_path=path)
+    await restored.initialize_game_data()
+
+    # Snapshots keep timestamps to the millisecond
+    assert _without_timestamps(restored.characters) == _without_timestamps(db.characters)
+    assert restored.inventories == db.inventories
+    assert _without_timestamps(restored.player_quests) == _without_timestamps(db.player_quests)
+    assert await restored.leaderboard_page("gold", 10) == await db.leaderboard_page("gold", 10)
+
+
+async def test_snapshot_is_encoded_off_the_loop(tmp_path, monkeypatch):
+    db = InMemoryGameDatabase(snapshot_path=str(tmp_path / "snapshot.json"))
+    await db.initialize_game_data()
+    await db.get_character("p1")
+    write_snapshot = db._write_snapshot
+    threads = []
+
+    def record_thread(state):
+        threads.append(threading.current_thread())
+        # Writes made while the file is encoded do not reach the copy being written
+        db.characters["p1"]["gold"] = -1
+        write_snapshot(state)
+
+    monkeypatch.setattr(db, "_write_snapshot", record_thread)
+    await db.save_snapshot()
+
+    assert threads and threads[0] is not threading.main_thread()
+    restored = InMemoryGameDatabase(snapshot_path=db.snapshot_path)
+    await restored.initialize_game_data()
+    assert restored.characters["p1"]["gold"] == 850
@@ -0,0 +1,53 @@
+def _walk(api, path, **params):
+    """Every page of a listing, following X-Next-Cursor"""
+    pages, cursor = [], None
+    while True:
+        response = api.get(path, params={**params, **({"cursor": cursor} if cursor else {})})
+        assert response.status_code == 200
+        pages.append(response.json())
+        cursor = response.headers.get("X-Next-Cursor")
+        if cursor is None:
+            return pages
+
+
+def test_inventory_pages_cover_the_inventory_once(api):
+    inventory = api.get("/api/inventory/p1").json()
+
+    pages = _walk(api, "/api/inventory/p1", limit=2)
+
+    assert [len(page) for page in pages] == [2, 2, 1]
+    entries = [entry for page in pages for entry in page]
+    assert [entry["itemId"] for entry in entries] == sorted(entry["itemId"] for entry in inventory)
+    assert sorted(entries, key=lambda e: e["_id"]) == sorted(inventory, key=lambda e: e["_id"])
+
+
+def test_inventory_filter_and_projection(api):
+    pages = _walk(api, "/api/inventory/p1", limit=10, type="consumable", fields="quantity")
+
+    entries = [entry for page in pages for entry in page]
+    assert [entry["itemId"] for entry in entries] == ["item_6", "item_7"]
+    assert all(set(entry) == {"itemId", "quantity"} for entry in entries)
+
+
+def test_empty_filtered_page_has_no_cursor(api):
+    response = api.get("/api/inventory/p1", params={"limit": 5, "rarity": "legendary"})
+
+    assert response.status_code == 200
+    assert response.json() == []
+    assert "X-Next-Cursor" not in response.headers
+
+
+def test_quest_pages_and_filters(api):
+    quests = api.get("/api/quests/p1").json()
+
+    pages = _walk(api, "/api/quests/p1", limit=1)
+    assert [quest["_id"] for page in pages for quest in page] == sorted(quest["_id"] for quest in quests)
+
+    active = _walk(api, "/api/quests/p1", limit=5, active="true", fields="progress")
+    assert sorted(quest["questId"] for page in active for quest in page) == ["quest_1", "quest_2"]
+    assert _walk(api, "/api/quests/p1", limit=5, active="false") == [[]]
+
+
+def test_bad_listing_cursor_is_rejected(api):
+    assert api.get("/api/inventory/p1", params={"limit": 2, "cursor": "%%%"}).status_code == 400
+    assert api.get("/api/quests/p1", params={"cursor": "WzEsMl0="}).status_code == 400
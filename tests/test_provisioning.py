@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from database import STARTER_QUESTS, GameDatabase
+
+pytestmark = pytest.mark.anyio
+
+
+async def _counts(db, user_id):
+    return (
+        await db.characters.count_documents({"_id": user_id}),
+        await db.inventories.count_documents({"userId": user_id}),
+        await db.player_quests.count_documents({"userId": user_id}),
+    )
+
+
+async def test_concurrent_first_requests_provision_once(storage):
+    await asyncio.gather(*(
+        read("new") for read in (storage.get_character, storage.get_inventory, storage.get_user_quests) * 5
+    ))
+
+    assert len(await storage.get_inventory("new")) == 5
+    assert len(await storage.get_user_quests("new")) == len(STARTER_QUESTS)
+
+
+async def test_concurrent_calls_share_one_run(make_storage, monkeypatch):
+    db = await make_storage("mongodb")
+    provision = db._provision_player
+    runs = []
+
+    async def counted(user_id):
+        runs.append(user_id)
+        return await provision(user_id)
+
+    monkeypatch.setattr(db, "_provision_player", counted)
+    results = await asyncio.gather(*(db.provision_player("new") for _ in range(5)))
+
+    assert runs == ["new"]
+    assert all(result == results[0] for result in results)
+
+
+async def test_processes_racing_on_one_database():
+    client = AsyncMongoMockClient()
+    processes = [GameDatabase(client, "rpg_test") for _ in range(3)]
+    await processes[0].initialize_game_data()
+    await processes[0].ensure_indexes()
+
+    await asyncio.gather(*(db.provision_player("new") for db in processes for _ in range(3)))
+
+    assert await _counts(processes[0], "new") == (1, 1, len(STARTER_QUESTS))
+
+
+async def test_provisioning_keeps_existing_state(make_storage):
+    db = await make_storage("mongodb")
+    await db.spend_gold("p1", 100)
+    await db.add_quest_progress({("p1", "quest_1"): 1}, {})
+
+    await db.provision_player("p1")
+
+    assert (await db.get_character("p1")).gold == 750
+    assert {q["questId"]: q["progress"] for q in await db.get_user_quests("p1")}["quest_1"] == 4
+
+
+async def test_lost_upsert_race_is_retried(make_storage, monkeypatch):
+    db = await make_storage("mongodb")
+    bulk_write = db.player_quests.bulk_write
+    calls = []
+
+    async def lose_once(*args, **kwargs):
+        calls.append(1)
+        if len(calls) == 1:
+            raise BulkWriteError({"writeErrors": [{"code": 11000, "index": 0}], "writeConcernErrors": []})
+        return await bulk_write(*args, **kwargs)
+
+    monkeypatch.setattr(db.player_quests, "bulk_write", lose_once)
+    await db.provision_player("new")
+
+    assert len(calls) == 2
+    assert await _counts(db, "new") == (1, 1, len(STARTER_QUESTS))
+
+
+@pytest.mark.parametrize("error", [
+    BulkWriteError({"writeErrors": [{"code": 121, "index": 0}], "writeConcernErrors": []}),
+    DuplicateKeyError("lost again", 11000),
+])
+async def test_other_or_repeated_errors_are_raised(make_storage, monkeypatch, error):
+    db = await make_storage("mongodb")
+
+    async def fail(*args, **kwargs):
+        raise error
+
+    monkeypatch.setattr(db.player_quests, "bulk_write", fail)
+    with pytest.raises(type(error)):
+        await db.provision_player("new")
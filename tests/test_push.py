@@ -0,0 +1,183 @@
+import asyncio
+
+import pytest
+
+import database
+from database import _owner_from_key
+from push import PushHub
+
+pytestmark = pytest.mark.anyio
+
+
+class _Socket:
+    """Stands in for a player's websocket, collecting what it is sent"""
+
+    def __init__(self):
+        self.messages = asyncio.Queue()
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, message):
+        await self.messages.put(message)
+
+    async def close(self, code=1000):
+        pass
+
+
+class _Stream:
+    resume_token = None
+
+    def __init__(self, changes):
+        self.changes = changes
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.changes.get()
+
+
+class _ChangeFeed:
+    """Stands in for a MongoDB database, with a change stream fed from a queue"""
+
+    def __init__(self, db, failures=0):
+        self.db = db
+        self.changes = asyncio.Queue()
+        self.failures = failures
+        self.opened = []
+
+    def __getitem__(self, name):
+        return self.db[name]
+
+    def watch(self, pipeline, **kwargs):
+        self.opened.append(kwargs)
+        if self.failures:
+            self.failures -= 1
+            raise RuntimeError("connection reset")
+        return _Stream(self.changes)
+
+    def change(self, collection, document_id):
+        self.changes.put_nowait({"ns": {"coll": collection}, "documentKey": {"_id": document_id}})
+
+
+async def _until(condition, timeout=2.0):
+    async def wait():
+        while not condition():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(wait(), timeout)
+
+
+@pytest.mark.parametrize("collection, document_id, user_id", [
+    ("characters", "p1", "p1"),
+    ("inventories", "inv_p1", "p1"),
+    ("inventories", "inv_p_1", "p_1"),
+    ("player_quests", "pq_p1_2", "p1"),
+    ("player_quests", "pq_p_1_2", "p_1"),
+    ("player_quests", "quest_1", None),
+    ("inventories", "legacy", None),
+    ("battles", "p1", None),
+])
+def test_owner_is_derived_from_document_keys(collection, document_id, user_id):
+    assert _owner_from_key(collection, document_id) == user_id
+
+
+async def test_change_stream_finds_players_from_keys_and_survives_errors(make_storage, monkeypatch):
+    monkeypatch.setattr(database, "WATCH_RETRY_DELAY", 0.01)
+    db = await make_storage("mongodb")
+    await db.inventories.insert_one({"_id": "legacy", "userId": "p4", "slots": {}})
+    feed = db.db = _ChangeFeed(db.db, failures=1)
+    published = []
+    db.add_change_listener(lambda user_id, parts: published.append((user_id, parts)))
+
+    db.follow_changes(True)
+    feed.change("characters", "p1")
+    feed.change("inventories", "inv_p2")
+    feed.change("player_quests", "pq_p3_1")
+    feed.change("inventories", "legacy")
+    await _until(lambda: len(published) == 4)
+
+    assert published == [
+        ("p1", ("character",)), ("p2", ("inventory",)), ("p3", ("quests",)), ("p4", ("inventory",))
+    ]
+    # Reopened after the failure, and never asked to fetch whole documents
+    assert len(feed.opened) == 2
+    assert all("full_document" not in kwargs for kwargs in feed.opened)
+
+    db.follow_changes(False)
+    assert db._watch_task is None
+
+
+async def test_changes_are_followed_only_while_sockets_are_open(make_storage, monkeypatch):
+    db = await make_storage("memory")
+    follows = []
+    monkeypatch.setattr(db, "follow_changes", follows.append)
+    hub = PushHub(db)
+    first, second = _Socket(), _Socket()
+
+    await hub.connect("p1", first)
+    await hub.connect("p2", second)
+    assert follows == [True]
+
+    hub.disconnect("p1", first)
+    assert follows == [True]
+    hub.disconnect("p2", second)
+    assert follows == [True, False]
+
+
+def test_socket_gets_a_snapshot_then_diffs(api):
+    with api.websocket_connect("/ws/p1") as socket:
+        snapshot = socket.receive_json()
+        assert snapshot["type"] == "snapshot"
+        assert snapshot["character"]["_id"] == "p1"
+        gold = snapshot["character"]["gold"]
+
+        api.put("/api/character/p1", json={"name": "Renamed"})
+        message = socket.receive_json()
+        assert message["type"] == "character"
+        assert message["changes"].keys() == {"name", "updatedAt"} and message["changes"]["name"] == "Renamed"
+
+        assert api.post("/api/shop/buy", json={"userId": "p1", "itemId": "item_1"}).status_code == 200
+        messages = {message["type"]: message for message in (socket.receive_json(), socket.receive_json())}
+        assert messages["character"]["changes"]["gold"] == gold - 200
+        assert [entry["itemId"] for entry in messages["inventory"]["updated"]] == ["item_1"]
+        assert messages["inventory"]["removed"] == []
+
+
+async def test_changes_made_while_the_snapshot_loads_are_pushed_after_it(make_storage):
+    db = await make_storage("memory")
+    gold = (await db.get_character("p1")).gold
+    hub = PushHub(db, debounce=0)
+    db.add_change_listener(hub.changed)
+    hub.start()
+
+    load, loaded, release = hub._load, asyncio.Event(), asyncio.Event()
+
+    async def slow_snapshot(user_id, parts):
+        state = await load(user_id, parts)
+        if not loaded.is_set():
+            loaded.set()
+            await release.wait()
+        return state
+
+    hub._load = slow_snapshot
+    socket = _Socket()
+    connecting = asyncio.create_task(hub.connect("p1", socket))
+    await loaded.wait()
+    # The snapshot has been read; this change is pushed while it is still on its way
+    await db.spend_gold("p1", 100)
+    await _until(lambda: hub._subscribers["p1"][0].missed)
+    release.set()
+    await connecting
+
+    snapshot = await socket.messages.get()
+    assert snapshot["character"]["gold"] == gold
+    diff = await asyncio.wait_for(socket.messages.get(), 2)
+    assert diff["type"] == "character" and diff["changes"]["gold"] == gold - 100
+    await hub.stop()
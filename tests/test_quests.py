@@ -0,0 +1,63 @@
+import asyncio
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def _finishable_quest(db):
+    """quest_2, with the progress needed to complete it"""
+    await db.get_user_quests("p1")
+    await db.add_quest_progress({("p1", "quest_2"): 3}, {})
+    return await db.get_quest("quest_2")
+
+
+def _quantity(inventory, item_id):
+    return next((entry["quantity"] for entry in inventory if entry["_id"] == item_id), 0)
+
+
+async def test_concurrent_completions_pay_once(storage):
+    quest = await _finishable_quest(storage)
+    gold = (await storage.get_character("p1")).gold
+    items = _quantity(await storage.get_inventory("p1"), quest.reward.item)
+
+    results = await asyncio.gather(*(storage.complete_quest("p1", quest) for _ in range(10)))
+
+    assert [paid for _, paid in filter(None, results)].count(True) == 1
+    assert (await storage.get_character("p1")).gold == gold + quest.reward.gold
+    assert _quantity(await storage.get_inventory("p1"), quest.reward.item) == items + 1
+    assert await storage.complete_quest("p1", quest) is None
+
+
+async def test_interrupted_payout_is_finished_once(storage, monkeypatch):
+    quest = await _finishable_quest(storage)
+    gold = (await storage.get_character("p1")).gold
+
+    async def unavailable(*args, **kwargs):
+        raise RuntimeError("storage unavailable")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(storage, "grant_quest_rewards", unavailable)
+        with pytest.raises(RuntimeError):
+            await storage.complete_quest("p1", quest)
+
+    # The quest stays claimable until its reward is paid
+    character, paid = await storage.complete_quest("p1", quest)
+    assert paid
+    assert character.gold == gold + quest.reward.gold
+    assert await storage.complete_quest("p1", quest) is None
+    assert (await storage.get_character("p1")).gold == gold + quest.reward.gold
+
+
+async def test_reward_writes_are_idempotent(storage):
+    quest = await _finishable_quest(storage)
+    claim_id = await storage.claim_player_quest("p1", quest.id)
+    gold = (await storage.get_character("p1")).gold
+
+    assert await storage.grant_quest_rewards("p1", claim_id, gold=100) is not None
+    assert await storage.grant_quest_rewards("p1", claim_id, gold=100) is None
+    assert await storage.add_quest_items("p1", claim_id, {"item_5": 1})
+    assert not await storage.add_quest_items("p1", claim_id, {"item_5": 1})
+
+    assert (await storage.get_character("p1")).gold == gold + 100
+    assert _quantity(await storage.get_inventory("p1"), "item_5") == 1
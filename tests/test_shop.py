@@ -0,0 +1,44 @@
+import pytest
+
+
+@pytest.mark.parametrize("path, body", [
+    ("/api/shop/buy", {"userId": "p1", "itemId": "item_6", "quantity": -5}),
+    ("/api/shop/sell", {"userId": "p1", "itemId": "item_6", "quantity": -1}),
+    ("/api/shop/cart/buy", {"userId": "p1", "items": [{"itemId": "item_6", "quantity": 0}]}),
+    ("/api/shop/cart/sell", {"userId": "p1", "items": [{"itemId": "item_6", "quantity": -2}]}),
+    ("/api/inventory/p1/use", {"userId": "p1", "itemId": "item_6", "quantity": 0}),
+])
+def test_non_positive_quantities_are_rejected(api, path, body):
+    character = api.get("/api/character/p1").json()
+    inventory = api.get("/api/inventory/p1").json()
+
+    assert api.post(path, json=body).status_code == 422
+
+    assert api.get("/api/character/p1").json() == character
+    assert api.get("/api/inventory/p1").json() == inventory
+
+
+def test_cart_buy_and_sell(api):
+    gold = api.get("/api/character/p1").json()["gold"]
+
+    bought = api.post("/api/shop/cart/buy", json={"userId": "p1", "items": [
+        {"itemId": "item_6", "quantity": 2}, {"itemId": "item_7", "quantity": 1}, {"itemId": "item_6", "quantity": 1},
+    ]})
+    assert bought.status_code == 200
+    spent = gold - bought.json()["gold"]
+    assert spent > 0
+
+    quantities = {entry["_id"]: entry["quantity"] for entry in api.get("/api/inventory/p1").json()}
+    assert quantities["item_6"] == 5 + 3
+    assert quantities["item_7"] == 3 + 1
+
+    sold = api.post("/api/shop/cart/sell", json={"userId": "p1", "items": [
+        {"itemId": "item_6", "quantity": 8}, {"itemId": "item_7", "quantity": 5},
+    ]})
+    assert sold.status_code == 400
+    assert {entry["_id"]: entry["quantity"] for entry in api.get("/api/inventory/p1").json()} == quantities
+
+
+def test_unknown_cart_item_is_rejected(api):
+    response = api.post("/api/shop/cart/buy", json={"userId": "p1", "items": [{"itemId": "nope", "quantity": 1}]})
+    assert response.status_code == 404